@@ -1,9 +1,49 @@
 import os
 import random
 import json
-import requests
 from datetime import datetime
 
+try:
+    from .enhancer_ratelimit import call_with_backoff, estimate_tokens
+except ImportError:
+    from enhancer_ratelimit import call_with_backoff, estimate_tokens
+
+try:
+    from .enhancer_local import (
+        OLLAMA_KEEP_ALIVE, chat_messages, completion_prompt,
+        llamacpp_cache_fields, ollama_timings, llamacpp_timings, record_response,
+    )
+except ImportError:
+    from enhancer_local import (
+        OLLAMA_KEEP_ALIVE, chat_messages, completion_prompt,
+        llamacpp_cache_fields, ollama_timings, llamacpp_timings, record_response,
+    )
+
+try:
+    from .enhancer_clients import read_api_keys, openai_chat, cohere_client, gemini_model
+    from .enhancer_async import ASYNC_NODES, run_node, http_post, RequestCancelled
+except ImportError:
+    from enhancer_clients import read_api_keys, openai_chat, cohere_client, gemini_model
+    from enhancer_async import ASYNC_NODES, run_node, http_post, RequestCancelled
+
+try:
+    from .enhancer_telemetry import track, note_usage_from, stats_json, output_connected
+except ImportError:
+    from enhancer_telemetry import track, note_usage_from, stats_json, output_connected
+
+try:
+    from .enhancer_budget import governor
+    from .enhancer_singleflight import singleflight
+    from .enhancer_residency import residency
+    from .node_state import node_state
+    from .history_segments import history_log
+except ImportError:
+    from enhancer_budget import governor
+    from enhancer_singleflight import singleflight
+    from enhancer_residency import residency
+    from node_state import node_state
+    from history_segments import history_log
+
 
 class PromptBuilderNode:
     """
@@ -163,12 +203,15 @@ class PromptBuilderNode:
                 # Ollama settings
                 "ollama_host": ("STRING", {"default": "http://192.168.1.1:11434"}),
                 "ollama_model": ("STRING", {"default": "llama3.2"}),
-            }
+            },
+            # the graph being run: the costly stats sections are built only when "stats" is linked
+            "hidden": {"graph": "PROMPT", "node_id": "UNIQUE_ID"},
         }
 
-    RETURN_TYPES = ("STRING",)
-    RETURN_NAMES = ("prompt",)
-    FUNCTION = "generate_prompt"
+    RETURN_TYPES = ("STRING", "STRING")
+    RETURN_NAMES = ("prompt", "stats")
+    # async on ComfyUI versions that support it (see enhancer_async)
+    FUNCTION = "generate_prompt_async" if ASYNC_NODES else "generate_prompt"
     CATEGORY = "Prompt Creator"
 
     # ===== shared helpers (kept compatible with PromptCreatorNode behavior) =====
@@ -190,15 +233,8 @@ class PromptBuilderNode:
             }
 
     def _read_api_keys(self, base_path):
-        keys_path = os.path.join(base_path, "api_keys.txt")
-        keys = {}
-        if os.path.exists(keys_path):
-            with open(keys_path, "r", encoding="utf-8") as f:
-                for line in f:
-                    if "=" in line:
-                        k, v = line.strip().split("=", 1)
-                        keys[k.strip()] = v.strip()
-        return keys
+        # cached, re-parsed only when api_keys.txt changes
+        return read_api_keys(base_path)
 
     def _identity_profiles(self):
         identities_path = os.path.join(os.path.dirname(__file__), "identities.json")
@@ -224,48 +260,57 @@ class PromptBuilderNode:
 
     # ===== enhancer backends (same behavior as PromptCreatorNode) =====
 
-    def _enhance_with_ollama(self, host, model, system_prompt, user_prompt):
-        r = requests.post(f"{host}/api/chat", json={
+    def _enhance_with_ollama(self, host, model, system_prompt, user_prompt, budget=None):
+        payload = {
             "model": model,
-            "messages": [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            "stream": False
-        }, timeout=120)
-        r.raise_for_status()
-        return r.json()["message"]["content"].strip()
-
-    def _enhance_with_openai(self, base_path, system_prompt, user_prompt):
-        import openai
+            "messages": chat_messages(system_prompt, user_prompt),
+            "stream": False,
+            "keep_alive": OLLAMA_KEEP_ALIVE,
+        }
+        if budget:
+            payload["options"] = {"num_predict": budget.max_tokens, "stop": budget.stop}
+        with residency.slot(host, model) as slot:
+            r = http_post("ollama", f"{host}/api/chat", json=payload, timeout=120)
+            r.raise_for_status()
+            j = r.json()
+            timings = ollama_timings(j)
+            if timings:
+                slot.loaded(timings["load_ms"])
+        record_response(r, "ollama", model, timings, tag="PromptBuilder")
+        return j["message"]["content"].strip()
+
+    def _enhance_with_openai(self, base_path, system_prompt, user_prompt, budget=None):
         keys = self._read_api_keys(base_path)
-        openai.api_key = keys.get("openai", "")
-        resp = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ]
+        limits = {"max_tokens": budget.max_tokens, "stop": budget.stop} if budget else {}
+        content = call_with_backoff(
+            "openai",
+            lambda: openai_chat(
+                keys.get("openai", ""),
+                "gpt-3.5-turbo",
+                chat_messages(system_prompt, user_prompt),
+                **limits
+            ),
+            est_tokens=estimate_tokens(system_prompt, user_prompt, max_output=budget.max_tokens if budget else 400),
         )
-        return resp.choices[0].message.content.strip()
+        return content.strip()
 
-    def _enhance_with_llamacpp(self, host, system_prompt, user_prompt, temperature=0.7, top_p=0.9, n_predict=220):
+    def _enhance_with_llamacpp(self, host, system_prompt, user_prompt, temperature=0.7, top_p=0.9, n_predict=220, stop=None):
         host = host.rstrip("/")
 
         # Try OpenAI compatible endpoint
         try:
-            r = requests.post(
+            r = http_post(
+                "llamacpp",
                 f"{host}/v1/chat/completions",
                 json={
                     "model": "llama",
-                    "messages": [
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": user_prompt},
-                    ],
+                    "messages": chat_messages(system_prompt, user_prompt),
                     "temperature": float(temperature),
                     "top_p": float(top_p),
                     "max_tokens": int(n_predict),
+                    "stop": stop or [],
                     "stream": False,
+                    **llamacpp_cache_fields(system_prompt),
                 },
                 timeout=120,
             )
@@ -279,19 +324,23 @@ class PromptBuilderNode:
                 )
                 content = (content or "").strip()
                 if content:
+                    record_response(r, "llamacpp", j.get("model"), llamacpp_timings(j), tag="PromptBuilder")
                     return content
         except Exception:
             pass
 
         # Fallback
-        r = requests.post(
+        r = http_post(
+            "llamacpp",
             f"{host}/completion",
             json={
-                "prompt": f"{system_prompt}\n\n{user_prompt}",
+                "prompt": completion_prompt(system_prompt, user_prompt),
                 "temperature": float(temperature),
                 "top_p": float(top_p),
                 "n_predict": int(n_predict),
+                "stop": stop or [],
                 "stream": False,
+                **llamacpp_cache_fields(system_prompt),
             },
             timeout=120,
         )
@@ -300,9 +349,10 @@ class PromptBuilderNode:
         content = (j.get("content") or j.get("completion") or "").strip()
         if not content:
             raise RuntimeError(f"llama.cpp returned no content. Keys: {list(j.keys())}")
+        record_response(r, "llamacpp", j.get("model"), llamacpp_timings(j), tag="PromptBuilder")
         return content
 
-    def _enhance_with_cohere(self, base_path, system_prompt, user_prompt):
+    def _enhance_with_cohere(self, base_path, system_prompt, user_prompt, budget=None):
         import re
         try:
             import cohere
@@ -317,7 +367,7 @@ class PromptBuilderNode:
             return user_prompt
 
         try:
-            co = cohere.ClientV2(api_key=api_key)
+            co = cohere_client(api_key)
         except Exception as e:
             print(f"[PromptBuilder] Cohere ClientV2 not available: {e}")
             return user_prompt
@@ -328,15 +378,21 @@ class PromptBuilderNode:
         )
 
         try:
-            resp = co.chat(
-                model="command-r-08-2024",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_msg},
-                ],
-                max_tokens=700,
-                temperature=0.9,
+            resp = call_with_backoff(
+                "cohere",
+                lambda: co.chat(
+                    model="command-r-08-2024",
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": user_msg},
+                    ],
+                    max_tokens=budget.max_tokens if budget else 700,
+                    temperature=0.9,
+                    **({"stop_sequences": budget.stop} if budget else {})
+                ),
+                est_tokens=estimate_tokens(system_prompt, user_msg, max_output=budget.max_tokens if budget else 700),
             )
+            note_usage_from(resp)
 
             content = ""
             if hasattr(resp, "message") and getattr(resp.message, "content", None):
@@ -355,19 +411,55 @@ class PromptBuilderNode:
             print(f"[PromptBuilder] Error calling Cohere chat: {e}")
             return user_prompt
 
-    def _enhance_with_gemini(self, base_path, system_prompt, user_prompt):
-        import google.generativeai as genai
+    def _enhance_with_gemini(self, base_path, system_prompt, user_prompt, budget=None):
         keys = self._read_api_keys(base_path)
-        genai.configure(api_key=keys.get("gemini", ""))
-        model = genai.GenerativeModel("models/gemini-2.5-pro")
+        model = gemini_model(keys.get("gemini", ""), "models/gemini-2.5-pro")
         txt = (
             f"SYSTEM: {system_prompt}\n"
             f"USER: {user_prompt}\n"
             "Return only the final prompt as a single paragraph."
         )
-        r = model.generate_content(txt)
+        generation_config = {"max_output_tokens": budget.max_tokens, "stop_sequences": budget.stop} if budget else None
+        r = call_with_backoff(
+            "gemini",
+            lambda: model.generate_content(txt, generation_config=generation_config),
+            est_tokens=estimate_tokens(txt, max_output=budget.max_tokens if budget else 400),
+        )
+        note_usage_from(r)
         return r.candidates[0].content.parts[0].text.strip()
 
+    def _run_enhancer(self, use_enhancer, base_path, ollama_host, ollama_model, system_prompt, user_prompt):
+        """Backend dispatch under telemetry; None means fallback to the seed prompt."""
+        model = ollama_model if use_enhancer == "ollama" else ""
+        # concurrent identical requests share one call
+        flight = ("PromptBuilder", use_enhancer, ollama_host, model, system_prompt, user_prompt)
+        return singleflight.do(flight, lambda: self._call_enhancer(
+            use_enhancer, base_path, ollama_host, ollama_model, system_prompt, user_prompt, model
+        ), tag="PromptBuilder")
+
+    def _call_enhancer(self, use_enhancer, base_path, ollama_host, ollama_model, system_prompt, user_prompt, model):
+        # no word inputs here: cap at the Creator's default range
+        budget = governor.plan_words(use_enhancer, model, "auto", 140, 220)
+        with track("PromptBuilder", use_enhancer, model) as call:
+            out = None
+            if use_enhancer == "ollama":
+                out = self._enhance_with_ollama(ollama_host, ollama_model, system_prompt, user_prompt, budget=budget)
+            elif use_enhancer == "llamacpp":
+                out = self._enhance_with_llamacpp(ollama_host, system_prompt, user_prompt, n_predict=budget.max_tokens, stop=budget.stop)
+            elif use_enhancer == "openai":
+                out = self._enhance_with_openai(base_path, system_prompt, user_prompt, budget=budget)
+            elif use_enhancer == "cohere":
+                out = self._enhance_with_cohere(base_path, system_prompt, user_prompt, budget=budget)
+            elif use_enhancer == "gemini":
+                out = self._enhance_with_gemini(base_path, system_prompt, user_prompt, budget=budget)
+
+            if not out or out == user_prompt:
+                call.fallback("no enhanced output")
+                return None
+            governor.observe(budget, out, call.tokens_out, tag="PromptBuilder")
+            call.estimate_tokens(system_prompt + user_prompt, out)
+            return out
+
     # ===== logging =====
 
     @staticmethod
@@ -381,10 +473,6 @@ class PromptBuilderNode:
         source="generated",
         node_version="1.0.0",
     ):
-        log_dir = os.path.join(os.path.dirname(__file__), "logs")
-        os.makedirs(log_dir, exist_ok=True)
-        log_path = os.path.join(log_dir, "prompt_history.jsonl")
-
         entry = {
             "timestamp": datetime.now().isoformat(timespec="seconds"),
             "json_world": json_name,
@@ -397,8 +485,7 @@ class PromptBuilderNode:
             "node_version": node_version
         }
 
-        with open(log_path, "a", encoding="utf-8") as f:
-            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        history_log.append(entry)
 
     # ===== builder logic =====
 
@@ -441,6 +528,10 @@ class PromptBuilderNode:
             return random.sample(candidates, min(int(multi_count), len(candidates)))
         return [random.choice(candidates)]
 
+    async def generate_prompt_async(self, **kwargs):
+        """Same as generate_prompt; interrupting the queue aborts the enhancer request."""
+        return await run_node(self.generate_prompt, **kwargs)
+
     def generate_prompt(
         self,
         json_name,
@@ -476,15 +567,17 @@ class PromptBuilderNode:
         multi_object_count,
         ollama_host,
         ollama_model,
+        graph=None,
+        node_id=None,
     ):
         base_path = os.path.dirname(__file__)
+        full_stats = output_connected(graph, node_id, 1)
         json_path = os.path.join(base_path, "JSON_DATA", json_name)
 
-        # history lock (same behavior)
-        history_path = os.path.join(base_path, "history", f"last_prompt_{json_name}.txt")
-        if lock_last_prompt == "yes" and os.path.exists(history_path):
-            with open(history_path, "r", encoding="utf-8") as f:
-                prompt = f.read().strip()
+        # history lock (same behavior, shared with Prompt Generator)
+        last_prompt = node_state.get("last_prompt", json_name) if lock_last_prompt == "yes" else None
+        if last_prompt is not None:
+            prompt = last_prompt.strip()
             self.log_prompt_run(
                 json_name=json_name,
                 enhancer_mode=enhancer_mode,
@@ -496,14 +589,14 @@ class PromptBuilderNode:
                 node_version="1.0.0"
             )
             print("[PromptBuilder] Prompt locked and loaded from history")
-            return (prompt,)
+            return (prompt, stats_json("PromptBuilder", full_stats))
 
         try:
             with open(json_path, "r", encoding="utf-8") as f:
                 data = json.load(f)
         except Exception as e:
             print(f"[PromptBuilder] Errore nel caricamento del JSON: {e}")
-            return ("",)
+            return ("", stats_json("PromptBuilder", full_stats))
 
         # Seed for deterministic "random" picks
         if seed:
@@ -637,16 +730,11 @@ class PromptBuilderNode:
             print("[PromptBuilder][DEBUG] user_prompt:", user_prompt)
 
             try:
-                if use_enhancer == "ollama":
-                    prompt = self._enhance_with_ollama(ollama_host, ollama_model, system_prompt, user_prompt)
-                elif use_enhancer == "llamacpp":
-                    prompt = self._enhance_with_llamacpp(ollama_host, system_prompt, user_prompt)
-                elif use_enhancer == "openai":
-                    prompt = self._enhance_with_openai(base_path, system_prompt, user_prompt)
-                elif use_enhancer == "cohere":
-                    prompt = self._enhance_with_cohere(base_path, system_prompt, user_prompt)
-                elif use_enhancer == "gemini":
-                    prompt = self._enhance_with_gemini(base_path, system_prompt, user_prompt)
+                enhanced = self._run_enhancer(use_enhancer, base_path, ollama_host, ollama_model, system_prompt, user_prompt)
+                if enhanced:
+                    prompt = enhanced
+            except RequestCancelled:
+                raise
             except Exception as e:
                 print(f"[PromptBuilder] Errore nell'enhancer ({use_enhancer}): {e}")
 
@@ -660,9 +748,7 @@ class PromptBuilderNode:
         if add_symbols == "yes":
             prompt = f"[{prompt}]"
 
-        os.makedirs(os.path.join(base_path, "history"), exist_ok=True)
-        with open(history_path, "w", encoding="utf-8") as f:
-            f.write(prompt.strip())
+        node_state.set("last_prompt", json_name, prompt.strip())
 
         print(f"[PromptBuilder] Prompt finale: {prompt}")
         self.log_prompt_run(
@@ -676,7 +762,7 @@ class PromptBuilderNode:
             node_version="1.0.0"
         )
 
-        return (prompt,)
+        return (prompt, stats_json("PromptBuilder", full_stats))
     # ===== ComfyUI mappings =====
 NODE_CLASS_MAPPINGS = {
     "PromptBuilderNode": PromptBuilderNode
@@ -1,9 +1,75 @@
 import os
+import time
 import random
 import json
-import requests
 from datetime import datetime
 
+try:
+    from .enhancer_ratelimit import call_with_backoff, estimate_tokens
+except ImportError:
+    from enhancer_ratelimit import call_with_backoff, estimate_tokens
+
+try:
+    from .enhancer_local import (
+        OLLAMA_KEEP_ALIVE, chat_messages, completion_prompt,
+        llamacpp_cache_fields, ollama_timings, llamacpp_timings, record_response,
+    )
+except ImportError:
+    from enhancer_local import (
+        OLLAMA_KEEP_ALIVE, chat_messages, completion_prompt,
+        llamacpp_cache_fields, ollama_timings, llamacpp_timings, record_response,
+    )
+
+try:
+    from .enhancer_clients import read_api_keys, openai_chat, cohere_client, gemini_model
+    from .enhancer_async import ASYNC_NODES, run_node, http_post, RequestCancelled
+except ImportError:
+    from enhancer_clients import read_api_keys, openai_chat, cohere_client, gemini_model
+    from enhancer_async import ASYNC_NODES, run_node, http_post, RequestCancelled
+
+try:
+    from .enhancer_telemetry import track, note_usage_from, stats_json, output_connected
+except ImportError:
+    from enhancer_telemetry import track, note_usage_from, stats_json, output_connected
+
+try:
+    from .enhancer_budget import governor, word_range
+except ImportError:
+    from enhancer_budget import governor, word_range
+
+try:
+    from .enhancer_cache import enhancer_cache, cache_key
+    from .enhancer_packing import pack_size, build_pack_prompt, split_pack_response, pack_stats
+    from .enhancer_prefetch import prefetcher
+    from .enhancer_fusion import fused_registry, fused_system_prompt
+    from .enhancer_similarity import similarity_cache
+    from .enhancer_singleflight import singleflight
+    from .enhancer_residency import residency
+    from .enhancer_jobs import job_queue, job_pool
+    from .node_state import node_state
+    from .history_segments import history_log
+    from .history_fingerprints import prompt_fingerprints, seed_key, final_key, key_hex, POLICIES as DUPLICATE_POLICIES
+    from .PromptRefinerNode import PromptRefinerNode, REFINEMENT_MODES, CLEAN_OUTPUT_PROMPT
+except ImportError:
+    from enhancer_cache import enhancer_cache, cache_key
+    from enhancer_packing import pack_size, build_pack_prompt, split_pack_response, pack_stats
+    from enhancer_prefetch import prefetcher
+    from enhancer_fusion import fused_registry, fused_system_prompt
+    from enhancer_similarity import similarity_cache
+    from enhancer_singleflight import singleflight
+    from enhancer_residency import residency
+    from enhancer_jobs import job_queue, job_pool
+    from node_state import node_state
+    from history_segments import history_log
+    from history_fingerprints import prompt_fingerprints, seed_key, final_key, key_hex, POLICIES as DUPLICATE_POLICIES
+    from PromptRefinerNode import PromptRefinerNode, REFINEMENT_MODES, CLEAN_OUTPUT_PROMPT
+
+# point at a local fake server for testing
+OPENROUTER_URL = os.environ.get("PCN_OPENROUTER_URL", "https://openrouter.ai/api/v1/chat/completions")
+
+# duplicate_policy=resample: variants tried before enhancing a known seed prompt anyway
+RESAMPLE_TRIES = 8
+
 
 class PromptCreatorNode:
     NODE_VERSION = "1.12.1"
@@ -121,12 +187,30 @@ class PromptCreatorNode:
                 "ollama_host": ("STRING", {"default": "http://10.10.10.2:11434"}),
                 "ollama_model": ("STRING", {"default": "qwen3:8b"}),
                 "openrouter_model": ("STRING", {"default": "openai/gpt-4o-mini"})
-            }
+            },
+            "optional": {
+                # > 1: enhance the next seeds in the same request (ollama / llamacpp / openai / openrouter)
+                "enhancer_pack_size": ("INT", {"default": 1, "min": 1, "max": 8, "step": 1}),
+                # enhance the next execution's prompt in the background while this one renders
+                "prefetch_next": (["off", "seed+1", "pose_index+1"], {"default": "off"}),
+                # refine in the same enhancer request; a Prompt Refiner with this mode then passes through
+                "fuse_refine": (["off"] + list(REFINEMENT_MODES.keys()), {"default": "off"}),
+                # reuse the enhancement of a near-identical seed prompt: 0 = off, 0.85 strict, 0.6 loose
+                "similar_reuse": ("FLOAT", {"default": 0.0, "min": 0.0, "max": 1.0, "step": 0.01}),
+                # seeds ahead kept as durable jobs (logs/enhancer_jobs.db), resumed after a restart; 0 = off
+                "durable_queue": ("INT", {"default": 0, "min": 0, "max": 100000}),
+                # this exact enhancer request ran before (logs/prompt_fingerprints.*.bin):
+                # proceed = call anyway, reuse = the logged result, resample = another seed prompt
+                "duplicate_policy": (DUPLICATE_POLICIES, {"default": "off"}),
+            },
+            # the graph being run: the costly stats sections are built only when "stats" is linked
+            "hidden": {"graph": "PROMPT", "node_id": "UNIQUE_ID"},
         }
 
-    RETURN_TYPES = ("STRING", "STRING")
-    RETURN_NAMES = ("prompt", "pose_preview")
-    FUNCTION = "generate_prompt"
+    RETURN_TYPES = ("STRING", "STRING", "STRING")
+    RETURN_NAMES = ("prompt", "pose_preview", "stats")
+    # async on ComfyUI versions that support it (see enhancer_async)
+    FUNCTION = "generate_prompt_async" if ASYNC_NODES else "generate_prompt"
     CATEGORY = "Prompt Creator"
 
     # ---------- Loaders ----------
@@ -247,6 +331,7 @@ class PromptCreatorNode:
         camera_angle_txt="",
         camera_light_txt="",
         daytime_txt="",
+        rng=random,
     ):
         parts = []
 
@@ -292,7 +377,7 @@ class PromptCreatorNode:
                         ci = chosen
 
                 if not ci and pool:
-                    ci = random.choice(list(pool.values()))
+                    ci = rng.choice(list(pool.values()))
 
             if ci:
                 parts.append(ci)
@@ -302,7 +387,7 @@ class PromptCreatorNode:
             if isinstance(data, dict) and gender in data:
                 values = data[gender]
                 if isinstance(values, list) and values:
-                    parts.append(random.choice(values))
+                    parts.append(rng.choice(values))
                     gender_inserted = True
 
             if not gender_inserted:
@@ -321,7 +406,7 @@ class PromptCreatorNode:
         if isinstance(data, dict) and "COLOR_REALM" in data:
             possible_realms = data["COLOR_REALM"]
             if isinstance(possible_realms, list) and possible_realms:
-                color_realm_value = random.choice(possible_realms)
+                color_realm_value = rng.choice(possible_realms)
                 parts.append(color_realm_value)
 
         multi_keys = ["OBJECTS", "ACCESSORIES"]
@@ -336,10 +421,10 @@ class PromptCreatorNode:
                 values_by_realm = data.get(key, {}).get(color_realm_value, [])
                 if isinstance(values_by_realm, list) and values_by_realm:
                     if key in multi_keys:
-                        sampled = random.sample(values_by_realm, min(multi_object_count, len(values_by_realm)))
+                        sampled = rng.sample(values_by_realm, min(multi_object_count, len(values_by_realm)))
                         parts.extend(sampled)
                     else:
-                        parts.append(random.choice(values_by_realm))
+                        parts.append(rng.choice(values_by_realm))
         else:
             if isinstance(data, dict):
                 for key, values in data.items():
@@ -361,10 +446,10 @@ class PromptCreatorNode:
 
                     if isinstance(values, list) and values:
                         if key in multi_keys:
-                            sampled = random.sample(values, min(multi_object_count, len(values)))
+                            sampled = rng.sample(values, min(multi_object_count, len(values)))
                             parts.extend(sampled)
                         else:
-                            parts.append(random.choice(values))
+                            parts.append(rng.choice(values))
 
         # Horror intensity
         if horror_intensity != "auto" and isinstance(data, dict) and "HORROR_INTENSITY" in data:
@@ -395,49 +480,107 @@ class PromptCreatorNode:
 
         return ", ".join([p for p in parts if isinstance(p, str) and p.strip()])
 
+    @staticmethod
+    def _pick_pose(poses, i):
+        if not poses:
+            return ""
+        i = max(0, min(int(i), len(poses) - 1))
+        return str(poses[i]).strip()
+
+    def _compose_seed_prompt(self, data, build_args, poses, pose_mode, pose_index, locked_pose, identity_txt, rng):
+        """
+        Seed prompt (+ chosen pose) for one seed. No file I/O and only `rng`
+        is used, so prompts of upcoming seeds can be built ahead of time.
+        """
+        prompt = self._build_prompt_from_json(data=data, rng=rng, **build_args)
+
+        if pose_mode == "world_pick":
+            chosen_pose = self._pick_pose(poses, pose_index)
+        elif pose_mode == "lock":
+            chosen_pose = locked_pose or self._pick_pose(poses, pose_index)
+        else:  # random
+            chosen_pose = rng.choice(poses).strip() if poses else ""
+
+        if chosen_pose:
+            prompt = prompt + ", " + chosen_pose
+
+        # Identity appended after pose (keeps face consistency late in chain)
+        if identity_txt:
+            prompt = prompt + ", " + identity_txt
+        return prompt, chosen_pose
+
+    def _resample_seed_prompt(self, data, build_args, poses, pose_mode, pose_index, locked_pose, identity_txt, seed,
+                              system_prompt, words_mode, wmin, wmax):
+        """(seed prompt, pose, user prompt, fingerprint) of a variant never enhanced before, or None."""
+        for n in range(1, RESAMPLE_TRIES + 1):
+            # derived from the seed but off the seed+1, seed+2, ... path of the next executions
+            rng = random.Random(f"{seed}/resample/{n}") if seed else random
+            p, pose = self._compose_seed_prompt(data, build_args, poses, pose_mode, pose_index, locked_pose, identity_txt, rng)
+            u = self._build_enhancer_user_prompt(p, words_mode, wmin, wmax)
+            key = seed_key(system_prompt, u)
+            if prompt_fingerprints.seen(key) is None:
+                return p, pose, u, key
+        return None
+
+    @staticmethod
+    def _logged_enhancement(entry):
+        """Enhancer text of a logged run: its final prompt without add_symbols brackets and LoRA triggers."""
+        text = str(entry.get("final_prompt") or "").strip()
+        if text.startswith("[") and text.endswith("]"):
+            text = text[1:-1]
+        triggers = [x.strip() for x in str(entry.get("lora_triggers") or "").split(",") if x.strip()]
+        suffix = ", " + ", ".join(triggers)
+        if triggers and text.endswith(suffix):
+            text = text[:-len(suffix)]
+        return text.strip()
+
     # ---------- API Keys ----------
     def _read_api_keys(self, base_path):
-        keys_path = os.path.join(base_path, "api_keys.txt")
-        keys = {}
-        if os.path.exists(keys_path):
-            with open(keys_path, "r", encoding="utf-8") as f:
-                for line in f:
-                    if "=" in line:
-                        k, v = line.strip().split("=", 1)
-                        keys[k.strip()] = v.strip()
-        return keys
+        # cached, re-parsed only when api_keys.txt changes
+        return read_api_keys(base_path)
 
     # ---------- Enhancers ----------
-    def _enhance_with_ollama(self, host, model, system_prompt, user_prompt):
-        r = requests.post(
-            f"{host}/api/chat",
-            json={
-                "model": model,
-                "messages": [
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                "stream": False
-            },
-            timeout=120
-        )
-        r.raise_for_status()
-        return r.json()["message"]["content"].strip()
-
-    def _enhance_with_openai(self, base_path, system_prompt, user_prompt):
-        import openai
+    def _enhance_with_ollama(self, host, model, system_prompt, user_prompt, budget=None):
+        payload = {
+            "model": model,
+            "messages": chat_messages(system_prompt, user_prompt),
+            "stream": False,
+            "keep_alive": OLLAMA_KEEP_ALIVE,
+        }
+        if budget:
+            payload["options"] = {"num_predict": budget.max_tokens, "stop": budget.stop}
+        # grouped by model, so two models on one host don't swap on every call
+        with residency.slot(host, model) as slot:
+            r = http_post(
+                "ollama",
+                f"{host}/api/chat",
+                json=payload,
+                timeout=120
+            )
+            r.raise_for_status()
+            j = r.json()
+            timings = ollama_timings(j)
+            if timings:
+                slot.loaded(timings["load_ms"])
+        record_response(r, "ollama", model, timings, tag="PromptCreator")
+        return j["message"]["content"].strip()
+
+    def _enhance_with_openai(self, base_path, system_prompt, user_prompt, budget=None):
         keys = self._read_api_keys(base_path)
-        openai.api_key = keys.get("openai", "")
-        resp = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ]
+        limits = {"max_tokens": budget.max_tokens, "stop": budget.stop} if budget else {}
+        content = call_with_backoff(
+            "openai",
+            lambda: openai_chat(
+                keys.get("openai", ""),
+                "gpt-3.5-turbo",
+                chat_messages(system_prompt, user_prompt),
+                **limits
+            ),
+            est_tokens=estimate_tokens(system_prompt, user_prompt, max_output=budget.max_tokens if budget else 400),
         )
-        return resp.choices[0].message.content.strip()
+        return content.strip()
 
-    def _enhance_with_llamacpp(self, host, system_prompt, user_prompt, temperature=0.7, top_p=0.9, n_predict=220):
+    def _enhance_with_llamacpp(self, host, system_prompt, user_prompt, temperature=0.7, top_p=0.9, n_predict=220, stop=None):
         """
         llama.cpp server backend.
         Tries OpenAI-compatible endpoint first (/v1/chat/completions), then falls back to (/completion).
@@ -447,18 +590,18 @@ class PromptCreatorNode:
 
         # 1) Try OpenAI-compatible chat endpoint
         try:
-            r = requests.post(
+            r = http_post(
+                "llamacpp",
                 f"{host}/v1/chat/completions",
                 json={
                     "model": "llama",
-                    "messages": [
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": user_prompt},
-                    ],
+                    "messages": chat_messages(system_prompt, user_prompt),
                     "temperature": float(temperature),
                     "top_p": float(top_p),
                     "max_tokens": int(n_predict),
+                    "stop": stop or [],
                     "stream": False,
+                    **llamacpp_cache_fields(system_prompt),
                 },
                 timeout=120,
             )
@@ -472,19 +615,23 @@ class PromptCreatorNode:
                 )
                 content = (content or "").strip()
                 if content:
+                    record_response(r, "llamacpp", j.get("model"), llamacpp_timings(j), tag="PromptCreator")
                     return content
         except Exception:
             pass
 
         # 2) Fallback to llama.cpp native /completion
-        r = requests.post(
+        r = http_post(
+            "llamacpp",
             f"{host}/completion",
             json={
-                "prompt": f"{system_prompt}\n\n{user_prompt}",
+                "prompt": completion_prompt(system_prompt, user_prompt),
                 "temperature": float(temperature),
                 "top_p": float(top_p),
                 "n_predict": int(n_predict),
+                "stop": stop or [],
                 "stream": False,
+                **llamacpp_cache_fields(system_prompt),
             },
             timeout=120,
         )
@@ -493,9 +640,10 @@ class PromptCreatorNode:
         content = (j.get("content") or j.get("completion") or "").strip()
         if not content:
             raise RuntimeError(f"llama.cpp returned no content. Keys: {list(j.keys())}")
+        record_response(r, "llamacpp", j.get("model"), llamacpp_timings(j), tag="PromptCreator")
         return content
 
-    def _enhance_with_cohere(self, base_path, system_prompt, user_prompt):
+    def _enhance_with_cohere(self, base_path, system_prompt, user_prompt, budget=None):
         import re
         try:
             import cohere
@@ -510,7 +658,7 @@ class PromptCreatorNode:
             return user_prompt
 
         try:
-            co = cohere.ClientV2(api_key=api_key)
+            co = cohere_client(api_key)
         except Exception as e:
             print(f"[PromptCreator] Cohere ClientV2 not available: {e}")
             return user_prompt
@@ -521,15 +669,21 @@ class PromptCreatorNode:
         )
 
         try:
-            resp = co.chat(
-                model="command-r-08-2024",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_msg},
-                ],
-                max_tokens=700,
-                temperature=0.9,
+            resp = call_with_backoff(
+                "cohere",
+                lambda: co.chat(
+                    model="command-r-08-2024",
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": user_msg},
+                    ],
+                    max_tokens=budget.max_tokens if budget else 700,
+                    temperature=0.9,
+                    **({"stop_sequences": budget.stop} if budget else {})
+                ),
+                est_tokens=estimate_tokens(system_prompt, user_msg, max_output=budget.max_tokens if budget else 700),
             )
+            note_usage_from(resp)
 
             content = ""
             if hasattr(resp, "message") and getattr(resp.message, "content", None):
@@ -547,20 +701,24 @@ class PromptCreatorNode:
             print(f"[PromptCreator] Error calling Cohere chat: {e}")
             return user_prompt
 
-    def _enhance_with_gemini(self, base_path, system_prompt, user_prompt):
-        import google.generativeai as genai
+    def _enhance_with_gemini(self, base_path, system_prompt, user_prompt, budget=None):
         keys = self._read_api_keys(base_path)
-        genai.configure(api_key=keys.get("gemini", ""))
-        model = genai.GenerativeModel("models/gemini-2.5-pro")
+        model = gemini_model(keys.get("gemini", ""), "models/gemini-2.5-pro")
         txt = (
             f"SYSTEM: {system_prompt}\n"
             f"USER: {user_prompt}\n"
             "Return only the final prompt as a single paragraph."
         )
-        r = model.generate_content(txt)
+        generation_config = {"max_output_tokens": budget.max_tokens, "stop_sequences": budget.stop} if budget else None
+        r = call_with_backoff(
+            "gemini",
+            lambda: model.generate_content(txt, generation_config=generation_config),
+            est_tokens=estimate_tokens(txt, max_output=budget.max_tokens if budget else 400),
+        )
+        note_usage_from(r)
         return r.candidates[0].content.parts[0].text.strip()
 
-    def _enhance_with_openrouter(self, base_path, model, system_prompt, user_prompt):
+    def _enhance_with_openrouter(self, base_path, model, system_prompt, user_prompt, budget=None):
         keys = self._read_api_keys(base_path)
         api_key = keys.get("openrouter", "").strip()
 
@@ -580,19 +738,236 @@ class PromptCreatorNode:
                 {"role": "user", "content": user_prompt}
             ]
         }
+        if budget:
+            payload["max_tokens"] = budget.max_tokens
+            payload["stop"] = budget.stop
+
+        def _post():
+            r = http_post(
+                "openrouter",
+                OPENROUTER_URL,
+                headers=headers,
+                json=payload,
+                timeout=120
+            )
+            r.raise_for_status()
+            return r
 
-        r = requests.post(
-            "https://openrouter.ai/api/v1/chat/completions",
-            headers=headers,
-            json=payload,
-            timeout=120
+        r = call_with_backoff(
+            "openrouter",
+            _post,
+            est_tokens=estimate_tokens(system_prompt, user_prompt, max_output=budget.max_tokens if budget else 400),
         )
+        data = r.json()
+        note_usage_from(data)
+        return data["choices"][0]["message"]["content"].strip()
 
-        r.raise_for_status()
-        print(headers)
-        print(payload)
-        return r.json()["choices"][0]["message"]["content"].strip()
 
+    def _run_enhancer(self, use_enhancer, base_path, ollama_host, ollama_model, openrouter_model, system_prompt, user_prompt, word_bounds=(None, 220)):
+        """
+        Dispatches to the selected backend under telemetry, with an output
+        token budget derived from the requested word range.
+        Concurrent identical requests share one call (singleflight).
+        Returns None when the backend fell back (caller keeps the seed prompt).
+        """
+        model = self._enhancer_model(use_enhancer, ollama_model, openrouter_model)
+        flight = ("PromptCreator", use_enhancer, ollama_host, model, system_prompt, user_prompt, tuple(word_bounds))
+        return singleflight.do(flight, lambda: self._call_enhancer(
+            use_enhancer, base_path, ollama_host, ollama_model, openrouter_model,
+            system_prompt, user_prompt, model, word_bounds
+        ), tag="PromptCreator")
+
+    def _call_enhancer(self, use_enhancer, base_path, ollama_host, ollama_model, openrouter_model, system_prompt, user_prompt, model, word_bounds):
+        budget = governor.plan(use_enhancer, model, *word_bounds)
+        with track("PromptCreator", use_enhancer, model) as call:
+            out = None
+            if use_enhancer == "ollama":
+                out = self._enhance_with_ollama(ollama_host, ollama_model, system_prompt, user_prompt, budget=budget)
+            elif use_enhancer == "llamacpp":
+                out = self._enhance_with_llamacpp(ollama_host, system_prompt, user_prompt, n_predict=budget.max_tokens, stop=budget.stop)
+            elif use_enhancer == "openai":
+                out = self._enhance_with_openai(base_path, system_prompt, user_prompt, budget=budget)
+            elif use_enhancer == "cohere":
+                out = self._enhance_with_cohere(base_path, system_prompt, user_prompt, budget=budget)
+            elif use_enhancer == "gemini":
+                out = self._enhance_with_gemini(base_path, system_prompt, user_prompt, budget=budget)
+            elif use_enhancer == "openrouter":
+                out = self._enhance_with_openrouter(base_path, openrouter_model, system_prompt, user_prompt, budget=budget)
+
+            if not out or out == user_prompt:
+                call.fallback("no enhanced output")
+                return None
+            governor.observe(budget, out, call.tokens_out, tag="PromptCreator")
+            call.estimate_tokens(system_prompt + user_prompt, out)
+            return out
+
+    @staticmethod
+    def _enhancer_model(use_enhancer, ollama_model, openrouter_model):
+        return {"ollama": ollama_model, "openrouter": openrouter_model}.get(use_enhancer, "")
+
+    def _run_packed(self, use_enhancer, base_path, ollama_host, ollama_model, openrouter_model, system_prompt, user_prompts, word_bounds):
+        """
+        One request for several seeds (JSON array answer).
+        Returns one entry per user prompt, None for items that failed validation.
+        """
+        model = self._enhancer_model(use_enhancer, ollama_model, openrouter_model)
+        n = len(user_prompts)
+        item_budget = governor.plan(use_enhancer, model, *word_bounds)
+        budget = governor.plan(use_enhancer, model, *word_bounds, items=n)
+        packed_prompt = build_pack_prompt(user_prompts)
+
+        with track("PromptCreator", use_enhancer, model) as call:
+            raw = None
+            if use_enhancer == "ollama":
+                raw = self._enhance_with_ollama(ollama_host, ollama_model, system_prompt, packed_prompt, budget=budget)
+            elif use_enhancer == "llamacpp":
+                raw = self._enhance_with_llamacpp(ollama_host, system_prompt, packed_prompt, n_predict=budget.max_tokens, stop=budget.stop)
+            elif use_enhancer == "openai":
+                raw = self._enhance_with_openai(base_path, system_prompt, packed_prompt, budget=budget)
+            elif use_enhancer == "openrouter":
+                raw = self._enhance_with_openrouter(base_path, openrouter_model, system_prompt, packed_prompt, budget=budget)
+
+            items = split_pack_response(raw if raw != packed_prompt else "", user_prompts)
+            ok = sum(1 for x in items if x)
+            if not ok:
+                call.fallback("pack: no valid items")
+            call.estimate_tokens(system_prompt + packed_prompt, raw or "")
+
+        pack_stats.record(use_enhancer, system_prompt, n, ok)
+        print(f"[PromptCreator] packed {n} seeds in one {use_enhancer} request: {ok}/{n} valid")
+        for item in items:
+            if item:
+                governor.observe(item_budget, item, tag="PromptCreator")
+        return items
+
+    def _enhance_seed(self, use_enhancer, base_path, ollama_host, ollama_model, openrouter_model,
+                      system_prompt, user_prompt, word_bounds, pack=1, upcoming=None,
+                      seed_prompt="", similar=0.0, durable=0):
+        """
+        Enhancer entry point of generate_prompt: cached result if there is one,
+        else the result of a near-identical seed prompt (similar > 0), else
+        the durable job queue (durable > 0), else a packed request covering
+        the next seeds too (pack > 1), else a single request. Failed packed
+        items are re-issued one by one.
+        """
+        model = self._enhancer_model(use_enhancer, ollama_model, openrouter_model)
+        key = cache_key(use_enhancer, model, system_prompt, user_prompt)
+        cached = enhancer_cache.get(key)
+        if cached:
+            print("[PromptCreator] enhancer cache hit")
+            return cached
+        # prefetched by the previous execution and still running: wait for it
+        cached = prefetcher.wait(key)
+        if cached:
+            print("[PromptCreator] enhancer prefetch joined")
+            return cached
+
+        scope = None
+        if similar and similar > 0 and seed_prompt:
+            scope = cache_key(use_enhancer, model, system_prompt, repr(word_bounds))
+            near = similarity_cache.lookup(scope, seed_prompt, similar)
+            if near:
+                print(f"[PromptCreator] near-duplicate seed prompt (similarity {near[1]:.2f}): enhancement reused")
+                return near[0]
+
+        if durable and upcoming is not None:
+            out = self._enhance_durable(
+                use_enhancer, ollama_host, ollama_model, openrouter_model,
+                system_prompt, user_prompt, word_bounds, key, model, durable, upcoming
+            )
+        else:
+            out = self._enhance_uncached(
+                use_enhancer, base_path, ollama_host, ollama_model, openrouter_model,
+                system_prompt, user_prompt, word_bounds, key, model, pack, upcoming
+            )
+        if out and scope:
+            similarity_cache.add(scope, seed_prompt, out)
+        return out
+
+    def _enhance_durable(self, use_enhancer, ollama_host, ollama_model, openrouter_model,
+                         system_prompt, user_prompt, word_bounds, key, model, durable, upcoming):
+        """
+        Keeps the next `durable` seeds queued as jobs for the worker pool, and
+        takes this seed's result from its job (stored, run here, or awaited).
+        """
+        def spec(u):
+            return {
+                "backend": use_enhancer, "host": ollama_host,
+                "ollama_model": ollama_model, "openrouter_model": openrouter_model,
+                "system_prompt": system_prompt, "user_prompt": u, "word_bounds": list(word_bounds),
+            }
+
+        def job_key(u):
+            return cache_key(use_enhancer, model, system_prompt, u)
+
+        n = int(durable)
+        last = upcoming(n, n - 1) if n > 1 else []
+        if last and not job_queue.known([job_key(last[0])]):
+            # the window slides by one seed per execution: when the seed before
+            # its far end is queued, the far end is the only new job
+            before = upcoming(n - 1, n - 2) if n > 2 else []
+            if n == 2 or (before and job_queue.known([job_key(before[0])])):
+                job_queue.enqueue([(job_key(last[0]), spec(last[0]))])
+            else:
+                # first run of a batch, or the seed jumped: the whole window
+                added = job_queue.enqueue([(job_key(u), spec(u)) for u in upcoming(n)])
+                if added:
+                    print(f"[PromptCreator] {added} enhancement jobs queued ({use_enhancer})")
+        job_pool.start()
+        return job_pool.run(key, spec(user_prompt))
+
+    def _enhance_uncached(self, use_enhancer, base_path, ollama_host, ollama_model, openrouter_model,
+                          system_prompt, user_prompt, word_bounds, key, model, pack, upcoming):
+        """Packed request (pack > 1) or single request for a prompt no cache could serve."""
+        k = pack_size(use_enhancer, pack)
+        if pack_stats.take_failed(key):
+            pack_stats.reissued(use_enhancer)
+            k = 1
+        if k > 1 and upcoming is not None:
+            ahead = [
+                u for u in upcoming(k)
+                if cache_key(use_enhancer, model, system_prompt, u) not in enhancer_cache
+            ]
+            if ahead:
+                user_prompts = [user_prompt] + ahead
+                try:
+                    items = self._run_packed(
+                        use_enhancer, base_path, ollama_host, ollama_model, openrouter_model,
+                        system_prompt, user_prompts, word_bounds
+                    )
+                except RequestCancelled:
+                    raise
+                except Exception as e:
+                    print(f"[PromptCreator] packed request failed ({use_enhancer}): {e}")
+                    items = [None] * len(user_prompts)
+
+                for u, item in zip(ahead, items[1:]):
+                    u_key = cache_key(use_enhancer, model, system_prompt, u)
+                    if item:
+                        enhancer_cache.put(u_key, item, source="pack")
+                    else:
+                        # re-issued alone when its seed runs
+                        pack_stats.mark_failed(u_key)
+                if items[0]:
+                    return items[0]
+                pack_stats.reissued(use_enhancer)
+
+        out = self._run_enhancer(
+            use_enhancer, base_path, ollama_host, ollama_model, openrouter_model,
+            system_prompt, user_prompt, word_bounds=word_bounds
+        )
+        return out
+
+    def _prefetch(self, use_enhancer, base_path, ollama_host, ollama_model, openrouter_model,
+                  system_prompt, user_prompt, word_bounds):
+        """Enhances a predicted next prompt in the background, into the enhancer cache."""
+        model = self._enhancer_model(use_enhancer, ollama_model, openrouter_model)
+        key = cache_key(use_enhancer, model, system_prompt, user_prompt)
+        if prefetcher.schedule(key, lambda: self._run_enhancer(
+            use_enhancer, base_path, ollama_host, ollama_model, openrouter_model,
+            system_prompt, user_prompt, word_bounds=word_bounds
+        )):
+            print(f"[PromptCreator] prefetching next prompt ({use_enhancer})")
 
     # ---------- Logging ----------
     @staticmethod
@@ -605,11 +980,10 @@ class PromptCreatorNode:
         final_prompt,
         source="generated",
         node_version="1.12.1",
+        use_enhancer=None,
+        enhance_ms=None,
+        seed_fp=None,
     ):
-        log_dir = os.path.join(os.path.dirname(__file__), "logs")
-        os.makedirs(log_dir, exist_ok=True)
-        log_path = os.path.join(log_dir, "prompt_history.jsonl")
-
         entry = {
             "timestamp": datetime.now().isoformat(timespec="seconds"),
             "json_world": json_name,
@@ -621,9 +995,16 @@ class PromptCreatorNode:
             "source": source,
             "node_version": node_version
         }
+        # enhancer runs only: which backend, and how long it took (history_stats.py)
+        if use_enhancer and use_enhancer != "none":
+            entry["use_enhancer"] = use_enhancer
+            entry["enhance_ms"] = enhance_ms
+            # fingerprint of the enhancer request, see history_fingerprints
+            if seed_fp:
+                entry["seed_fp"] = key_hex(seed_fp)
 
-        with open(log_path, "a", encoding="utf-8") as f:
-            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        # batched in the background, rotated into segments (see history_segments)
+        history_log.append(entry)
 
     # ---------- Enhancer words ----------
     @staticmethod
@@ -638,34 +1019,9 @@ class PromptCreatorNode:
         if not base:
             return "Enhance this prompt."
 
-        # sanitize ints
-        try:
-            wmin = int(wmin)
-        except Exception:
-            wmin = 140
-        try:
-            wmax = int(wmax)
-        except Exception:
-            wmax = 220
-
-        wmin = max(20, min(wmin, 600))
-        wmax = max(20, min(wmax, 800))
-        if wmax < wmin:
-            wmax = wmin
-
-        mode = (words_mode or "auto").strip().lower()
-
-        if mode == "min":
-            lo = max(20, wmin - 10)
-            hi = max(lo + 10, wmin + 20)
-            return (
-                f"Enhance this prompt into ONE single long sentence (~{lo}–{hi} words), "
-                f"no lists and no line breaks: {base}"
-            )
-
-        if mode == "max":
-            lo = max(30, wmax - 30)
-            hi = max(lo + 10, wmax)
+        # same ranges the token budget is derived from
+        lo, hi = word_range(words_mode, wmin, wmax)
+        if lo is not None:
             return (
                 f"Enhance this prompt into ONE single long sentence (~{lo}–{hi} words), "
                 f"no lists and no line breaks: {base}"
@@ -694,6 +1050,10 @@ class PromptCreatorNode:
         return text.strip()
     
     # ---------- Main ----------
+    async def generate_prompt_async(self, **kwargs):
+        """Same as generate_prompt; interrupting the queue aborts the enhancer request."""
+        return await run_node(self.generate_prompt, **kwargs)
+
     def generate_prompt(
         self,
         json_name,
@@ -725,19 +1085,24 @@ class PromptCreatorNode:
         multi_object_count,
         ollama_host,
         ollama_model,
-        openrouter_model
+        openrouter_model,
+        enhancer_pack_size=1,
+        prefetch_next="off",
+        fuse_refine="off",
+        similar_reuse=0.0,
+        durable_queue=0,
+        duplicate_policy="off",
+        graph=None,
+        node_id=None
     ):
         base_path = os.path.dirname(__file__)
+        full_stats = output_connected(graph, node_id, 2)
         json_path = os.path.join(base_path, "JSON_DATA", json_name)
 
-        # history lock
-        history_dir = os.path.join(base_path, "history")
-        os.makedirs(history_dir, exist_ok=True)
-        history_path = os.path.join(history_dir, f"last_prompt_{json_name}.txt")
-
-        if lock_last_prompt == "yes" and os.path.exists(history_path):
-            with open(history_path, "r", encoding="utf-8") as f:
-                prompt = f.read().strip()
+        # history lock (logs/node_state.db)
+        last_prompt = node_state.get("last_prompt", json_name) if lock_last_prompt == "yes" else None
+        if last_prompt is not None:
+            prompt = last_prompt.strip()
             pose_preview = ""  # best-effort (history has no pose preview)
             self.log_prompt_run(
                 json_name=json_name,
@@ -750,14 +1115,14 @@ class PromptCreatorNode:
                 node_version=self.NODE_VERSION
             )
             print("[PromptCreator] Prompt locked and loaded from history")
-            return (prompt, pose_preview)
+            return (prompt, pose_preview, stats_json("PromptCreator", full_stats))
 
         try:
             with open(json_path, "r", encoding="utf-8") as f:
                 data = json.load(f)
         except Exception as e:
             print(f"[PromptCreator] Errore nel caricamento del JSON: {e}")
-            return ("", "")
+            return ("", "", stats_json("PromptCreator", full_stats))
 
         # world-level SYSTEM_PROMPT (unified JSON) if present
         world_system_prompt = None
@@ -781,9 +1146,8 @@ class PromptCreatorNode:
         data = self._sanitize_world_keys(data, camera_light, ["camera_light", "CAMERA_LIGHT"])
         data = self._sanitize_world_keys(data, daytime, ["daytime", "DAYTIME"])
 
-        # Seed
-        if seed:
-            random.seed(seed)
+        # Seed: a private RNG per seed, so upcoming seeds can be replayed exactly
+        rng = random.Random(seed) if seed else random
 
         # Identity profile (prompt-only)
         identity_txt = ""
@@ -794,9 +1158,7 @@ class PromptCreatorNode:
                 identities = self._identity_profiles()
                 identity_txt = self._identity_to_text(identities.get(identity_profile, {}))
 
-        # Build base prompt
-        prompt = self._build_prompt_from_json(
-            data=data,
+        build_args = dict(
             gender=gender,
             custom_intro=custom_intro,
             custom_intro_id=custom_intro_id,
@@ -816,31 +1178,17 @@ class PromptCreatorNode:
         poses = poses if isinstance(poses, list) else []
 
         pose_preview = ""
-        chosen_pose = ""
-        pose_path = os.path.join(history_dir, f"last_pose_{json_name}.txt")
-
-        def pick_pose_by_index(i):
-            if not poses:
-                return ""
-            i = max(0, min(int(i), len(poses) - 1))
-            return str(poses[i]).strip()
+        locked_pose = ""
+        if pose_mode == "lock":
+            locked_pose = (node_state.get("last_pose", json_name) or "").strip()
 
-        if pose_mode == "world_pick":
-            chosen_pose = pick_pose_by_index(pose_index)
-        elif pose_mode == "lock":
-            if os.path.exists(pose_path):
-                with open(pose_path, "r", encoding="utf-8") as f:
-                    chosen_pose = f.read().strip()
-            if not chosen_pose:
-                chosen_pose = pick_pose_by_index(pose_index)
-        else:  # random
-            if poses:
-                chosen_pose = random.choice(poses).strip()
+        # Build base prompt (+ pose + identity)
+        prompt, chosen_pose = self._compose_seed_prompt(
+            data, build_args, poses, pose_mode, pose_index, locked_pose, identity_txt, rng
+        )
 
         if chosen_pose:
-            prompt = prompt + ", " + chosen_pose
-            with open(pose_path, "w", encoding="utf-8") as f:
-                f.write(chosen_pose)
+            node_state.set("last_pose", json_name, chosen_pose)
 
         if show_pose_preview:
             if poses:
@@ -852,15 +1200,16 @@ class PromptCreatorNode:
             else:
                 pose_preview = "POSES: (none found in this world JSON)"
 
-        # Identity appended after pose (keeps face consistency late in chain)
-        if identity_txt:
-            prompt = prompt + ", " + identity_txt
-
         # System prompt selection
         system_prompts = self._system_prompts()
         effective_world_system_prompt = None if system_prompt_lock == "external" else world_system_prompt
         system_prompt = effective_world_system_prompt or system_prompts.get(enhancer_mode, system_prompts.get("standard", ""))
 
+        # fused refine: the Refiner's instructions ride along with the enhancer request
+        fused = fuse_refine != "off" and use_enhancer != "none"
+        if fused:
+            system_prompt = fused_system_prompt(system_prompt, REFINEMENT_MODES.get(fuse_refine, ""), CLEAN_OUTPUT_PROMPT)
+
         # ✅ NEW: words-controlled user prompt for enhancer
         user_prompt = self._build_enhancer_user_prompt(
             seed_prompt=prompt,
@@ -869,26 +1218,94 @@ class PromptCreatorNode:
             wmax=enhancer_words_max
         )
 
+        def user_prompt_for(s, p_index):
+            p, _ = self._compose_seed_prompt(
+                data, build_args, poses, pose_mode, p_index,
+                locked_pose or chosen_pose, identity_txt, random.Random(s)
+            )
+            return self._build_enhancer_user_prompt(p, enhancer_words_mode, enhancer_words_min, enhancer_words_max)
+
+        def upcoming_user_prompts(count, first=1):
+            """Enhancer user prompts of the next seeds (seed+first, ..., seed+count-1)."""
+            if not seed:
+                return []
+            return [user_prompt_for(s, pose_index) for s in range(seed + first, seed + count)]
+
+        # Enhancer request seen before?
+        seed_fp = seed_key(system_prompt, user_prompt) if use_enhancer != "none" else None
+        reused = None
+        if seed_fp and duplicate_policy != "off":
+            # busy (another sync, a grow): check against the table as it is
+            prompt_fingerprints.sync(blocking=False)
+            seen = prompt_fingerprints.seen_seed(seed_fp)
+            if seen is not None:
+                print(f"[PromptCreator] seed prompt already enhanced on {datetime.fromtimestamp(seen).isoformat(timespec='seconds')} ({duplicate_policy})")
+                if duplicate_policy == "reuse":
+                    e = prompt_fingerprints.logged_entry(seed_fp, seen)
+                    reused = self._logged_enhancement(e) if e else None
+                    if reused:
+                        prompt_fingerprints.count("reused")
+                    else:
+                        prompt_fingerprints.count("reuse_missing")
+                        print("[PromptCreator] logged result not found, enhancing again")
+                elif duplicate_policy == "resample":
+                    resampled = self._resample_seed_prompt(
+                        data, build_args, poses, pose_mode, pose_index, locked_pose, identity_txt, seed,
+                        system_prompt, enhancer_words_mode, enhancer_words_min, enhancer_words_max
+                    )
+                    if resampled:
+                        prompt, new_pose, user_prompt, seed_fp = resampled
+                        if new_pose and new_pose != chosen_pose:
+                            chosen_pose = new_pose
+                            node_state.set("last_pose", json_name, chosen_pose)
+                        prompt_fingerprints.count("resampled")
+                    else:
+                        print(f"[PromptCreator] no unseen seed prompt in {RESAMPLE_TRIES} tries, enhancing anyway")
+
         # Enhancer backends
-        if use_enhancer != "none":
+        enhanced = None
+        enhance_ms = None
+        if reused:
+            enhanced = prompt = reused
+            print("[PromptCreator] logged enhancement reused")
+        elif use_enhancer != "none":
+            t_enhance = time.perf_counter()
             try:
-                if use_enhancer == "ollama":
-                    prompt = self._enhance_with_ollama(ollama_host, ollama_model, system_prompt, user_prompt)
-                elif use_enhancer == "llamacpp":
-                    prompt = self._enhance_with_llamacpp(ollama_host, system_prompt, user_prompt)
-                elif use_enhancer == "openai":
-                    prompt = self._enhance_with_openai(base_path, system_prompt, user_prompt)
-                elif use_enhancer == "cohere":
-                    prompt = self._enhance_with_cohere(base_path, system_prompt, user_prompt)
-                elif use_enhancer == "gemini":
-                    prompt = self._enhance_with_gemini(base_path, system_prompt, user_prompt)
-                elif use_enhancer == "openrouter":
-                    prompt = self._enhance_with_openrouter(base_path, openrouter_model, system_prompt, user_prompt)
-                # original gemini branch removed below
-                if False:
-                    prompt = self._enhance_with_gemini(base_path, system_prompt, user_prompt)
+                enhanced = self._enhance_seed(
+                    use_enhancer, base_path, ollama_host, ollama_model, openrouter_model,
+                    system_prompt, user_prompt,
+                    word_range(enhancer_words_mode, enhancer_words_min, enhancer_words_max),
+                    pack=enhancer_pack_size,
+                    upcoming=upcoming_user_prompts,
+                    seed_prompt=prompt,
+                    similar=similar_reuse,
+                    # unseeded runs can't be resumed
+                    durable=durable_queue if seed else 0,
+                )
+                if enhanced and fused:
+                    # same cleanup the Refiner applies to its own answers
+                    enhanced = PromptRefinerNode().extract_text(enhanced)
+                if enhanced:
+                    prompt = enhanced
+            except RequestCancelled:
+                raise
             except Exception as e:
+                enhanced = None
                 print(f"[PromptCreator] Errore nell'enhancer ({use_enhancer}): {e}")
+            enhance_ms = round((time.perf_counter() - t_enhance) * 1000.0, 1)
+
+            # unseeded runs can't be predicted
+            if prefetch_next != "off" and seed:
+                if prefetch_next == "seed+1":
+                    next_user_prompt = user_prompt_for(seed + 1, pose_index)
+                else:
+                    next_user_prompt = user_prompt_for(seed, pose_index + 1)
+                if next_user_prompt != user_prompt:
+                    self._prefetch(
+                        use_enhancer, base_path, ollama_host, ollama_model, openrouter_model,
+                        system_prompt, next_user_prompt,
+                        word_range(enhancer_words_mode, enhancer_words_min, enhancer_words_max)
+                    )
 
         # LoRA triggers
         if isinstance(lora_triggers, str) and lora_triggers.strip():
@@ -900,8 +1317,13 @@ class PromptCreatorNode:
             prompt = f"[{prompt}]"
 
         # Persist history
-        with open(history_path, "w", encoding="utf-8") as f:
-            f.write(prompt.strip())
+        node_state.set("last_prompt", json_name, prompt.strip())
+
+        if duplicate_policy != "off":
+            if not reused and prompt_fingerprints.seen_final(final_key(prompt)) is not None:
+                print("[PromptCreator] this final prompt was logged before")
+            # right away: the log line itself is written in the background
+            prompt_fingerprints.add([seed_fp if enhanced else None, final_key(prompt)])
 
         self.log_prompt_run(
             json_name=json_name,
@@ -911,8 +1333,26 @@ class PromptCreatorNode:
             lora_triggers=lora_triggers,
             final_prompt=prompt,
             source="generated",
-            node_version=self.NODE_VERSION
+            node_version=self.NODE_VERSION,
+            use_enhancer=use_enhancer,
+            enhance_ms=enhance_ms,
+            # only with an enhanced result: a failed request is nothing to reuse
+            seed_fp=seed_fp if enhanced else None,
         )
         prompt = self._compress_prompt(prompt)
+        if fused and enhanced:
+            fused_registry.mark(prompt, fuse_refine)
         print(f"[PromptCreator] Prompt finale: {prompt}")
-        return (prompt, pose_preview)
+        return (prompt, pose_preview, stats_json("PromptCreator", full_stats))
+
+
+def _run_durable_job(spec):
+    """job_pool runner: one enhancement from a stored job spec."""
+    return PromptCreatorNode()._run_enhancer(
+        spec["backend"], os.path.dirname(__file__), spec["host"],
+        spec["ollama_model"], spec["openrouter_model"],
+        spec["system_prompt"], spec["user_prompt"], word_bounds=tuple(spec["word_bounds"]),
+    )
+
+
+job_pool.bind(_run_durable_job)
@@ -1,5 +1,54 @@
 import requests
 import os
+import json
+import time
+
+try:
+    from .enhancer_ratelimit import call_with_backoff, estimate_tokens
+except ImportError:
+    from enhancer_ratelimit import call_with_backoff, estimate_tokens
+
+try:
+    from .enhancer_local import (
+        OLLAMA_KEEP_ALIVE, completion_prompt,
+        llamacpp_cache_fields, ollama_timings, llamacpp_timings, record_response,
+    )
+except ImportError:
+    from enhancer_local import (
+        OLLAMA_KEEP_ALIVE, completion_prompt,
+        llamacpp_cache_fields, ollama_timings, llamacpp_timings, record_response,
+    )
+
+try:
+    from .enhancer_clients import read_api_keys
+    from .enhancer_async import ASYNC_NODES, run_node, http_stream, RequestCancelled, DeadlineExceeded
+except ImportError:
+    from enhancer_clients import read_api_keys
+    from enhancer_async import ASYNC_NODES, run_node, http_stream, RequestCancelled, DeadlineExceeded
+
+try:
+    from .enhancer_telemetry import track, note_usage_from, stats_json, output_connected
+except ImportError:
+    from enhancer_telemetry import track, note_usage_from, stats_json, output_connected
+
+try:
+    from .enhancer_budget import governor
+    from .enhancer_fusion import fused_registry
+    from .enhancer_singleflight import singleflight
+    from .enhancer_residency import residency
+except ImportError:
+    from enhancer_budget import governor
+    from enhancer_fusion import fused_registry
+    from enhancer_singleflight import singleflight
+    from enhancer_residency import residency
+
+# point at a local fake server for testing
+OPENROUTER_URL = os.environ.get("PCN_OPENROUTER_URL", "https://openrouter.ai/api/v1/chat/completions")
+
+# transport: every answer is streamed under the node's overall deadline
+CONNECT_TIMEOUT_S = 5
+READ_TIMEOUT_S = 60      # max silence between two streamed chunks
+MAX_RETRIES = 2          # connection errors / 429 / 5xx, within the deadline
 
 
 # =========================
@@ -28,6 +77,18 @@ The output must be ready to use directly.
 """
 
 
+# =========================
+# 🎚️ REFINEMENT MODES
+# =========================
+# also used by PromptCreatorNode's fuse_refine
+REFINEMENT_MODES = {
+    "subtle": "Refine the prompt preserving structure and improving clarity.",
+    "balanced": "Refine the prompt improving clarity, flow and visual richness while preserving identity.",
+    "creative": "Enhance the prompt with richer detail, atmosphere and depth while keeping the original concept intact.",
+    "consistency": "Refine the prompt with strict consistency.Preserve identity, structure, and key visual elements exactly as given. Avoid introducing new concepts, styles, or variations. Keep wording stable and deterministic while improving only clarity and coherence.",
+}
+
+
 class PromptRefinerNode:
 
     def __init__(self):
@@ -38,18 +99,13 @@ class PromptRefinerNode:
     # =========================
     def _read_api_keys(self, base_path):
         keys_path = os.path.join(base_path, "api_keys.txt")
-        keys = {}
-
-        if os.path.exists(keys_path):
-            with open(keys_path, "r", encoding="utf-8") as f:
-                for line in f:
-                    if "=" in line:
-                        k, v = line.strip().split("=", 1)
-                        keys[k.strip()] = v.strip()
-        else:
+
+        if not os.path.exists(keys_path):
             print(f"[PromptRefiner] api_keys.txt NOT FOUND at: {keys_path}")
+            return {}
 
-        return keys
+        # cached, re-parsed only when api_keys.txt changes
+        return read_api_keys(base_path)
 
     # =========================
     # 🧩 INPUTS
@@ -68,92 +124,120 @@ class PromptRefinerNode:
                     "cohere",
                     "llama_cpp"
                 ],),
-                "refinement_mode": ([
-                    "subtle",
-                    "balanced",
-                    "creative",
-                    "consistency"
-                ],),
+                "refinement_mode": (list(REFINEMENT_MODES.keys()),),
             },
             "optional": {
                 "model": ("STRING", {"default": ""}),
                 "system_prompt": ("STRING", {"multiline": True, "default": ""}),
                 "host": ("STRING", {"default": "http://127.0.0.1:11434"}),
-            }
+                # overall deadline (retries included); past it prompt_in is returned
+                "deadline_s": ("INT", {"default": 120, "min": 5, "max": 1800, "step": 5}),
+            },
+            # the graph being run: the costly stats sections are built only when "stats" is linked
+            "hidden": {"graph": "PROMPT", "node_id": "UNIQUE_ID"},
         }
 
-    RETURN_TYPES = ("STRING", "STRING")
-    RETURN_NAMES = ("prompt_out", "prompt_raw")
-    FUNCTION = "refine"
+    RETURN_TYPES = ("STRING", "STRING", "STRING")
+    RETURN_NAMES = ("prompt_out", "prompt_raw", "stats")
+    # async on ComfyUI versions that support it (see enhancer_async)
+    FUNCTION = "refine_async" if ASYNC_NODES else "refine"
     CATEGORY = "PFN / Prompt"
 
     # =========================
     # 🚀 MAIN
     # =========================
-    def refine(self, prompt_in, enable_refine, provider, refinement_mode, model="", system_prompt="", host="http://127.0.0.1:11434"):
+    async def refine_async(self, **kwargs):
+        """Same as refine; interrupting the queue aborts the provider request."""
+        return await run_node(self.refine, **kwargs)
+
+    def refine(self, prompt_in, enable_refine, provider, refinement_mode, model="", system_prompt="", host="http://127.0.0.1:11434", deadline_s=120, graph=None, node_id=None):
+        full_stats = output_connected(graph, node_id, 2)
 
         if not enable_refine:
-            return (prompt_in, prompt_in)
+            return (prompt_in, prompt_in, stats_json("PromptRefiner", full_stats))
+
+        # already refined by the Creator's fused request (fuse_refine)
+        fused_mode = fused_registry.mode_of(prompt_in)
+        if fused_mode is not None and not system_prompt.strip():
+            if fused_mode == refinement_mode:
+                fused_registry.count("passed_through")
+                print(f"[PromptRefiner] prompt already refined by PromptCreator ({fused_mode}), passing through")
+                return (prompt_in, prompt_in, stats_json("PromptRefiner", full_stats))
+            fused_registry.count("mode_mismatch")
 
         base_prompt = system_prompt.strip() if system_prompt.strip() else self.get_default_system_prompt(refinement_mode)
         system_prompt_full = base_prompt + "\n\n" + CLEAN_OUTPUT_PROMPT
 
-        try:
-            raw_response = self.call_provider(
-                provider,
-                model,
-                system_prompt_full,
-                prompt_in,
-                host
-            )
+        # a refinement is about as long as its input: cap the output accordingly
+        words_in = len(prompt_in.split())
+        budget = governor.plan(provider, model, None, max(60, int(words_in * 1.5)))
+        deadline = time.monotonic() + float(deadline_s)
 
-            refined_prompt = self.extract_text(raw_response)
+        try:
+            # concurrent identical refinements share one call
+            flight = ("PromptRefiner", provider, host, model, system_prompt_full, prompt_in)
+            raw_response, refined_prompt = singleflight.do(flight, lambda: self._refine_call(
+                provider, model, system_prompt_full, prompt_in, host, budget, deadline
+            ), tag="PromptRefiner")
 
             # 🔥 DEBUG
             print("\n[PromptRefiner] FINAL PROMPT:\n")
             print(refined_prompt)
             print("\n" + "="*60 + "\n")
 
+        except RequestCancelled:
+            raise
         except Exception as e:
             refined_prompt = prompt_in
-            raw_response = f"ERROR: {str(e)}"
-            print(f"[PromptRefiner ERROR] {e}")
+            # a silent host hits the read timeout, which is capped at the deadline
+            if isinstance(e, DeadlineExceeded) or (isinstance(e, requests.Timeout) and time.monotonic() >= deadline - 0.5):
+                raw_response = f"ERROR: {provider} did not answer within {deadline_s}s ({e}), prompt_in returned"
+            else:
+                raw_response = f"ERROR: {str(e)}"
+            print(f"[PromptRefiner ERROR] {raw_response}")
+
+        return (refined_prompt, raw_response, stats_json("PromptRefiner", full_stats))
+
+    def _refine_call(self, provider, model, system_prompt_full, prompt_in, host, budget, deadline):
+        """One provider call under telemetry; returns (raw_response, refined_prompt)."""
+        with track("PromptRefiner", provider, model) as call:
+            raw_response = self.call_provider(
+                provider,
+                model,
+                system_prompt_full,
+                prompt_in,
+                host,
+                budget,
+                deadline
+            )
 
-        return (refined_prompt, raw_response)
+            refined_prompt = self.extract_text(raw_response)
+            if not refined_prompt or raw_response == prompt_in or "NOT IMPLEMENTED]" in str(raw_response):
+                call.fallback("no refined output")
+            else:
+                governor.observe(budget, refined_prompt, call.tokens_out, tag="PromptRefiner")
+            call.estimate_tokens(system_prompt_full + prompt_in, str(raw_response))
+        return raw_response, refined_prompt
 
     # =========================
     # 🧠 SYSTEM MODES
     # =========================
     def get_default_system_prompt(self, mode):
-
-        if mode == "subtle":
-            return "Refine the prompt preserving structure and improving clarity."
-
-        elif mode == "balanced":
-            return "Refine the prompt improving clarity, flow and visual richness while preserving identity."
-
-        elif mode == "creative":
-            return "Enhance the prompt with richer detail, atmosphere and depth while keeping the original concept intact."
-        
-        elif mode == "consistency":
-            return "Refine the prompt with strict consistency.Preserve identity, structure, and key visual elements exactly as given. Avoid introducing new concepts, styles, or variations. Keep wording stable and deterministic while improving only clarity and coherence."
-    
-
-        return ""
+        return REFINEMENT_MODES.get(mode, "")
 
     # =========================
     # 🔌 ROUTER
     # =========================
-    def call_provider(self, provider, model, system_prompt, user_prompt, host):
+    def call_provider(self, provider, model, system_prompt, user_prompt, host, budget=None, deadline=None):
 
         if provider == "ollama":
-            return self.call_ollama(model, system_prompt, user_prompt, host)
+            return self.call_ollama(model, system_prompt, user_prompt, host, budget, deadline)
 
         elif provider == "llama_cpp":
-            return self.call_llama_cpp(system_prompt, user_prompt, host)
+            return self.call_llama_cpp(system_prompt, user_prompt, host, budget, deadline)
 
         elif provider == "openrouter":
-            return self._enhance_with_openrouter(self.base_path, model, system_prompt, user_prompt)
+            return self._enhance_with_openrouter(self.base_path, model, system_prompt, user_prompt, budget, deadline)
 
         elif provider == "openai":
             return f"[OpenAI NOT IMPLEMENTED]\n{user_prompt}"
@@ -167,42 +251,101 @@ class PromptRefinerNode:
         else:
             raise ValueError("Unsupported provider")
 
+    # =========================
+    # 🔌 TRANSPORT
+    # =========================
+    @staticmethod
+    def _stream(name, url, payload, deadline, headers=None, est_tokens=0):
+        """Streamed POST with connect/read timeouts, bounded retries and the overall deadline."""
+        return call_with_backoff(
+            name,
+            lambda: http_stream(
+                name, url, json=payload, headers=headers,
+                timeout=(CONNECT_TIMEOUT_S, READ_TIMEOUT_S), deadline=deadline,
+            ),
+            est_tokens=est_tokens,
+            max_retries=MAX_RETRIES,
+            deadline=deadline,
+        )
+
+    @staticmethod
+    def _events(r):
+        """JSON events of an NDJSON (Ollama) or SSE (llama.cpp / OpenAI) stream."""
+        for line in r.lines:
+            if line.startswith(":"):
+                continue
+            if line.startswith("data:"):
+                line = line[5:].strip()
+            if line == "[DONE]":
+                break
+            try:
+                ev = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(ev, dict):
+                if ev.get("error"):
+                    raise RuntimeError(f"stream error: {ev['error']}")
+                yield ev
+
     # =========================
     # 🔌 OLLAMA
     # =========================
-    def call_ollama(self, model, system_prompt, user_prompt, host):
+    def call_ollama(self, model, system_prompt, user_prompt, host, budget=None, deadline=None):
 
         url = f"{host}/api/generate"
 
         payload = {
             "model": model,
-            "prompt": f"{system_prompt}\n\n{user_prompt}",
-            "stream": False
+            "prompt": completion_prompt(system_prompt, user_prompt),
+            "stream": True,
+            "keep_alive": OLLAMA_KEEP_ALIVE,
         }
-
-        r = requests.post(url, json=payload)
-        return r.json().get("response", "")
+        if budget:
+            payload["options"] = {"num_predict": budget.max_tokens, "stop": budget.stop}
+
+        # grouped by model: the Creator's model and this one don't swap on every call
+        with residency.slot(host, model) as slot:
+            r = self._stream("ollama", url, payload, deadline)
+            parts, final = [], {}
+            for ev in self._events(r):
+                parts.append(ev.get("response", ""))
+                if ev.get("done"):
+                    final = ev
+            timings = ollama_timings(final)
+            if timings:
+                slot.loaded(timings["load_ms"])
+        record_response(r, "ollama", model, timings, tag="PromptRefiner")
+        return "".join(parts)
 
     # =========================
     # 🔌 LLAMA CPP
     # =========================
-    def call_llama_cpp(self, system_prompt, user_prompt, host):
+    def call_llama_cpp(self, system_prompt, user_prompt, host, budget=None, deadline=None):
 
         url = f"{host}/completion"
 
         payload = {
-            "prompt": f"{system_prompt}\n\n{user_prompt}",
+            "prompt": completion_prompt(system_prompt, user_prompt),
             "temperature": 0.7,
-            "max_tokens": 512
+            "n_predict": budget.max_tokens if budget else 512,
+            "stop": budget.stop if budget else [],
+            "stream": True,
+            **llamacpp_cache_fields(system_prompt),
         }
 
-        r = requests.post(url, json=payload)
-        return r.json().get("content", "")
+        r = self._stream("llamacpp", url, payload, deadline)
+        parts, final = [], {}
+        for ev in self._events(r):
+            parts.append(ev.get("content", ""))
+            if ev.get("stop"):
+                final = ev
+        record_response(r, "llamacpp", final.get("model"), llamacpp_timings(final), tag="PromptRefiner")
+        return "".join(parts)
 
     # =========================
     # 🌐 OPENROUTER (PCN STYLE + SAFE)
     # =========================
-    def _enhance_with_openrouter(self, base_path, model, system_prompt, user_prompt):
+    def _enhance_with_openrouter(self, base_path, model, system_prompt, user_prompt, budget=None, deadline=None):
 
         keys = self._read_api_keys(base_path)
         api_key = keys.get("openrouter", "").strip()
@@ -223,39 +366,32 @@ class PromptRefinerNode:
                 {"role": "user", "content": user_prompt}
             ]
         }
-
-        try:
-            r = requests.post(
-                "https://openrouter.ai/api/v1/chat/completions",
-                headers=headers,
-                json=payload,
-                timeout=120
-            )
-
-            r.raise_for_status()
-
-            data = r.json()
-
-            print("\n[OpenRouter RAW RESPONSE]")
-            print(data)
-            print("="*60)
-
-            # ✅ standard
-            if "choices" in data:
-                return data["choices"][0]["message"]["content"].strip()
-
-            # ❗ fallback
-            if "output" in data:
-                return data["output"]
-
-            if "content" in data:
-                return data["content"]
-
-            return str(data)
-
-        except Exception as e:
-            print(f"[PromptRefiner OpenRouter ERROR] {e}")
-            return user_prompt
+        if budget:
+            payload["max_tokens"] = budget.max_tokens
+            payload["stop"] = budget.stop
+
+        payload["stream"] = True
+
+        # same transport as ollama / llama.cpp: MAX_RETRIES within the deadline
+        r = self._stream(
+            "openrouter", OPENROUTER_URL, payload, deadline, headers=headers,
+            est_tokens=estimate_tokens(system_prompt, user_prompt, max_output=budget.max_tokens if budget else 400),
+        )
+
+        parts = []
+        for ev in self._events(r):
+            if ev.get("usage"):
+                note_usage_from(ev)
+            for choice in ev.get("choices") or []:
+                delta = choice.get("delta") or choice.get("message") or {}
+                parts.append(delta.get("content") or "")
+        content = "".join(parts)
+
+        print("\n[OpenRouter RAW RESPONSE]")
+        print(content)
+        print("="*60)
+
+        return content.strip()
 
     # =========================
     # 🧹 CLEAN OUTPUT
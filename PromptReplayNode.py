@@ -1,24 +1,32 @@
-import os
 import json
 import re
+import threading
+from collections import OrderedDict
+
+try:
+    from .history_writer import history_writer
+    from .history_segments import history_log
+    from .history_index import history_index, entry_id as _content_id
+except ImportError:
+    from history_writer import history_writer
+    from history_segments import history_log
+    from history_index import history_index, entry_id as _content_id
 
 class PromptReplayNode:
     """
     Prompt Replay (V2)
-    - Reads ./logs/prompt_history.jsonl
-    - Builds a human-friendly dropdown of recent entries
-    - Lets you filter by source/json/lora/system
+    - Reads ./logs/prompt_history.jsonl (and its rotated segments in ./logs/history/)
+    - Searchable list of recent entries (web widget + /prompt_creator/history route)
+    - Lets you filter by source/json/lora/system/text (indexed, see history_index)
     - Outputs the exact final_prompt
     """
 
-    # Cache to map dropdown labels -> entry dict
-    _cache_options = []
-    _cache_entries = []
-
-    @staticmethod
-    def _log_path():
-        base_path = os.path.dirname(__file__)
-        return os.path.join(base_path, "logs", "prompt_history.jsonl")
+    # filter key -> (log version, dropdown labels, {entry id: entry}), LRU.
+    # Labels carry a stable entry id, so a pick resolves to the same entry
+    # whatever list another node or a UI refresh built meanwhile.
+    _cache = OrderedDict()
+    _cache_lock = threading.Lock()
+    _cache_keys = 32
 
     @staticmethod
     def _normalize(s: str) -> str:
@@ -34,99 +42,202 @@ class PromptReplayNode:
         return []
 
     @classmethod
-    def _load_entries(cls, max_entries: int, source_filter: str, json_filter: str, lora_filter: str, system_filter: str):
-        path = cls._log_path()
-        if not os.path.exists(path):
-            cls._cache_options = ["(no prompt_history.jsonl found)"]
-            cls._cache_entries = []
-            return
+    def _matches(cls, entries, source_filter: str, json_filter: str, lora_filter: str, system_filter: str, text_filter: str = ""):
+        jf = cls._normalize(json_filter).lower()
+        sf = cls._normalize(system_filter).lower()
+        lf = cls._normalize(lora_filter).lower()
+        tf = cls._normalize(text_filter).lower()
+        for data in entries:
+            # source filter
+            if source_filter != "all":
+                if data.get("source") != source_filter:
+                    continue
 
-        entries = []
-        with open(path, "r", encoding="utf-8") as f:
-            for line in f:
-                line = line.strip()
-                if not line:
+            # json filter (substring, case-insensitive)
+            if jf:
+                world = str(data.get("json_world", "")).lower()
+                if jf not in world:
                     continue
-                try:
-                    data = json.loads(line)
-                except Exception:
+
+            # system filter (substring on enhancer_mode key)
+            if sf:
+                sysmode = str(data.get("system_prompt", "")).lower()
+                if sf not in sysmode:
+                    continue
+
+            # lora filter (substring against triggers)
+            if lf:
+                triggers = ",".join(cls._parse_triggers(data.get("lora_triggers", ""))).lower()
+                if lf not in triggers:
                     continue
 
-                # source filter
-                if source_filter != "all":
-                    if data.get("source") != source_filter:
-                        continue
-
-                # json filter (substring, case-insensitive)
-                jf = cls._normalize(json_filter).lower()
-                if jf:
-                    world = str(data.get("json_world", "")).lower()
-                    if jf not in world:
-                        continue
-
-                # system filter (substring on enhancer_mode key)
-                sf = cls._normalize(system_filter).lower()
-                if sf:
-                    sysmode = str(data.get("system_prompt", "")).lower()
-                    if sf not in sysmode:
-                        continue
-
-                # lora filter (substring against triggers)
-                lf = cls._normalize(lora_filter).lower()
-                if lf:
-                    triggers = ",".join(cls._parse_triggers(data.get("lora_triggers", ""))).lower()
-                    if lf not in triggers:
-                        continue
+            # text filter (substring in the prompt itself)
+            if tf:
+                if tf not in str(data.get("final_prompt", "")).lower():
+                    continue
 
+            yield data
+
+    @classmethod
+    def _scan_entries(cls, max_entries, source_filter, json_filter, lora_filter, system_filter, text_filter):
+        # newest first, from the cached tail of the log backwards: stops as
+        # soon as max_entries match, older segments are only opened if needed
+        newest = history_log.newest(world=cls._normalize(json_filter), source=source_filter)
+        entries = []
+        try:
+            for data in cls._matches(newest, source_filter, json_filter, lora_filter, system_filter, text_filter):
                 entries.append(data)
+                if len(entries) >= max_entries:
+                    break
+        finally:
+            newest.close()
+        return entries[::-1]
+
+    @classmethod
+    def _query(cls, limit, offset, source_filter, json_filter, lora_filter, system_filter, text_filter):
+        """Matching entries `offset` to `offset + limit` counted from the newest, oldest first."""
+        if history_index.available():
+            try:
+                return history_index.query(
+                    limit,
+                    offset=offset,
+                    source=source_filter,
+                    world=cls._normalize(json_filter),
+                    system=cls._normalize(system_filter),
+                    lora=cls._normalize(lora_filter),
+                    text=cls._normalize(text_filter),
+                )
+            except Exception as e:
+                print(f"[PromptReplay] history index failed, scanning the log: {e}")
+        entries = cls._scan_entries(offset + limit, source_filter, json_filter, lora_filter, system_filter, text_filter)
+        return entries[:len(entries) - offset] if offset else entries
+
+    @staticmethod
+    def _entry_id(e) -> str:
+        """Stable id of a log entry (history_index.entry_id): indexed, so a pick is one lookup."""
+        return _content_id(e)
+
+    @classmethod
+    def _load_entries(cls, max_entries: int, source_filter: str, json_filter: str, lora_filter: str, system_filter: str, text_filter: str = ""):
+        """(dropdown labels, {entry id: entry} newest first) for these filters, cached until the log changes."""
+        # runs logged by this process may still be queued
+        history_writer.flush()
+        key = (int(max_entries), source_filter, cls._normalize(json_filter), cls._normalize(lora_filter),
+               cls._normalize(system_filter), cls._normalize(text_filter))
+        version = history_log.version()
+        with cls._cache_lock:
+            hit = cls._cache.get(key)
+            if hit is not None and hit[0] == version:
+                cls._cache.move_to_end(key)
+                return hit[1], hit[2]
+
+        options, by_id = cls._build_entries(*key)
+        with cls._cache_lock:
+            cls._cache[key] = (version, options, by_id)
+            cls._cache.move_to_end(key)
+            while len(cls._cache) > cls._cache_keys:
+                cls._cache.popitem(last=False)
+        return options, by_id
+
+    @classmethod
+    def _build_entries(cls, max_entries, source_filter, json_filter, lora_filter, system_filter, text_filter):
+        if not history_log.exists():
+            return ["(no prompt_history.jsonl found)"], {}
+
+        entries = cls._query(max_entries, 0, source_filter, json_filter, lora_filter, system_filter, text_filter)
 
         if not entries:
-            cls._cache_options = ["(no entries match filters)"]
-            cls._cache_entries = []
-            return
+            return ["(no entries match filters)"], {}
 
         # take last N, most recent first
         entries = entries[-max_entries:][::-1]
 
         options = []
-        for idx, e in enumerate(entries):
-            ts = e.get("timestamp", "unknown-time")
-            world = e.get("json_world", "unknown-json")
-            sysmode = e.get("system_prompt", "standard")
-            src = e.get("source", "generated")
-            triggers = cls._parse_triggers(e.get("lora_triggers", ""))
-            triggers_short = ""
-            if triggers:
-                # keep it readable
-                show = triggers[:3]
-                triggers_short = " | LoRA: " + ", ".join(show) + ("…" if len(triggers) > 3 else "")
-
-            # label format: "0 | 2026-01-21T22:47:03 | Modern_Goth_Urban.json | enhancer_mode | generated | LoRA: ..."
-            label = f"{idx} | {ts} | {world} | {sysmode} | {src}{triggers_short}"
-            options.append(label)
-
-        cls._cache_options = options
-        cls._cache_entries = entries
+        by_id = {}
+        for e in entries:
+            entry_id = cls._entry_id(e)
+            if entry_id in by_id:
+                continue   # the very same entry twice: one pick is enough
+            by_id[entry_id] = e
+            options.append(f"#{entry_id} | {cls._label(e)}")
+
+        return options, by_id
+
+    @classmethod
+    def _label(cls, e) -> str:
+        # "2026-01-21T22:47:03 | Modern_Goth_Urban.json | enhancer_mode | generated | LoRA: ..."
+        ts = e.get("timestamp", "unknown-time")
+        world = e.get("json_world", "unknown-json")
+        sysmode = e.get("system_prompt", "standard")
+        src = e.get("source", "generated")
+        triggers = cls._parse_triggers(e.get("lora_triggers", ""))
+        triggers_short = ""
+        if triggers:
+            # keep it readable
+            show = triggers[:3]
+            triggers_short = " | LoRA: " + ", ".join(show) + ("…" if len(triggers) > 3 else "")
+        return f"{ts} | {world} | {sysmode} | {src}{triggers_short}"
+
+    @classmethod
+    def search(cls, offset=0, limit=20, source_filter="all", json_filter="", lora_filter="", system_filter="", text_filter=""):
+        """One page of matching entries, newest first (the history route of the replay widget)."""
+        history_writer.flush()
+        if not history_log.exists():
+            return {"entries": [], "offset": offset, "has_more": False}
+        entries = cls._query(limit + 1, offset, source_filter, json_filter, lora_filter, system_filter, text_filter)[::-1]
+        page = []
+        for e in entries[:limit]:
+            prompt = str(e.get("final_prompt", "") or "")
+            page.append({
+                "id": cls._entry_id(e),
+                "label": cls._label(e),
+                "preview": prompt[:160] + ("…" if len(prompt) > 160 else ""),
+            })
+        return {"entries": page, "offset": offset, "has_more": len(entries) > limit}
+
+    @classmethod
+    def _find_entry(cls, entry_id):
+        """An entry outside the cached lists (older, or other filters), by id: an index lookup, else a scan."""
+        if history_index.available():
+            try:
+                return history_index.find(entry_id)
+            except Exception as e:
+                print(f"[PromptReplay] history index failed, scanning the log: {e}")
+        newest = history_log.newest()
+        try:
+            for e in newest:
+                if cls._entry_id(e) == entry_id:
+                    return e
+        finally:
+            newest.close()
+        return None
+
+    @classmethod
+    def _cached_entry(cls, entry_id):
+        with cls._cache_lock:
+            for _, _, by_id in cls._cache.values():
+                if entry_id in by_id:
+                    return by_id[entry_id]
+        return None
 
     @classmethod
     def INPUT_TYPES(cls):
-        # Defaults for initial cache build
-        # Note: dropdown list updates when ComfyUI reloads nodes (or restart).
-        cls._load_entries(
-            max_entries=80,
-            source_filter="all",
-            json_filter="",
-            lora_filter="",
-            system_filter=""
-        )
+        # pick holds an entry id ("#<id> | label", or the bare id): the replay widget (web/)
+        # searches the history through the /prompt_creator/history route as you type, so
+        # no entry list is built here or sent with the node definitions. Without the
+        # widget, paste an id (meta output of an earlier run) or leave it empty for the newest match
         return {
             "required": {
-                "pick": (cls._cache_options if cls._cache_options else ["(empty)"],),
+                "pick": ("STRING", {"default": "", "multiline": False}),
                 "max_entries": ("INT", {"default": 80, "min": 1, "max": 500, "step": 1}),
                 "source_filter": (["all", "generated", "history_lock"],),
                 "json_filter": ("STRING", {"default": "", "multiline": False}),
                 "lora_filter": ("STRING", {"default": "", "multiline": False}),
                 "system_filter": ("STRING", {"default": "", "multiline": False}),
+            },
+            "optional": {
+                # searches the prompt text itself (full-text index when available)
+                "text_filter": ("STRING", {"default": "", "multiline": False}),
             }
         }
 
@@ -135,32 +246,44 @@ class PromptReplayNode:
     FUNCTION = "replay"
     CATEGORY = "Prompt Tools"
 
-    def replay(self, pick, max_entries, source_filter, json_filter, lora_filter, system_filter):
-        # Rebuild cache using current filters
-        self.__class__._load_entries(
-            max_entries=int(max_entries),
-            source_filter=str(source_filter),
-            json_filter=str(json_filter),
-            lora_filter=str(lora_filter),
-            system_filter=str(system_filter),
-        )
-
-        if not self.__class__._cache_entries:
-            print("[PromptReplay] No entries available.")
-            return ("", "no_entries")
-
-        # "idx | ..." -> idx
-        m = re.match(r"^\s*(\d+)\s*\|", str(pick))
-        if not m:
-            print("[PromptReplay] Could not parse selection index.")
-            return ("", "bad_selection")
-
-        idx = int(m.group(1))
-        if idx < 0 or idx >= len(self.__class__._cache_entries):
-            print("[PromptReplay] Selection index out of range.")
-            return ("", "out_of_range")
-
-        e = self.__class__._cache_entries[idx]
+    def replay(self, pick, max_entries, source_filter, json_filter, lora_filter, system_filter, text_filter=""):
+        cls = self.__class__
+        pick = str(pick).strip()
+        if pick.startswith("("):
+            pick = ""   # "(empty)" of workflows saved with the old dropdown: newest match
+
+        # "#<entry id> | ..." or a bare id -> that entry, whatever the filters
+        m = re.match(r"^#([0-9a-f]+)\s*(\||$)", pick) or re.match(r"^([0-9a-f]{16})$", pick)
+        if m:
+            entry_id = m.group(1)
+            e = cls._cached_entry(entry_id) or cls._find_entry(entry_id)
+            if e is None:
+                print("[PromptReplay] Selected entry is no longer in the history.")
+                return ("", "not_found")
+        else:
+            # empty: newest match; "idx | ..." from workflows saved before entry ids: position in the list.
+            # Served from the per-filter cache unless the log changed
+            options, by_id = cls._load_entries(
+                max_entries=int(max_entries),
+                source_filter=str(source_filter),
+                json_filter=str(json_filter),
+                lora_filter=str(lora_filter),
+                system_filter=str(system_filter),
+                text_filter=str(text_filter),
+            )
+            if not by_id:
+                print("[PromptReplay] No entries available.")
+                return ("", "no_entries")
+            m = re.match(r"^(\d+)\s*\|", pick)
+            if pick and not m:
+                print("[PromptReplay] Could not parse selection.")
+                return ("", "bad_selection")
+            idx = int(m.group(1)) if m else 0
+            if idx < 0 or idx >= len(by_id):
+                print("[PromptReplay] Selection index out of range.")
+                return ("", "out_of_range")
+            e = list(by_id.values())[idx]
+
         prompt = e.get("final_prompt", "") or ""
 
         meta = {
@@ -172,6 +295,7 @@ class PromptReplayNode:
             "lora_triggers": e.get("lora_triggers"),
             "source": e.get("source"),
             "node_version": e.get("node_version"),
+            "entry_id": cls._entry_id(e),
         }
 
         print(f"[PromptReplay] Replayed: {meta.get('timestamp')} | {meta.get('json_world')} | {meta.get('source')}")
@@ -71,7 +71,35 @@ from .PromptReplayNode import PromptReplayNode
 from .PromptBuilderNode import PromptBuilderNode
 from .PromptTagsExtractorNode import PromptTagsExtractorNode
 from .PromptRefinerNode import PromptRefinerNode
+from .enhancer_residency import residency
+from .enhancer_jobs import job_pool
+from .history_routes import register as register_history_route
 
+# -------------------------
+# Ollama warm-up (background, models used last time or PCN_OLLAMA_WARMUP)
+# -------------------------
+
+residency.warm_up_in_background()
+
+# -------------------------
+# Durable enhancement jobs left pending by the last run
+# -------------------------
+
+job_pool.resume()
+
+# -------------------------
+# History search route for the Prompt Replay widget
+# -------------------------
+
+register_history_route()
+
+
+# -------------------------
+# Frontend extensions (Prompt Builder world options, Prompt Replay search),
+# served under /extensions/PromptCreatorNode/
+# -------------------------
+
+WEB_DIRECTORY = "./web/extensions/PromptCreatorNode"
 
 
 # -------------------------
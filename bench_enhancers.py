@@ -0,0 +1,215 @@
+"""
+End-to-end enhancer benchmark.
+
+Runs PromptCreatorNode.generate_prompt and PromptRefinerNode.refine against the
+bundled stub server (or a real host) at several concurrency levels and reports
+throughput and p50 / p95 / p99 latency.
+
+The nodes run from a throw-away copy of this folder, so the benchmark never
+touches your logs/ and history/.
+
+    python bench_enhancers.py
+    python bench_enhancers.py --backends ollama llamacpp --concurrency 1 4 16 --requests 64
+    python bench_enhancers.py --latency-ms 300 --tokens-per-s 25 --error-rate 0.05
+    python bench_enhancers.py --host http://10.10.10.2:11434 --model qwen3:8b --backends ollama
+"""
+import os
+import sys
+import json
+import time
+import atexit
+import shutil
+import argparse
+import contextlib
+import tempfile
+import importlib
+from concurrent.futures import ThreadPoolExecutor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# node backend name -> refiner provider name
+REFINER_PROVIDER = {"ollama": "ollama", "llamacpp": "llama_cpp", "openrouter": "openrouter"}
+
+
+def make_sandbox(unlimited=False):
+    """Copies the nodes + their data into a temp dir and imports them from there."""
+    root = tempfile.mkdtemp(prefix="pcn_bench_")
+    for fn in os.listdir(HERE):
+        src = os.path.join(HERE, fn)
+        if os.path.isfile(src) and (fn.endswith(".py") or fn.endswith(".json")) and fn != "__init__.py":
+            shutil.copy2(src, root)
+    shutil.copytree(
+        os.path.join(HERE, "JSON_DATA"), os.path.join(root, "JSON_DATA"),
+        ignore=shutil.ignore_patterns("OLD_VERSION"),
+    )
+    with open(os.path.join(root, "api_keys.txt"), "w", encoding="utf-8") as f:
+        f.write("openrouter=stub\n")
+    if unlimited:
+        # the stub is not a real provider: measure the nodes, not our rate limiter
+        with open(os.path.join(root, "rate_limits.json"), "w", encoding="utf-8") as f:
+            json.dump({p: {"rpm": 0, "tpm": 0} for p in ("openai", "openrouter", "cohere", "gemini")}, f)
+    sys.path.insert(0, root)
+    return root
+
+
+def percentile(ordered, q):
+    if not ordered:
+        return None
+    i = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+    return ordered[i]
+
+
+def run_level(fn, n, concurrency, verbose=False):
+    lat = []
+    errors = 0
+    quiet = open(os.devnull, "w") if not verbose else None
+
+    def one(i):
+        t0 = time.perf_counter()
+        fn(i)
+        return time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    with contextlib.redirect_stdout(quiet) if quiet else contextlib.nullcontext():
+        with ThreadPoolExecutor(max_workers=concurrency) as ex:
+            for fut in [ex.submit(one, i) for i in range(n)]:
+                try:
+                    lat.append(fut.result())
+                except Exception:
+                    errors += 1
+    wall = time.perf_counter() - t0
+    if quiet:
+        quiet.close()
+
+    lat.sort()
+    ms = 1000.0
+    return {
+        "requests": n,
+        "concurrency": concurrency,
+        "errors": errors,
+        "wall_s": round(wall, 3),
+        "throughput_rps": round(len(lat) / wall, 2) if wall else None,
+        "p50_ms": round(percentile(lat, 0.50) * ms, 1) if lat else None,
+        "p95_ms": round(percentile(lat, 0.95) * ms, 1) if lat else None,
+        "p99_ms": round(percentile(lat, 0.99) * ms, 1) if lat else None,
+    }
+
+
+def creator_kwargs(node_cls, world, backend, host, model, pack_size=1, fuse_refine="off"):
+    kw = {}
+    for k, spec in node_cls.INPUT_TYPES()["required"].items():
+        opts = spec[1] if len(spec) > 1 else {}
+        kw[k] = spec[0][0] if isinstance(spec[0], list) else opts.get("default", "")
+    kw.update(
+        json_name=world or kw["json_name"],
+        use_enhancer=backend,
+        ollama_host=host,
+        external_identity="",
+        show_pose_preview=False,
+        enhancer_pack_size=pack_size,
+        fuse_refine=fuse_refine,
+    )
+    if model:
+        kw["ollama_model"] = model
+        kw["openrouter_model"] = model
+    return kw
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark the enhancer paths of PromptCreatorNode / PromptRefinerNode")
+    ap.add_argument("--host", default="", help="real backend host (default: start the stub server)")
+    ap.add_argument("--model", default="")
+    ap.add_argument("--world", default="", help="JSON world for the Creator (default: first one)")
+    ap.add_argument("--backends", nargs="+", default=["ollama", "llamacpp", "openrouter"])
+    ap.add_argument(
+        "--nodes", nargs="+", default=["creator", "refiner"],
+        help="creator, refiner, pipeline (Creator then Refiner, two requests), fused (Creator with fuse_refine, Refiner passes through)",
+    )
+    ap.add_argument("--concurrency", nargs="+", type=int, default=[1, 2, 4, 8])
+    ap.add_argument("--requests", type=int, default=32, help="requests per concurrency level")
+    ap.add_argument("--latency-ms", type=float, default=50.0)
+    ap.add_argument("--tokens-per-s", type=float, default=200.0)
+    ap.add_argument("--prompt-tps", type=float, default=2000.0)
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    ap.add_argument("--pack-size", type=int, default=1, help="Creator enhancer_pack_size (seeds per request)")
+    ap.add_argument("--out", default="", help="write results as JSON")
+    ap.add_argument("--verbose", action="store_true", help="keep the nodes' own prints")
+    a = ap.parse_args()
+
+    stub = None
+    host = a.host.rstrip("/")
+    if not host:
+        from stub_llm_server import StubServer, StubConfig
+        stub = StubServer(StubConfig(
+            latency_ms=a.latency_ms, tokens_per_s=a.tokens_per_s,
+            prompt_tps=a.prompt_tps, error_rate=a.error_rate, retry_after=0,
+        )).start()
+        host = stub.url
+        print(f"[Bench] stub server on {host}")
+
+    # read at import time by the nodes
+    os.environ["PCN_OPENROUTER_URL"] = f"{host}/v1/chat/completions"
+    sandbox = make_sandbox(unlimited=stub is not None)
+    # registered before the nodes are imported, so it runs after their own atexit hooks
+    atexit.register(shutil.rmtree, sandbox, True)
+    creator_mod = importlib.import_module("PromptCreatorNode")
+    refiner_mod = importlib.import_module("PromptRefinerNode")
+    fusion_mod = importlib.import_module("enhancer_fusion")
+
+    results = []
+    # fresh seeds for every level: packed / cached results must not leak across rows
+    seed_offset = [0]
+    try:
+        for backend in a.backends:
+            for node in a.nodes:
+                if node == "creator":
+                    creator = creator_mod.PromptCreatorNode()
+                    base_kw = creator_kwargs(creator_mod.PromptCreatorNode, a.world, backend, host, a.model, a.pack_size)
+
+                    def fn(i, creator=creator, base_kw=base_kw):
+                        creator.generate_prompt(**dict(base_kw, seed=seed_offset[0] + i + 1))
+                elif node in ("pipeline", "fused"):
+                    # end to end: Creator -> Refiner ("balanced"), two requests vs one
+                    creator = creator_mod.PromptCreatorNode()
+                    refiner = refiner_mod.PromptRefinerNode()
+                    provider = REFINER_PROVIDER.get(backend, backend)
+                    base_kw = creator_kwargs(
+                        creator_mod.PromptCreatorNode, a.world, backend, host, a.model, a.pack_size,
+                        fuse_refine="balanced" if node == "fused" else "off",
+                    )
+
+                    def fn(i, creator=creator, refiner=refiner, provider=provider, base_kw=base_kw):
+                        prompt = creator.generate_prompt(**dict(base_kw, seed=seed_offset[0] + i + 1))[0]
+                        refiner.refine(prompt, True, provider, "balanced", model=a.model or "stub", host=host)
+                else:
+                    refiner = refiner_mod.PromptRefinerNode()
+                    provider = REFINER_PROVIDER.get(backend, backend)
+                    seed_text = "a beautiful woman, gothic cathedral, candlelight, velvet dress, dramatic shadows"
+
+                    def fn(i, refiner=refiner, provider=provider):
+                        refiner.refine(f"{seed_text}, variant {i}", True, provider, "balanced", model=a.model or "stub", host=host)
+
+                for c in a.concurrency:
+                    # the stub answers alike across rows: don't let "pipeline" pass through "fused" prompts
+                    fusion_mod.fused_registry.clear()
+                    row = run_level(fn, a.requests, c, a.verbose)
+                    seed_offset[0] += a.requests
+                    row.update(node=node, backend=backend)
+                    results.append(row)
+                    print(
+                        f"[Bench] {node:8s} {backend:10s} c={c:<3d} "
+                        f"{row['throughput_rps']} req/s  p50 {row['p50_ms']} ms  "
+                        f"p95 {row['p95_ms']} ms  p99 {row['p99_ms']} ms  errors {row['errors']}"
+                    )
+    finally:
+        if stub:
+            stub.stop()
+
+    if a.out:
+        with open(a.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"[Bench] wrote {a.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,347 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import datetime
+import threading
+import concurrent.futures
+
+import requests
+
+try:
+    from .enhancer_clients import http_session
+    from .enhancer_telemetry import current_call
+except ImportError:
+    from enhancer_clients import http_session
+    from enhancer_telemetry import current_call
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+# =========================
+# ⚡ ASYNC NODE EXECUTION
+# =========================
+# On a ComfyUI that runs coroutine node functions, the network-bound nodes
+# expose an async FUNCTION: the node body runs in a worker thread, and its
+# HTTP calls are handed to aiohttp on ComfyUI's event loop, so the loop is
+# never blocked and an interrupted prompt aborts the request in flight.
+# Anywhere else (older ComfyUI, scripts, the prefetch worker) the same calls
+# go through requests, unchanged.
+
+INTERRUPT_POLL_S = 0.25
+
+
+def _comfy_runs_async_nodes():
+    forced = os.environ.get("PCN_ASYNC_NODES", "").strip().lower()
+    if forced in ("0", "false", "no", "off"):
+        return False
+    if aiohttp is None:
+        return False
+    if forced in ("1", "true", "yes", "on"):
+        return True
+    # only look, never import: this is ComfyUI's own module
+    execution = sys.modules.get("execution")
+    return execution is not None and hasattr(execution, "_async_map_node_over_list")
+
+
+ASYNC_NODES = _comfy_runs_async_nodes()
+
+
+class RequestCancelled(Exception):
+    """The prompt was interrupted while this request was in flight."""
+
+
+def _interrupted():
+    mm = sys.modules.get("comfy.model_management")
+    try:
+        return bool(mm and mm.processing_interrupted())
+    except Exception:
+        return False
+
+
+def _raise_interrupt():
+    mm = sys.modules.get("comfy.model_management")
+    if mm is not None and hasattr(mm, "throw_exception_if_processing_interrupted"):
+        mm.throw_exception_if_processing_interrupted()
+    raise RequestCancelled("interrupted")
+
+
+# ---------- binding: worker thread <-> event loop ----------
+_bound = threading.local()
+
+
+class LoopBinding:
+    """Ties one node execution (worker thread) to the event loop that awaits it."""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.cancelled = threading.Event()
+        self.lock = threading.Lock()
+        self.inflight = set()
+
+    def submit(self, coro):
+        if self.cancelled.is_set():
+            coro.close()
+            raise RequestCancelled("interrupted")
+        fut = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        with self.lock:
+            self.inflight.add(fut)
+        try:
+            return fut.result()
+        except concurrent.futures.CancelledError:
+            raise RequestCancelled("interrupted")
+        finally:
+            with self.lock:
+                self.inflight.discard(fut)
+
+    def cancel(self):
+        self.cancelled.set()
+        with self.lock:
+            futs = list(self.inflight)
+        for fut in futs:
+            fut.cancel()
+
+
+def current_binding():
+    return getattr(_bound, "binding", None)
+
+
+def sleep(seconds):
+    """time.sleep that an interrupt cuts short (RequestCancelled)."""
+    binding = current_binding()
+    if binding is None:
+        time.sleep(seconds)
+        return
+    if binding.cancelled.wait(seconds):
+        raise RequestCancelled("interrupted")
+
+
+def interrupted():
+    """True once the running node execution was interrupted (its binding, or ComfyUI's flag)."""
+    binding = current_binding()
+    return (binding is not None and binding.cancelled.is_set()) or _interrupted()
+
+
+def _run_bound(binding, fn, args, kwargs):
+    _bound.binding = binding
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        _bound.binding = None
+
+
+async def run_node(fn, *args, **kwargs):
+    """
+    Awaitable wrapper for a synchronous node function.
+    Polls ComfyUI's interrupt flag and aborts the node's HTTP calls when set.
+    """
+    loop = asyncio.get_running_loop()
+    binding = LoopBinding(loop)
+    fut = loop.run_in_executor(None, _run_bound, binding, fn, args, kwargs)
+    try:
+        while True:
+            done, _ = await asyncio.wait({fut}, timeout=INTERRUPT_POLL_S)
+            if done:
+                break
+            if _interrupted():
+                print("[PromptCreatorNode] interrupted: aborting in-flight enhancer request")
+                binding.cancel()
+                # don't wait for the worker: it may be blocked outside submit() / sleep()
+                break
+    except asyncio.CancelledError:
+        binding.cancel()
+        raise
+    if binding.cancelled.is_set():
+        # the worker finishes on its own, unawaited; its RequestCancelled is expected
+        fut.add_done_callback(lambda f: f.cancelled() or f.exception())
+        _raise_interrupt()
+    return fut.result()
+
+
+# ---------- HTTP ----------
+class AsyncResponse:
+    """The part of requests.Response the nodes use, filled from aiohttp."""
+
+    def __init__(self, url, status, headers, content, elapsed):
+        self.url = url
+        self.status_code = status
+        self.headers = headers
+        self.content = content
+        self.elapsed = datetime.timedelta(seconds=elapsed)
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.content or b"null")
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise requests.HTTPError(f"{self.status_code} Error for url: {self.url}", response=self)
+
+
+_sessions = {}   # loop -> aiohttp.ClientSession
+_sessions_lock = threading.Lock()
+
+
+def _client_timeout(timeout):
+    if timeout is None:
+        return aiohttp.ClientTimeout(total=None)
+    if isinstance(timeout, (tuple, list)):
+        connect, read = timeout
+        return aiohttp.ClientTimeout(total=None, sock_connect=connect, sock_read=read)
+    return aiohttp.ClientTimeout(total=None, sock_connect=timeout, sock_read=timeout)
+
+
+async def _session():
+    loop = asyncio.get_running_loop()
+    with _sessions_lock:
+        s = _sessions.get(loop)
+        if s is None or s.closed:
+            s = _sessions[loop] = aiohttp.ClientSession()
+        return s
+
+
+async def _apost(url, json_body, headers, timeout):
+    t0 = time.perf_counter()
+    session = await _session()
+    async with session.post(url, json=json_body, headers=headers, timeout=_client_timeout(timeout)) as resp:
+        content = await resp.read()
+        return AsyncResponse(str(resp.url), resp.status, dict(resp.headers), content, time.perf_counter() - t0)
+
+
+def _timeout_error(e):
+    """aiohttp timeout -> the requests exception call_with_backoff knows (only connect timeouts are retried)."""
+    connect = getattr(aiohttp, "ConnectionTimeoutError", None)
+    if connect is not None and isinstance(e, connect):
+        return requests.ConnectTimeout(str(e) or "connect timed out")
+    return requests.ReadTimeout(str(e) or "timed out")
+
+
+def http_post(name, url, json=None, headers=None, timeout=120):
+    """
+    POST through aiohttp when this thread runs an async node execution,
+    else through the pooled requests session `name`.
+    Returns a requests.Response (or a compatible AsyncResponse).
+    """
+    binding = current_binding()
+    if binding is None:
+        return http_session(name).post(url, json=json, headers=headers, timeout=timeout)
+    try:
+        return binding.submit(_apost(url, json, headers, timeout))
+    except asyncio.TimeoutError as e:
+        raise _timeout_error(e)
+    except aiohttp.ClientConnectionError as e:
+        raise requests.ConnectionError(str(e))
+
+
+# ---------- streaming ----------
+class DeadlineExceeded(Exception):
+    """The overall deadline of a streamed request passed."""
+
+
+class StreamedResponse:
+    """Status, headers and the non-empty lines of a streamed answer."""
+
+    def __init__(self, url, status, headers, lines, ttft, elapsed):
+        self.url = url
+        self.status_code = status
+        self.headers = headers
+        self.lines = lines
+        self.ttft = ttft
+        self.elapsed = datetime.timedelta(seconds=elapsed)
+
+
+def _remaining(deadline):
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def _check_status(url, status, headers, body):
+    if status >= 400:
+        r = AsyncResponse(url, status, headers, body, 0.0)
+        r.raise_for_status()
+
+
+async def _astream(url, json_body, headers, timeout, deadline):
+    t0 = time.perf_counter()
+    session = await _session()
+    async with session.post(url, json=json_body, headers=headers, timeout=_client_timeout(timeout)) as resp:
+        if resp.status >= 400:
+            _check_status(str(resp.url), resp.status, dict(resp.headers), await resp.read())
+        lines, ttft = [], None
+        while True:
+            left = _remaining(deadline)
+            if left is not None and left <= 0:
+                raise DeadlineExceeded(f"deadline exceeded after {time.perf_counter() - t0:.1f}s")
+            try:
+                raw = await asyncio.wait_for(resp.content.readline(), left)
+            except asyncio.TimeoutError:
+                if _remaining(deadline) is not None and _remaining(deadline) <= 0:
+                    raise DeadlineExceeded(f"deadline exceeded after {time.perf_counter() - t0:.1f}s")
+                raise
+            if not raw:
+                break
+            line = raw.decode("utf-8", errors="replace").strip()
+            if line:
+                if ttft is None:
+                    ttft = time.perf_counter() - t0
+                lines.append(line)
+        return StreamedResponse(str(resp.url), resp.status, dict(resp.headers), lines, ttft, time.perf_counter() - t0)
+
+
+def _stream_sync(name, url, json_body, headers, timeout, deadline):
+    t0 = time.perf_counter()
+    r = http_session(name).post(url, json=json_body, headers=headers, timeout=timeout, stream=True)
+    try:
+        if r.status_code >= 400:
+            r.raise_for_status()
+        lines, ttft = [], None
+        # the read timeout bounds silence between chunks, the deadline the whole answer
+        for raw in r.iter_lines():
+            left = _remaining(deadline)
+            if left is not None and left <= 0:
+                raise DeadlineExceeded(f"deadline exceeded after {time.perf_counter() - t0:.1f}s")
+            line = raw.decode("utf-8", errors="replace").strip() if raw else ""
+            if line:
+                if ttft is None:
+                    ttft = time.perf_counter() - t0
+                lines.append(line)
+        return StreamedResponse(url, r.status_code, dict(r.headers), lines, ttft, time.perf_counter() - t0)
+    finally:
+        r.close()
+
+
+def http_stream(name, url, json=None, headers=None, timeout=(5, 60), deadline=None):
+    """
+    Streamed POST; returns a StreamedResponse once the answer is complete.
+    timeout: (connect, read) like requests; deadline: time.monotonic() limit
+    for the whole answer, raises DeadlineExceeded past it.
+    """
+    left = _remaining(deadline)
+    if left is not None:
+        if left <= 0:
+            raise DeadlineExceeded("deadline exceeded before the request")
+        # never wait on a silent socket past the deadline
+        connect, read = timeout if isinstance(timeout, (tuple, list)) else (timeout, timeout)
+        timeout = (min(connect, left), min(read, left))
+    binding = current_binding()
+    if binding is None:
+        resp = _stream_sync(name, url, json, headers, timeout, deadline)
+    else:
+        try:
+            resp = binding.submit(_astream(url, json, headers, timeout, deadline))
+        except asyncio.TimeoutError as e:
+            raise _timeout_error(e)
+        except aiohttp.ClientConnectionError as e:
+            raise requests.ConnectionError(str(e))
+    current_call().set_ttft(resp.ttft)
+    return resp
@@ -0,0 +1,208 @@
+import os
+import json
+import math
+import time
+import atexit
+import threading
+
+try:
+    from .enhancer_telemetry import register_snapshot
+except ImportError:
+    from enhancer_telemetry import register_snapshot
+
+
+# =========================
+# 🎯 OUTPUT TOKEN BUDGET
+# =========================
+# enhancer_words_min/max -> per-backend generation caps + stop sequences.
+# The words-per-token ratio is learned per backend/model from past runs
+# (persisted in logs/enhancer_budget.json), and every run is checked for
+# over- / under-shoot against the requested word range.
+
+DEFAULT_WORDS_PER_TOKEN = 0.75
+SLACK = 1.2            # headroom over the upper word bound
+MIN_TOKENS = 64
+EMA_ALPHA = 0.2
+
+# only markers of "extra text after the prompt" (max 4 for OpenAI)
+STOP_SEQUENCES = ["\n\nNote:", "\n\n---", "\n\nExplanation", "\n\nThis prompt"]
+
+# thinking models spend output tokens before the answer
+REASONING_HINTS = ("qwen3", "deepseek-r1", "r1:", "think", "reason", "magistral", "gemini-2.5", "o1", "o3", "o4-", "gpt-5")
+REASONING_ALLOWANCE = 2048
+
+SAVE_INTERVAL_S = 30.0
+
+
+def word_range(words_mode, wmin, wmax):
+    """
+    Same ranges _build_enhancer_user_prompt asks for.
+    Returns (lo, hi); lo is None in auto mode (only capped by wmax).
+    """
+    try:
+        wmin = int(wmin)
+    except Exception:
+        wmin = 140
+    try:
+        wmax = int(wmax)
+    except Exception:
+        wmax = 220
+
+    wmin = max(20, min(wmin, 600))
+    wmax = max(20, min(wmax, 800))
+    if wmax < wmin:
+        wmax = wmin
+
+    mode = (words_mode or "auto").strip().lower()
+    if mode == "min":
+        lo = max(20, wmin - 10)
+        return lo, max(lo + 10, wmin + 20)
+    if mode == "max":
+        lo = max(30, wmax - 30)
+        return lo, max(lo + 10, wmax)
+    return None, wmax
+
+
+def is_reasoning_model(model):
+    m = (model or "").lower()
+    return any(h in m for h in REASONING_HINTS)
+
+
+class Budget:
+
+    def __init__(self, key, lo, hi, max_tokens, stop, words_per_token):
+        self.key = key
+        self.lo = lo
+        self.hi = hi
+        self.max_tokens = max_tokens
+        self.stop = stop
+        self.words_per_token = words_per_token
+
+
+class BudgetGovernor:
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(os.path.dirname(__file__), "logs", "enhancer_budget.json")
+        self.lock = threading.Lock()
+        self.ratios = None   # key -> {"wpt": float, "runs": int}
+        self.counters = {}
+        self.last_save = 0.0
+        self.dirty = False
+
+    def _load(self):
+        if self.ratios is not None:
+            return
+        self.ratios = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if isinstance(data, dict):
+                    self.ratios = {k: v for k, v in data.items() if isinstance(v, dict) and v.get("wpt")}
+            except Exception as e:
+                print(f"[EnhancerBudget] {self.path} ignored: {e}")
+
+    @staticmethod
+    def _key(backend, model):
+        return f"{backend}:{model or '-'}"
+
+    def words_per_token(self, backend, model):
+        with self.lock:
+            self._load()
+            row = self.ratios.get(self._key(backend, model))
+            return float(row["wpt"]) if row else DEFAULT_WORDS_PER_TOKEN
+
+    def plan(self, backend, model, lo, hi, items=1):
+        """items > 1: one request answering several prompts (JSON array)."""
+        wpt = self.words_per_token(backend, model)
+        max_tokens = max(MIN_TOKENS, int(math.ceil(hi * items / wpt * SLACK)))
+        if items > 1:
+            max_tokens += 8 * items
+        stop = list(STOP_SEQUENCES)
+        if is_reasoning_model(model) or backend == "gemini":
+            max_tokens += REASONING_ALLOWANCE
+        return Budget(self._key(backend, model), lo, hi, max_tokens, stop, wpt)
+
+    def plan_words(self, backend, model, words_mode, wmin, wmax):
+        lo, hi = word_range(words_mode, wmin, wmax)
+        return self.plan(backend, model, lo, hi)
+
+    def observe(self, budget, text, tokens_out=None, tag="PromptCreator"):
+        """Learns words/token and reports over/under-shoot. Returns the verdict."""
+        words = len((text or "").split())
+        if not words:
+            return "empty"
+
+        verdict = "ok"
+        if tokens_out and tokens_out >= budget.max_tokens * 0.98:
+            verdict = "truncated"
+        elif budget.hi and words > budget.hi:
+            verdict = "over"
+        elif budget.lo and words < budget.lo:
+            verdict = "under"
+
+        with self.lock:
+            self._load()
+            # truncated output says nothing reliable about the ratio
+            if tokens_out and verdict != "truncated":
+                row = self.ratios.setdefault(budget.key, {"wpt": DEFAULT_WORDS_PER_TOKEN, "runs": 0})
+                ratio = words / float(tokens_out)
+                if 0.2 <= ratio <= 2.0:
+                    row["wpt"] = ratio if row["runs"] == 0 else (1 - EMA_ALPHA) * row["wpt"] + EMA_ALPHA * ratio
+                    row["runs"] += 1
+                    self.dirty = True
+
+            c = self.counters.setdefault(budget.key, {
+                "runs": 0, "ok": 0, "over": 0, "under": 0, "truncated": 0,
+                "words_total": 0, "over_words": 0, "under_words": 0,
+            })
+            c["runs"] += 1
+            c[verdict] += 1
+            c["words_total"] += words
+            if verdict == "over":
+                c["over_words"] += words - budget.hi
+            elif verdict == "under":
+                c["under_words"] += budget.lo - words
+
+        if verdict != "ok":
+            target = f"{budget.lo}–{budget.hi}" if budget.lo else f"≤{budget.hi}"
+            print(f"[{tag}] enhancer output {words} words (target {target}, cap {budget.max_tokens} tok): {verdict}")
+        self.maybe_save()
+        return verdict
+
+    def snapshot(self):
+        with self.lock:
+            self._load()
+            out = {}
+            for key, c in self.counters.items():
+                row = dict(c)
+                row["avg_words"] = round(c["words_total"] / c["runs"], 1) if c["runs"] else None
+                out[key] = row
+            for key, r in self.ratios.items():
+                out.setdefault(key, {})["words_per_token"] = round(float(r["wpt"]), 3)
+            return out
+
+    def save(self):
+        with self.lock:
+            if not self.dirty or self.ratios is None:
+                return
+            data = json.dumps(self.ratios, indent=2)
+            self.dirty = False
+            self.last_save = time.monotonic()
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(data)
+            os.replace(tmp, self.path)
+        except Exception as e:
+            print(f"[EnhancerBudget] could not save {self.path}: {e}")
+
+    def maybe_save(self):
+        if time.monotonic() - self.last_save >= SAVE_INTERVAL_S:
+            self.save()
+
+
+governor = BudgetGovernor()
+atexit.register(governor.save)
+register_snapshot("output_budget", governor.snapshot)
@@ -0,0 +1,92 @@
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+try:
+    from .enhancer_telemetry import register_snapshot
+except ImportError:
+    from enhancer_telemetry import register_snapshot
+
+
+# =========================
+# 🗃️ ENHANCER RESULT CACHE
+# =========================
+# Enhanced prompts computed ahead of time (packed requests, prefetch) are
+# kept here until the execution that needs them comes along.
+# Keyed by backend + model + system prompt + user prompt, LRU + TTL.
+
+MAX_ENTRIES = 512
+TTL_S = 6 * 3600
+
+
+def cache_key(backend, model, system_prompt, user_prompt):
+    h = hashlib.sha1()
+    for part in (backend, model or "", system_prompt or "", user_prompt or ""):
+        h.update(part.encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+
+class EnhancerCache:
+
+    def __init__(self, max_entries=MAX_ENTRIES, ttl_s=TTL_S):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()   # key -> (stored_at, text, source)
+        self.counters = {"hits": 0, "misses": 0, "stored": 0, "evicted": 0, "expired": 0}
+        self.hits_by_source = {}
+
+    def _alive(self, key, now):
+        row = self.entries.get(key)
+        if row is None:
+            return None
+        if now - row[0] > self.ttl_s:
+            del self.entries[key]
+            self.counters["expired"] += 1
+            return None
+        return row
+
+    def get(self, key):
+        with self.lock:
+            row = self._alive(key, time.monotonic())
+            if row is None:
+                self.counters["misses"] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.counters["hits"] += 1
+            self.hits_by_source[row[2]] = self.hits_by_source.get(row[2], 0) + 1
+            return row[1]
+
+    def __contains__(self, key):
+        with self.lock:
+            return self._alive(key, time.monotonic()) is not None
+
+    def put(self, key, text, source="single"):
+        if not text:
+            return
+        with self.lock:
+            self.entries[key] = (time.monotonic(), text, source)
+            self.entries.move_to_end(key)
+            self.counters["stored"] += 1
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.counters["evicted"] += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def snapshot(self):
+        with self.lock:
+            out = dict(self.counters)
+            out["entries"] = len(self.entries)
+            out["hits_by_source"] = dict(self.hits_by_source)
+        looked_up = out["hits"] + out["misses"]
+        out["hit_rate"] = round(out["hits"] / looked_up, 3) if looked_up else None
+        return out
+
+
+enhancer_cache = EnhancerCache()
+register_snapshot("enhancer_cache", enhancer_cache.snapshot)
@@ -0,0 +1,138 @@
+import os
+import threading
+
+import requests
+
+try:
+    from .enhancer_telemetry import note_usage_from
+except ImportError:
+    from enhancer_telemetry import note_usage_from
+
+
+# =========================
+# 🔌 PROVIDER CLIENT POOL
+# =========================
+# SDK clients are built once per (provider, key, model) and shared by every
+# node in the process; api_keys.txt is only re-parsed when it changes.
+
+_keys_lock = threading.Lock()
+_keys_cache = {}   # path -> (stamp, keys)
+
+
+def read_api_keys(base_path):
+    """api_keys.txt as a dict, cached until the file's mtime/size change."""
+    keys_path = os.path.join(base_path, "api_keys.txt")
+    try:
+        st = os.stat(keys_path)
+    except OSError:
+        return {}
+    stamp = (st.st_mtime_ns, st.st_size)
+
+    with _keys_lock:
+        cached = _keys_cache.get(keys_path)
+        if cached and cached[0] == stamp:
+            return dict(cached[1])
+
+        keys = {}
+        with open(keys_path, "r", encoding="utf-8") as f:
+            for line in f:
+                if "=" in line:
+                    k, v = line.strip().split("=", 1)
+                    keys[k.strip()] = v.strip()
+        _keys_cache[keys_path] = (stamp, keys)
+        return dict(keys)
+
+
+class ClientPool:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clients = {}
+
+    def get(self, provider, api_key, model, factory):
+        key = (provider, api_key, model)
+        client = self.clients.get(key)
+        if client is not None:
+            return client
+        with self.lock:
+            client = self.clients.get(key)
+            if client is None:
+                client = factory()
+                self.clients[key] = client
+            return client
+
+    def clear(self):
+        with self.lock:
+            self.clients.clear()
+
+
+client_pool = ClientPool()
+
+
+# ---------- HTTP ----------
+_local = threading.local()
+
+
+def http_session(name):
+    """One keep-alive requests.Session per (thread, name)."""
+    sessions = getattr(_local, "sessions", None)
+    if sessions is None:
+        sessions = _local.sessions = {}
+    s = sessions.get(name)
+    if s is None:
+        s = sessions[name] = requests.Session()
+    return s
+
+
+# ---------- OpenAI ----------
+def openai_chat(api_key, model, messages, **kwargs):
+    """
+    openai>=1: pooled OpenAI client.
+    openai 0.28: per-call api_key, so the global openai.api_key is never touched.
+    """
+    import openai
+    if hasattr(openai, "OpenAI"):
+        client = client_pool.get("openai", api_key, None, lambda: openai.OpenAI(api_key=api_key))
+        resp = client.chat.completions.create(model=model, messages=messages, **kwargs)
+    else:
+        resp = openai.ChatCompletion.create(api_key=api_key, model=model, messages=messages, **kwargs)
+    note_usage_from(resp)
+    return resp.choices[0].message.content
+
+
+# ---------- Cohere ----------
+def cohere_client(api_key):
+    import cohere
+    return client_pool.get("cohere", api_key, None, lambda: cohere.ClientV2(api_key=api_key))
+
+
+# ---------- Gemini ----------
+_gemini_lock = threading.Lock()
+_gemini_key = None
+
+
+def gemini_model(api_key, model_name):
+    """
+    genai.configure() is process-global, so it only runs when the key changes,
+    under a lock, and models are bound to their client right away.
+    """
+    import google.generativeai as genai
+
+    def _build():
+        global _gemini_key
+        if _gemini_key != api_key:
+            genai.configure(api_key=api_key)
+            _gemini_key = api_key
+        model = genai.GenerativeModel(model_name)
+        # bind now: otherwise the client is picked lazily on first call,
+        # after a later configure() for another key may have replaced it
+        if getattr(model, "_client", "missing") is None:
+            try:
+                from google.generativeai import client as genai_client
+                model._client = genai_client.get_default_generative_client()
+            except Exception:
+                pass
+        return model
+
+    with _gemini_lock:
+        return client_pool.get("gemini", api_key, model_name, _build)
@@ -0,0 +1,70 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+try:
+    from .enhancer_telemetry import register_snapshot
+except ImportError:
+    from enhancer_telemetry import register_snapshot
+
+
+# =========================
+# 🔗 FUSED GENERATE + REFINE
+# =========================
+# With fuse_refine on, the Creator's enhancer request already carries the
+# Refiner's instructions, so one LLM call does both jobs. The prompts it
+# returns are remembered here; a Refiner that receives one of them (same
+# mode, default system prompt) passes it through instead of calling again.
+
+MAX_ENTRIES = 1024
+
+
+def _digest(text):
+    return hashlib.sha1((text or "").strip().encode("utf-8")).hexdigest()
+
+
+def fused_system_prompt(base_system_prompt, refinement_text, clean_output_prompt):
+    """World / mode system prompt + refinement mode text + clean output rules."""
+    parts = [p.strip() for p in (base_system_prompt, refinement_text, clean_output_prompt) if p and p.strip()]
+    return "\n\n".join(parts)
+
+
+class FusedRegistry:
+
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()   # digest -> refinement mode
+        self.counters = {"fused": 0, "passed_through": 0, "mode_mismatch": 0}
+
+    def mark(self, text, mode):
+        key = _digest(text)
+        with self.lock:
+            self.entries[key] = mode
+            self.entries.move_to_end(key)
+            self.counters["fused"] += 1
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def mode_of(self, text):
+        """Refinement mode this prompt was fused with, or None."""
+        with self.lock:
+            return self.entries.get(_digest(text))
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def count(self, key):
+        with self.lock:
+            self.counters[key] += 1
+
+    def snapshot(self):
+        with self.lock:
+            out = dict(self.counters)
+            out["entries"] = len(self.entries)
+            return out
+
+
+fused_registry = FusedRegistry()
+register_snapshot("fused_refine", fused_registry.snapshot)
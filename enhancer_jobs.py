@@ -0,0 +1,337 @@
+import os
+import json
+import time
+import socket
+import sqlite3
+import threading
+
+try:
+    from .enhancer_async import sleep, RequestCancelled
+    from .enhancer_telemetry import register_snapshot
+except ImportError:
+    from enhancer_async import sleep, RequestCancelled
+    from enhancer_telemetry import register_snapshot
+
+
+# =========================
+# 🗄️ DURABLE ENHANCEMENT JOBS
+# =========================
+# Overnight batch runs used to lose every enhancement on a ComfyUI restart.
+# With durable_queue on, the Creator writes the enhancement jobs of the next
+# seeds to logs/enhancer_jobs.db (SQLite, WAL): a worker pool works through
+# the pending ones, and each result is committed in its own transaction.
+# After a restart the pool resumes the pending jobs, jobs left "running" by
+# the dead process are taken over once their lease expires, and seeds whose
+# job is done are served from the database without calling the LLM again.
+
+WORKERS = max(1, int(os.environ.get("PCN_JOB_WORKERS", "2") or 2))
+LEASE_S = 90.0          # a running job is renewed every LEASE_S / 3 by its worker
+MAX_ATTEMPTS = 3
+RETRY_DELAY_S = 30.0    # x attempts, before a failed job is picked up again
+KEEP_DONE_DAYS = 30
+WAIT_POLL_S = 0.25
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    key         TEXT PRIMARY KEY,
+    state       TEXT NOT NULL,          -- pending / running / done / failed
+    spec        TEXT NOT NULL,          -- JSON: everything needed to run it again
+    result      TEXT,
+    error       TEXT,
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    owner       TEXT,
+    lease_until REAL,                   -- running: lease end; pending: not before
+    created     REAL NOT NULL,
+    updated     REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, created);
+"""
+
+
+class JobQueue:
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(os.path.dirname(__file__), "logs", "enhancer_jobs.db")
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.ready = False
+        self.counters = {"enqueued": 0, "completed": 0, "failed": 0, "served": 0, "inline": 0, "taken_over": 0}
+
+    def _db(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            with self.lock:
+                if not self.ready:
+                    os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            with self.lock:
+                if not self.ready:
+                    conn.executescript(SCHEMA)
+                    self.ready = True
+            self.local.conn = conn
+        return conn
+
+    def count(self, key, amount=1):
+        with self.lock:
+            self.counters[key] += amount
+
+    # ---------- producer side ----------
+    def enqueue(self, items):
+        """items: [(key, spec dict)]; keys already known are left alone. Returns how many are new."""
+        now = time.time()
+        rows = [(key, json.dumps(spec), now, now) for key, spec in items]
+        if not rows:
+            return 0
+        db = self._db()
+        with db:
+            db.execute("BEGIN IMMEDIATE")
+            before = db.total_changes
+            db.executemany(
+                "INSERT OR IGNORE INTO jobs (key, state, spec, created, updated) VALUES (?, 'pending', ?, ?, ?)",
+                rows,
+            )
+            added = db.total_changes - before
+        self.count("enqueued", added)
+        return added
+
+    def known(self, keys):
+        """Subset of keys already in the queue (any state)."""
+        keys = list(keys)
+        if not keys:
+            return set()
+        db = self._db()
+        out = set()
+        for i in range(0, len(keys), 500):
+            part = keys[i:i + 500]
+            q = "SELECT key FROM jobs WHERE key IN (%s)" % ",".join("?" * len(part))
+            out.update(k for (k,) in db.execute(q, part))
+        return out
+
+    def state(self, key):
+        """(state, result) of a job, or (None, None)."""
+        row = self._db().execute("SELECT state, result FROM jobs WHERE key = ?", (key,)).fetchone()
+        return row if row else (None, None)
+
+    # ---------- claiming ----------
+    def _claim_where(self, where, key=None):
+        now = time.time()
+        db = self._db()
+        with db:
+            db.execute("BEGIN IMMEDIATE")
+            row = db.execute(
+                "SELECT key, spec, state FROM jobs WHERE " + where + " ORDER BY created, rowid LIMIT 1",
+                {"now": now, "key": key},
+            ).fetchone()
+            if row is None:
+                return None
+            db.execute(
+                "UPDATE jobs SET state = 'running', owner = ?, lease_until = ?, attempts = attempts + 1, updated = ? WHERE key = ?",
+                (self.owner, now + LEASE_S, now, row[0]),
+            )
+        if row[2] == "running":
+            self.count("taken_over")
+        return row[0], json.loads(row[1])
+
+    def claim_next(self):
+        """Oldest pending job (or one whose worker died), now leased to this process."""
+        return self._claim_where(
+            "(state = 'pending' AND (lease_until IS NULL OR lease_until < :now))"
+            " OR (state = 'running' AND lease_until < :now)"
+        )
+
+    def claim(self, key):
+        """This job right away (retry delay ignored), unless a live worker has it."""
+        return self._claim_where("key = :key AND (state = 'pending' OR (state = 'running' AND lease_until < :now))", key)
+
+    def renew(self, keys):
+        if not keys:
+            return
+        now = time.time()
+        db = self._db()
+        with db:
+            db.executemany(
+                "UPDATE jobs SET lease_until = ? WHERE key = ? AND owner = ? AND state = 'running'",
+                [(now + LEASE_S, k, self.owner) for k in keys],
+            )
+
+    # ---------- results ----------
+    def complete(self, key, result):
+        now = time.time()
+        db = self._db()
+        with db:
+            db.execute(
+                "UPDATE jobs SET state = 'done', result = ?, error = NULL, lease_until = NULL, updated = ? WHERE key = ?",
+                (result, now, key),
+            )
+        self.count("completed")
+
+    def fail(self, key, error, retry=True):
+        """Back to pending (up to MAX_ATTEMPTS), else failed."""
+        now = time.time()
+        db = self._db()
+        with db:
+            db.execute(
+                "UPDATE jobs SET state = CASE WHEN ? AND attempts < ? THEN 'pending' ELSE 'failed' END, "
+                "error = ?, lease_until = ? + attempts * ?, updated = ? WHERE key = ?",
+                (1 if retry else 0, MAX_ATTEMPTS, str(error)[:500], now, RETRY_DELAY_S, now, key),
+            )
+        self.count("failed")
+
+    def retry(self, key):
+        """A failed job gets a fresh set of attempts."""
+        db = self._db()
+        with db:
+            db.execute("UPDATE jobs SET state = 'pending', attempts = 0, lease_until = NULL WHERE key = ? AND state = 'failed'", (key,))
+
+    def release(self, key):
+        """Gives a claimed job back untouched (interrupted, not failed)."""
+        db = self._db()
+        with db:
+            db.execute(
+                "UPDATE jobs SET state = 'pending', attempts = MAX(0, attempts - 1), lease_until = NULL WHERE key = ? AND owner = ?",
+                (key, self.owner),
+            )
+
+    def prune(self, days=KEEP_DONE_DAYS):
+        db = self._db()
+        with db:
+            db.execute("DELETE FROM jobs WHERE state IN ('done', 'failed') AND updated < ?", (time.time() - days * 86400,))
+
+    def pending(self):
+        """Jobs not finished yet, including those a dead worker left running."""
+        row = self._db().execute("SELECT COUNT(*) FROM jobs WHERE state IN ('pending', 'running')").fetchone()
+        return row[0]
+
+    def snapshot(self):
+        with self.lock:
+            out = dict(self.counters)
+        if not os.path.exists(self.path):
+            return out
+        try:
+            out["states"] = dict(self._db().execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+        except sqlite3.Error as e:
+            out["states"] = {"error": str(e)}
+        return out
+
+
+class JobPool:
+    """Worker threads draining the queue through a runner(spec) -> text."""
+
+    def __init__(self, queue, workers=WORKERS):
+        self.queue = queue
+        self.workers = workers
+        self.runner = None
+        self.lock = threading.Lock()
+        self.threads = []
+        self.active = set()      # keys being run by this process
+        self.wake = threading.Event()
+        self.heartbeat = None
+
+    def bind(self, runner):
+        self.runner = runner
+
+    def start(self):
+        if self.runner is None:
+            return
+        with self.lock:
+            self.threads = [t for t in self.threads if t.is_alive()]
+            for i in range(len(self.threads), self.workers):
+                t = threading.Thread(target=self._work, name=f"pcn-jobs-{i}", daemon=True)
+                t.start()
+                self.threads.append(t)
+            if self.heartbeat is None or not self.heartbeat.is_alive():
+                self.heartbeat = threading.Thread(target=self._renew, name="pcn-jobs-lease", daemon=True)
+                self.heartbeat.start()
+        self.wake.set()
+
+    def resume(self):
+        """At node load: picks up what a previous run left pending."""
+        if not os.path.exists(self.queue.path):
+            return 0
+        try:
+            self.queue.prune()
+            n = self.queue.pending()
+        except sqlite3.Error as e:
+            print(f"[EnhancerJobs] {self.queue.path} unreadable: {e}")
+            return 0
+        if n:
+            print(f"[EnhancerJobs] resuming {n} pending enhancement jobs")
+            self.start()
+        return n
+
+    def _renew(self):
+        while True:
+            time.sleep(LEASE_S / 3)
+            with self.lock:
+                keys = list(self.active)
+            try:
+                self.queue.renew(keys)
+            except sqlite3.Error as e:
+                print(f"[EnhancerJobs] lease renewal failed: {e}")
+
+    def _work(self):
+        while True:
+            try:
+                job = self.queue.claim_next()
+            except sqlite3.Error as e:
+                print(f"[EnhancerJobs] claim failed: {e}")
+                job = None
+            if job is None:
+                # idle until more work is enqueued (or a lease may have expired)
+                self.wake.wait(LEASE_S / 3)
+                self.wake.clear()
+                continue
+            self.run_claimed(*job)
+
+    def run_claimed(self, key, spec):
+        with self.lock:
+            self.active.add(key)
+        try:
+            out = self.runner(spec)
+        except RequestCancelled:
+            self.queue.release(key)
+            raise
+        except Exception as e:
+            print(f"[EnhancerJobs] job failed: {e}")
+            self.queue.fail(key, e)
+            return None
+        finally:
+            with self.lock:
+                self.active.discard(key)
+        if out:
+            self.queue.complete(key, out)
+        else:
+            self.queue.fail(key, "no enhanced output")
+        return out
+
+    def run(self, key, spec):
+        """
+        The execution's own seed: the stored result if its job is done, else
+        run it here (claiming it from the queue), or wait for the worker that
+        is running it.
+        """
+        while True:
+            state, result = self.queue.state(key)
+            if state == "done":
+                self.queue.count("served")
+                return result
+            if state is None:
+                self.queue.enqueue([(key, spec)])
+            job = self.queue.claim(key)
+            if job is not None:
+                self.queue.count("inline")
+                return self.run_claimed(*job)
+            if state == "failed":
+                # this seed runs again: give it another go
+                self.queue.retry(key)
+                continue
+            # a worker (here or in another process) has it: wait for its commit
+            sleep(WAIT_POLL_S)
+
+
+job_queue = JobQueue()
+job_pool = JobPool(job_queue)
+register_snapshot("job_queue", job_queue.snapshot, costly=True)
@@ -0,0 +1,139 @@
+import os
+import zlib
+import threading
+
+try:
+    from .enhancer_telemetry import register_snapshot, note_server_timings
+except ImportError:
+    from enhancer_telemetry import register_snapshot, note_server_timings
+
+
+# =========================
+# 🏠 LOCAL BACKENDS: PREFIX REUSE
+# =========================
+# Every run of a world sends the same SYSTEM_PROMPT, so requests are always
+# built system-first / seed-last: the backend can then reuse the KV cache of
+# the shared prefix and only evaluate the (short) seed part.
+#   - Ollama: keep the model resident (keep_alive) so its cache survives
+#   - llama.cpp: cache_prompt + pin each system prompt to the same slot
+
+# how long Ollama keeps the model (and its prompt cache) loaded after a call
+OLLAMA_KEEP_ALIVE = os.environ.get("PCN_OLLAMA_KEEP_ALIVE", "30m")
+
+# number of llama.cpp server slots (--parallel). 0 = let the server choose.
+LLAMACPP_SLOTS = int(os.environ.get("PCN_LLAMACPP_SLOTS", "0") or 0)
+
+
+def chat_messages(system_prompt, user_prompt):
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt},
+    ]
+
+
+def completion_prompt(system_prompt, user_prompt):
+    return f"{system_prompt}\n\n{user_prompt}"
+
+
+def llamacpp_slot(system_prompt):
+    """Same system prompt -> same slot, so its cached prefix is still there."""
+    if LLAMACPP_SLOTS <= 0:
+        return -1
+    return zlib.crc32((system_prompt or "").encode("utf-8")) % LLAMACPP_SLOTS
+
+
+def llamacpp_cache_fields(system_prompt):
+    fields = {"cache_prompt": True}
+    slot = llamacpp_slot(system_prompt)
+    if slot >= 0:
+        fields["id_slot"] = slot
+    return fields
+
+
+# ---------- timings ----------
+def ollama_timings(j):
+    """Ollama reports durations in ns."""
+    if not isinstance(j, dict) or "eval_count" not in j:
+        return None
+    ns = 1e6
+    return {
+        "prompt_tokens": int(j.get("prompt_eval_count") or 0),
+        "prompt_ms": (j.get("prompt_eval_duration") or 0) / ns,
+        "gen_tokens": int(j.get("eval_count") or 0),
+        "gen_ms": (j.get("eval_duration") or 0) / ns,
+        "load_ms": (j.get("load_duration") or 0) / ns,
+        "cached_tokens": None,
+    }
+
+
+def llamacpp_timings(j):
+    """llama.cpp /completion and /v1/chat/completions both carry "timings"."""
+    t = j.get("timings") if isinstance(j, dict) else None
+    if not isinstance(t, dict):
+        return None
+    cached = j.get("tokens_cached")
+    if cached is None:
+        cached = t.get("cache_n")
+    return {
+        "prompt_tokens": int(t.get("prompt_n") or 0),
+        "prompt_ms": float(t.get("prompt_ms") or 0.0),
+        "gen_tokens": int(t.get("predicted_n") or 0),
+        "gen_ms": float(t.get("predicted_ms") or 0.0),
+        "load_ms": 0.0,
+        "cached_tokens": int(cached) if cached is not None else None,
+    }
+
+
+class PrefixStats:
+    """Process-wide prompt-eval vs generation totals per (backend, model)."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.rows = {}
+
+    def record(self, backend, model, timings, tag="PromptCreator"):
+        if not timings:
+            return
+        key = f"{backend}:{model or '-'}"
+        with self.lock:
+            row = self.rows.setdefault(key, {
+                "requests": 0,
+                "prompt_tokens": 0, "prompt_ms": 0.0,
+                "gen_tokens": 0, "gen_ms": 0.0,
+                "cached_tokens": 0,
+            })
+            row["requests"] += 1
+            row["prompt_tokens"] += timings["prompt_tokens"]
+            row["prompt_ms"] += timings["prompt_ms"]
+            row["gen_tokens"] += timings["gen_tokens"]
+            row["gen_ms"] += timings["gen_ms"]
+            row["cached_tokens"] += timings.get("cached_tokens") or 0
+
+        cached = timings.get("cached_tokens")
+        print(
+            f"[{tag}] {key} prompt_eval {timings['prompt_tokens']} tok / {timings['prompt_ms']:.0f} ms"
+            + (f" ({cached} cached)" if cached is not None else "")
+            + f", gen {timings['gen_tokens']} tok / {timings['gen_ms']:.0f} ms"
+        )
+
+    def snapshot(self):
+        with self.lock:
+            out = {}
+            for key, row in self.rows.items():
+                r = dict(row)
+                r["prompt_ms"] = round(r["prompt_ms"], 1)
+                r["gen_ms"] = round(r["gen_ms"], 1)
+                total = r["prompt_ms"] + r["gen_ms"]
+                r["prompt_share"] = round(r["prompt_ms"] / total, 3) if total else 0.0
+                out[key] = r
+            return out
+
+
+prefix_stats = PrefixStats()
+register_snapshot("prefix_reuse", prefix_stats.snapshot)
+
+
+def record_response(r, backend, model, timings, tag="PromptCreator"):
+    """Feeds one local-backend response into prefix stats + enhancer telemetry."""
+    prefix_stats.record(backend, model, timings, tag=tag)
+    note_server_timings(r, timings)
@@ -0,0 +1,134 @@
+import re
+import json
+import threading
+from collections import OrderedDict
+
+try:
+    from .enhancer_ratelimit import estimate_tokens
+    from .enhancer_telemetry import register_snapshot
+except ImportError:
+    from enhancer_ratelimit import estimate_tokens
+    from enhancer_telemetry import register_snapshot
+
+
+# =========================
+# 📦 MULTI-SEED PACKING
+# =========================
+# K seed prompts in one request under one system prompt: the (long) world
+# SYSTEM_PROMPT is paid once instead of K times. The model answers with a
+# JSON array; items that don't validate are re-issued one by one.
+
+# largest K per backend (context length vs throughput); backends not listed
+# wrap the user prompt in their own instructions and are never packed
+PACK_MAX = {
+    "ollama": 4,
+    "llamacpp": 4,
+    "openai": 8,
+    "openrouter": 8,
+}
+
+MIN_ITEM_WORDS = 8
+
+
+def pack_size(backend, requested):
+    """Effective K for this backend (1 = packing off)."""
+    try:
+        requested = int(requested)
+    except Exception:
+        return 1
+    return max(1, min(requested, PACK_MAX.get(backend, 1)))
+
+
+def build_pack_prompt(user_prompts):
+    n = len(user_prompts)
+    lines = [
+        f"Below are {n} independent requests. Handle each one on its own, following its instructions.",
+        f"Return ONLY a JSON array of exactly {n} strings, in the same order: "
+        "each string is the final prompt for that request. No keys, no comments, no markdown.",
+        "",
+    ]
+    for i, u in enumerate(user_prompts, 1):
+        lines.append(f"{i}. {u}")
+    return "\n".join(lines)
+
+
+def _json_array(text):
+    text = re.sub(r"<think>.*?</think>", "", text or "", flags=re.DOTALL)
+    text = re.sub(r"```(?:json)?", "", text)
+    start, end = text.find("["), text.rfind("]")
+    if start < 0 or end <= start:
+        return None
+    try:
+        arr = json.loads(text[start:end + 1])
+    except ValueError:
+        return None
+    return arr if isinstance(arr, list) else None
+
+
+def _item_text(item):
+    if isinstance(item, dict):
+        for k in ("prompt", "text", "output"):
+            if isinstance(item.get(k), str):
+                item = item[k]
+                break
+    if not isinstance(item, str):
+        return None
+    return re.sub(r"\s+", " ", item).strip()
+
+
+def split_pack_response(text, user_prompts):
+    """One entry per request: the enhanced prompt, or None if it failed validation."""
+    out = [None] * len(user_prompts)
+    arr = _json_array(text)
+    if arr is None:
+        return out
+    for i, item in enumerate(arr[:len(user_prompts)]):
+        t = _item_text(item)
+        if not t or len(t.split()) < MIN_ITEM_WORDS or t == user_prompts[i]:
+            continue
+        out[i] = t
+    return out
+
+
+class PackStats:
+
+    def __init__(self, max_failed=256):
+        self.lock = threading.Lock()
+        self.rows = {}
+        # cache keys of packed items that failed validation: sent alone next time
+        self.failed = OrderedDict()
+        self.max_failed = max_failed
+
+    def record(self, backend, system_prompt, size, ok):
+        with self.lock:
+            row = self.rows.setdefault(backend, {
+                "packs": 0, "items": 0, "items_ok": 0, "reissued": 0, "system_tokens_saved": 0,
+            })
+            row["packs"] += 1
+            row["items"] += size
+            row["items_ok"] += ok
+            row["system_tokens_saved"] += estimate_tokens(system_prompt) * (size - 1)
+
+    def mark_failed(self, key):
+        with self.lock:
+            self.failed[key] = True
+            while len(self.failed) > self.max_failed:
+                self.failed.popitem(last=False)
+
+    def take_failed(self, key):
+        """True (once) if this item failed in a pack and must be re-issued alone."""
+        with self.lock:
+            return self.failed.pop(key, None) is not None
+
+    def reissued(self, backend):
+        with self.lock:
+            if backend in self.rows:
+                self.rows[backend]["reissued"] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return {k: dict(v) for k, v in self.rows.items()}
+
+
+pack_stats = PackStats()
+register_snapshot("packing", pack_stats.snapshot)
@@ -0,0 +1,103 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+try:
+    from .enhancer_cache import enhancer_cache
+    from .enhancer_async import interrupted, RequestCancelled, INTERRUPT_POLL_S
+    from .enhancer_telemetry import register_snapshot
+except ImportError:
+    from enhancer_cache import enhancer_cache
+    from enhancer_async import interrupted, RequestCancelled, INTERRUPT_POLL_S
+    from enhancer_telemetry import register_snapshot
+
+
+# =========================
+# 🔮 BACKGROUND PREFETCH
+# =========================
+# While ComfyUI renders image N the enhancer is idle: the Creator hands the
+# next seed's prompt to this worker, which enhances it into the enhancer
+# cache. The next execution then finds it there, or waits for the request
+# already in flight instead of sending a second one.
+
+MAX_PENDING = 4
+WAIT_TIMEOUT_S = 300.0
+
+
+class Prefetcher:
+
+    def __init__(self, workers=1):
+        self.lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pcn-prefetch")
+        self.inflight = {}   # cache key -> Future
+        self.counters = {"scheduled": 0, "skipped": 0, "completed": 0, "failed": 0, "used": 0, "waited": 0, "abandoned": 0}
+
+    def count(self, key, amount=1):
+        with self.lock:
+            self.counters[key] += amount
+
+    def schedule(self, key, fn):
+        """Runs fn() in the background and caches its result under key."""
+        if key in enhancer_cache:
+            self.count("skipped")
+            return False
+        with self.lock:
+            if key in self.inflight or len(self.inflight) >= MAX_PENDING:
+                self.counters["skipped"] += 1
+                return False
+            self.counters["scheduled"] += 1
+            self.inflight[key] = self.pool.submit(self._run, key, fn)
+            return True
+
+    def _run(self, key, fn):
+        try:
+            out = fn()
+            if out:
+                enhancer_cache.put(key, out, source="prefetch")
+                self.count("completed")
+            else:
+                self.count("failed")
+            return out
+        except Exception as e:
+            self.count("failed")
+            print(f"[Prefetch] failed: {e}")
+            return None
+        finally:
+            with self.lock:
+                self.inflight.pop(key, None)
+
+    def wait(self, key, timeout=WAIT_TIMEOUT_S):
+        """Result of an in-flight prefetch for key, or None if there is none. Raises RequestCancelled on an interrupt."""
+        with self.lock:
+            fut = self.inflight.get(key)
+        if fut is None:
+            return None
+        self.count("waited")
+        deadline = time.monotonic() + timeout
+        while True:
+            # short slices: an interrupt gives up on the prefetch (it still
+            # finishes in the background and lands in the cache)
+            try:
+                out = fut.result(timeout=min(INTERRUPT_POLL_S, max(0.0, deadline - time.monotonic())))
+                break
+            except FutureTimeout:
+                if interrupted():
+                    self.count("abandoned")
+                    raise RequestCancelled("interrupted")
+                if time.monotonic() >= deadline:
+                    return None
+            except Exception:
+                return None
+        if out:
+            self.count("used")
+        return out
+
+    def snapshot(self):
+        with self.lock:
+            out = dict(self.counters)
+            out["inflight"] = len(self.inflight)
+            return out
+
+
+prefetcher = Prefetcher()
+register_snapshot("prefetch", prefetcher.snapshot)
@@ -0,0 +1,265 @@
+import os
+import json
+import time
+import random
+import threading
+from email.utils import parsedate_to_datetime
+
+try:
+    from .enhancer_telemetry import register_snapshot, current_call
+    from .enhancer_async import sleep
+except ImportError:
+    from enhancer_telemetry import register_snapshot, current_call
+    from enhancer_async import sleep
+
+
+# =========================
+# ⏱️ CLOUD ENHANCER RATE LIMITS
+# =========================
+# One limiter per provider, shared by every node in the process.
+# Override in ./rate_limits.json, e.g. {"openai": {"rpm": 500, "tpm": 200000}}
+# (0 disables that bucket).
+DEFAULT_LIMITS = {
+    "openai": {"rpm": 60, "tpm": 90000},
+    "openrouter": {"rpm": 20, "tpm": 200000},
+    "cohere": {"rpm": 20, "tpm": 100000},
+    "gemini": {"rpm": 5, "tpm": 250000},
+}
+
+RETRYABLE_STATUS = {408, 409, 425, 429, 500, 502, 503, 504}
+# Read timeouts (requests.ReadTimeout / Timeout, openai APITimeoutError) are
+# not retried: the request reached a busy model, and waiting out the full read
+# timeout again up to MAX_RETRIES times would hold the queue for minutes.
+TRANSIENT_ERRORS = {
+    "ConnectionError", "ConnectTimeout",
+    "APIConnectionError", "ServiceUnavailableError", "ServiceUnavailable",
+}
+
+MAX_RETRIES = 4
+BASE_DELAY = 1.0
+MAX_DELAY = 60.0
+MAX_RETRY_AFTER = 300.0
+
+# private RNG: the nodes seed the global one for deterministic prompts
+_jitter = random.Random()
+
+
+class TokenBucket:
+    """
+    Reservation-style token bucket.
+    reserve() takes tokens right away (the balance may go negative) and
+    returns how long the caller has to wait for them, so concurrent callers
+    queue up fairly instead of racing on the refill.
+    """
+
+    def __init__(self, per_minute):
+        self.rate = float(per_minute) / 60.0
+        self.capacity = float(per_minute)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, amount):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # a single request bigger than the bucket would never fit
+            self.tokens -= min(float(amount), self.capacity)
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+
+class ProviderLimiter:
+
+    def __init__(self, name, rpm=0, tpm=0):
+        self.name = name
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+        self.counters = {
+            "calls": 0,
+            "throttled": 0,
+            "throttle_wait_s": 0.0,
+            "rate_limited": 0,
+            "retried": 0,
+            "failed": 0,
+        }
+
+    def count(self, key, amount=1):
+        with self.lock:
+            self.counters[key] += amount
+
+    def pause(self, seconds):
+        """Server said back off: hold every caller of this provider."""
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def acquire(self, est_tokens=0):
+        """Blocks until the request fits both buckets. Returns seconds waited."""
+        wait = 0.0
+        if self.requests:
+            wait = max(wait, self.requests.reserve(1))
+        if self.tokens and est_tokens:
+            wait = max(wait, self.tokens.reserve(est_tokens))
+        with self.lock:
+            wait = max(wait, self.blocked_until - time.monotonic())
+            self.counters["calls"] += 1
+            if wait > 0:
+                self.counters["throttled"] += 1
+                self.counters["throttle_wait_s"] += wait
+        if wait > 0:
+            sleep(wait)
+        return max(0.0, wait)
+
+    def snapshot(self):
+        with self.lock:
+            out = dict(self.counters)
+        out["throttle_wait_s"] = round(out["throttle_wait_s"], 3)
+        return out
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def _load_limits():
+    limits = {k: dict(v) for k, v in DEFAULT_LIMITS.items()}
+    path = os.path.join(os.path.dirname(__file__), "rate_limits.json")
+    if os.path.exists(path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if isinstance(data, dict):
+                for provider, cfg in data.items():
+                    if isinstance(cfg, dict):
+                        limits.setdefault(provider, {}).update(cfg)
+        except Exception as e:
+            print(f"[RateLimit] rate_limits.json ignored: {e}")
+    return limits
+
+
+def get_limiter(provider):
+    with _limiters_lock:
+        limiter = _limiters.get(provider)
+        if limiter is None:
+            cfg = _load_limits().get(provider, {})
+            limiter = ProviderLimiter(provider, int(cfg.get("rpm", 0) or 0), int(cfg.get("tpm", 0) or 0))
+            _limiters[provider] = limiter
+        return limiter
+
+
+def rate_limit_stats():
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {lim.name: lim.snapshot() for lim in limiters}
+
+
+register_snapshot("rate_limits", rate_limit_stats)
+
+
+def reset_limiters():
+    """Drops every limiter (and its counters); limits are re-read on next use."""
+    with _limiters_lock:
+        _limiters.clear()
+
+
+# ---------- helpers ----------
+def estimate_tokens(*texts, max_output=0):
+    """~4 chars per token, good enough for budgeting the tpm bucket."""
+    chars = sum(len(t) for t in texts if isinstance(t, str))
+    return chars // 4 + int(max_output or 0)
+
+
+def _status_of(exc):
+    for obj in (exc, getattr(exc, "response", None)):
+        if obj is None:
+            continue
+        for attr in ("status_code", "http_status", "code", "status"):
+            v = getattr(obj, attr, None)
+            if isinstance(v, int) and 100 <= v <= 599:
+                return int(v)
+    return None
+
+
+def _retry_after_of(exc):
+    headers = None
+    for obj in (exc, getattr(exc, "response", None)):
+        h = getattr(obj, "headers", None) if obj is not None else None
+        if h:
+            headers = h
+            break
+    if not headers:
+        return None
+    try:
+        lowered = {str(k).lower(): v for k, v in dict(headers).items()}
+    except Exception:
+        return None
+
+    ms = lowered.get("retry-after-ms")
+    if ms:
+        try:
+            return min(MAX_RETRY_AFTER, max(0.0, float(ms) / 1000.0))
+        except ValueError:
+            pass
+
+    value = lowered.get("retry-after")
+    if not value:
+        return None
+    try:
+        return min(MAX_RETRY_AFTER, max(0.0, float(value)))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(str(value))
+        return min(MAX_RETRY_AFTER, max(0.0, when.timestamp() - time.time()))
+    except Exception:
+        return None
+
+
+def backoff_delay(attempt, base=BASE_DELAY, cap=MAX_DELAY):
+    """Exponential backoff with equal jitter."""
+    d = min(cap, base * (2 ** attempt))
+    return d / 2.0 + _jitter.uniform(0, d / 2.0)
+
+
+def call_with_backoff(provider, fn, est_tokens=0, max_retries=MAX_RETRIES, deadline=None):
+    """
+    Runs fn() under the provider limiter.
+    Retries 429 / 5xx / connection errors (not read timeouts) with jittered
+    exponential backoff,
+    using Retry-After when the server sends one. Anything else is re-raised,
+    and so is the last error when the next attempt would start past
+    `deadline` (time.monotonic()).
+    """
+    limiter = get_limiter(provider)
+    attempt = 0
+    while True:
+        current_call().add_queue_wait(limiter.acquire(est_tokens))
+        try:
+            return fn()
+        except Exception as e:
+            status = _status_of(e)
+            transient = status in RETRYABLE_STATUS or (status is None and type(e).__name__ in TRANSIENT_ERRORS)
+            if not transient or attempt >= max_retries:
+                limiter.count("failed")
+                raise
+
+            retry_after = _retry_after_of(e)
+            delay = retry_after if retry_after is not None else backoff_delay(attempt)
+            if deadline is not None and time.monotonic() + delay >= deadline:
+                limiter.count("failed")
+                raise
+            limiter.count("retried")
+            if status == 429:
+                limiter.count("rate_limited")
+                # everybody waits, not only this caller
+                limiter.pause(delay)
+            else:
+                current_call().add_queue_wait(delay)
+                sleep(delay)
+
+            attempt += 1
+            print(f"[RateLimit] {provider}: {status or type(e).__name__}, retry {attempt}/{max_retries} in {delay:.1f}s")
@@ -0,0 +1,279 @@
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+
+try:
+    from .enhancer_local import OLLAMA_KEEP_ALIVE
+    from .enhancer_clients import http_session
+    from .enhancer_async import current_binding, RequestCancelled
+    from .enhancer_telemetry import register_snapshot
+except ImportError:
+    from enhancer_local import OLLAMA_KEEP_ALIVE
+    from enhancer_clients import http_session
+    from enhancer_async import current_binding, RequestCancelled
+    from enhancer_telemetry import register_snapshot
+
+
+# =========================
+# 🧊 OLLAMA MODEL RESIDENCY
+# =========================
+# The first request after idle pays Ollama's model load (often 10-30 s), and
+# two nodes using two models on a host that only fits one evict each other
+# on every image.
+#   - warm-up: at node load the models used last time (or PCN_OLLAMA_WARMUP)
+#     are preloaded in the background with keep_alive
+#   - scheduler: requests for a model that is resident run right away; a
+#     request that needs a swap waits until the resident model's requests
+#     in flight are done, so queued requests are grouped by model
+# How many models fit is PCN_OLLAMA_MAX_LOADED (default 1); it is raised on
+# its own when a switch turns out not to need a reload.
+
+DEFAULT_HOST = os.environ.get("PCN_OLLAMA_HOST", "http://127.0.0.1:11434").rstrip("/")
+MAX_LOADED = max(1, int(os.environ.get("PCN_OLLAMA_MAX_LOADED", "1") or 1))
+MAX_LOADED_CAP = 8
+
+# load_duration above this means the model was (re)loaded for the request
+LOAD_MS = 500.0
+# same-model requests granted while a swap waits, before the swap goes first
+MAX_STREAK = 4
+# never hold a request longer than this (the host decides after that)
+MAX_WAIT_S = 120.0
+WAIT_POLL_S = 0.25
+WARMUP_TIMEOUT_S = 180
+
+
+class _Host:
+
+    def __init__(self, max_loaded):
+        self.max_loaded = max_loaded
+        self.resident = OrderedDict()   # model -> None, LRU first
+        self.inflight = {}              # model -> requests running
+        self.waiting = {}               # model -> requests queued for a swap
+        self.streak = 0
+        self.probes = {}                # model -> "pending" / "clean": swap with no reload seen yet
+
+
+class ResidencyScheduler:
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(os.path.dirname(__file__), "logs", "ollama_models.json")
+        self.cond = threading.Condition()
+        self.hosts = {}
+        self.rows = {}       # "host|model" -> counters
+        self.seen_at = {}    # (host, model) -> first time it was known loaded since its last load
+        self.known = None    # host -> [models], persisted for the next warm-up
+
+    # ---------- scheduling ----------
+    def _host(self, host):
+        h = self.hosts.get(host)
+        if h is None:
+            h = self.hosts[host] = _Host(MAX_LOADED)
+        return h
+
+    def _row(self, host, model):
+        return self.rows.setdefault(f"{host}|{model}", {
+            "requests": 0, "loads": 0, "evictions": 0, "load_ms_total": 0.0, "load_ms_max": 0.0,
+            "wait_ms_total": 0.0, "swap_waits": 0, "last_resident_s": None,
+        })
+
+    def _swaps_waiting(self, h):
+        return any(n for m, n in h.waiting.items() if m not in h.resident)
+
+    def _can_run(self, h, model):
+        if model in h.resident:
+            # let a waiting swap through once this model had its turn
+            return not (self._swaps_waiting(h) and h.streak >= MAX_STREAK)
+        if len(h.resident) < h.max_loaded:
+            return True
+        return any(not h.inflight.get(m) for m in h.resident)
+
+    def _grant(self, h, model):
+        if model not in h.resident:
+            if len(h.resident) >= h.max_loaded:
+                victim = next(m for m in h.resident if not h.inflight.get(m))
+                del h.resident[victim]
+                h.probes[model] = "pending"
+            h.resident[model] = None
+            h.streak = 0
+        else:
+            h.resident.move_to_end(model)
+            h.streak = h.streak + 1 if self._swaps_waiting(h) else 0
+        h.inflight[model] = h.inflight.get(model, 0) + 1
+
+    def acquire(self, host, model):
+        """Blocks until model may run on host; returns the time it was let through."""
+        binding = current_binding()
+        t0 = time.monotonic()
+        with self.cond:
+            h = self._host(host)
+            if not self._can_run(h, model):
+                self._row(host, model)["swap_waits"] += 1
+                h.waiting[model] = h.waiting.get(model, 0) + 1
+                try:
+                    while not self._can_run(h, model) and time.monotonic() - t0 < MAX_WAIT_S:
+                        self.cond.wait(WAIT_POLL_S)
+                        if binding is not None and binding.cancelled.is_set():
+                            raise RequestCancelled("interrupted")
+                finally:
+                    h.waiting[model] -= 1
+            if model not in h.resident and len(h.resident) >= h.max_loaded and all(h.inflight.get(m) for m in h.resident):
+                # waited MAX_WAIT_S: run anyway, the host sorts it out
+                h.inflight[model] = h.inflight.get(model, 0) + 1
+            else:
+                self._grant(h, model)
+            row = self._row(host, model)
+            row["requests"] += 1
+            row["wait_ms_total"] += (time.monotonic() - t0) * 1000.0
+            return time.monotonic()
+
+    def release(self, host, model, load_ms=None, started=None):
+        with self.cond:
+            h = self._host(host)
+            h.inflight[model] = max(0, h.inflight.get(model, 0) - 1)
+            if load_ms is not None:
+                self._observe(host, h, model, load_ms, started)
+            if not h.inflight[model] and h.probes.pop(model, None) == "clean" and h.max_loaded < MAX_LOADED_CAP:
+                # a whole group ran after a swap without any reload:
+                # the host keeps more models than we assumed
+                h.max_loaded += 1
+                print(f"[OllamaResidency] {host} keeps {h.max_loaded}+ models loaded")
+            self.cond.notify_all()
+        self._remember(host, model)
+
+    def slot(self, host, model):
+        return _Slot(self, host, model)
+
+    def _observe(self, host, h, model, load_ms, started):
+        row = self._row(host, model)
+        now = time.monotonic()
+        seen = self.seen_at.get((host, model))
+        if load_ms >= LOAD_MS:
+            row["loads"] += 1
+            row["load_ms_total"] += load_ms
+            row["load_ms_max"] = max(row["load_ms_max"], load_ms)
+            if seen is not None and started is not None and seen < started:
+                # known loaded before this request started: evicted since
+                row["evictions"] += 1
+                row["last_resident_s"] = round(started - seen, 1)
+                print(f"[OllamaResidency] {model} was evicted on {host} (loaded {started - seen:.0f}s earlier), reload took {load_ms:.0f} ms")
+            self.seen_at[(host, model)] = now
+            h.probes.pop(model, None)
+        else:
+            self.seen_at.setdefault((host, model), now)
+            if h.probes.get(model) == "pending":
+                h.probes[model] = "clean"
+
+    # ---------- warm-up ----------
+    def _load_known(self):
+        if self.known is not None:
+            return
+        self.known = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if isinstance(data, dict):
+                    self.known = {h: [m for m in ms if isinstance(m, str)] for h, ms in data.items() if isinstance(ms, list)}
+            except Exception as e:
+                print(f"[OllamaResidency] {self.path} ignored: {e}")
+
+    def _remember(self, host, model):
+        with self.cond:
+            self._load_known()
+            models = self.known.setdefault(host, [])
+            if model in models:
+                return
+            models.append(model)
+            del models[:-MAX_LOADED_CAP]
+            data = json.dumps(self.known, indent=2)
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(data)
+            os.replace(tmp, self.path)
+        except Exception as e:
+            print(f"[OllamaResidency] could not save {self.path}: {e}")
+
+    def warm_up_targets(self):
+        """[(host, model)] from PCN_OLLAMA_WARMUP, else the models used last time."""
+        spec = os.environ.get("PCN_OLLAMA_WARMUP", "auto").strip()
+        if spec.lower() in ("0", "off", "no", "false", ""):
+            return []
+        if spec.lower() != "auto":
+            return [(DEFAULT_HOST, m.strip()) for m in spec.split(",") if m.strip()]
+        with self.cond:
+            self._load_known()
+            return [(h, m) for h, ms in self.known.items() for m in ms[-MAX_LOADED:]]
+
+    def warm_up(self, targets=None):
+        """Loads each model with keep_alive (no generation). Returns {model: load_ms}."""
+        out = {}
+        for host, model in (self.warm_up_targets() if targets is None else targets):
+            try:
+                with self.slot(host, model) as s:
+                    r = http_session("ollama").post(
+                        f"{host}/api/generate",
+                        json={"model": model, "keep_alive": OLLAMA_KEEP_ALIVE},
+                        timeout=(5, WARMUP_TIMEOUT_S),
+                    )
+                    r.raise_for_status()
+                    load_ms = (r.json().get("load_duration") or 0) / 1e6
+                    s.loaded(load_ms)
+                out[model] = load_ms
+                print(f"[OllamaResidency] warmed up {model} on {host} ({load_ms:.0f} ms load)")
+            except Exception as e:
+                print(f"[OllamaResidency] warm-up of {model} on {host} skipped: {e}")
+        return out
+
+    def warm_up_in_background(self):
+        targets = self.warm_up_targets()
+        if not targets:
+            return None
+        t = threading.Thread(target=self.warm_up, args=(targets,), name="pcn-ollama-warmup", daemon=True)
+        t.start()
+        return t
+
+    def snapshot(self):
+        with self.cond:
+            out = {}
+            for key, row in self.rows.items():
+                r = dict(row)
+                r["load_ms_total"] = round(r["load_ms_total"], 1)
+                r["load_ms_max"] = round(r["load_ms_max"], 1)
+                r["avg_load_ms"] = round(row["load_ms_total"] / row["loads"], 1) if row["loads"] else None
+                r["wait_ms_total"] = round(r["wait_ms_total"], 1)
+                out[key] = r
+            hosts = {
+                host: {"max_loaded": h.max_loaded, "resident": list(h.resident)}
+                for host, h in self.hosts.items()
+            }
+            return {"models": out, "hosts": hosts}
+
+
+class _Slot:
+    """with residency.slot(host, model) as s: ...request...; s.loaded(load_ms)"""
+
+    def __init__(self, scheduler, host, model):
+        self.scheduler = scheduler
+        self.host = host
+        self.model = model
+        self.load_ms = None
+        self.started = None
+
+    def loaded(self, load_ms):
+        self.load_ms = load_ms
+
+    def __enter__(self):
+        self.started = self.scheduler.acquire(self.host, self.model)
+        return self
+
+    def __exit__(self, *exc):
+        self.scheduler.release(self.host, self.model, self.load_ms, self.started)
+        return False
+
+
+residency = ResidencyScheduler()
+register_snapshot("ollama_residency", residency.snapshot)
@@ -0,0 +1,134 @@
+import re
+import random
+import hashlib
+import threading
+from collections import OrderedDict
+
+try:
+    from .enhancer_telemetry import register_snapshot
+except ImportError:
+    from enhancer_telemetry import register_snapshot
+
+
+# =========================
+# 🧲 NEAR-DUPLICATE REUSE
+# =========================
+# Seed prompts of one world often differ by a pose or an accessory only, and
+# their enhancements are interchangeable. Each enhanced seed prompt gets a
+# MinHash signature over its word shingles, indexed in LSH buckets; a new
+# seed prompt close enough to an indexed one reuses its enhancement instead
+# of paying for another LLM call.
+# Entries are scoped (backend + model + system prompt + word range), so a
+# result is only reused where it could have been produced.
+
+NUM_PERM = 64
+BANDS = 16            # 16 bands x 4 rows: candidate pairs from ~0.5 similarity up
+ROWS = NUM_PERM // BANDS
+SHINGLE_WORDS = 2
+MAX_ENTRIES = 2048
+
+_PRIME = (1 << 61) - 1
+_rng = random.Random(0x5EED)
+_PERMS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+
+
+def shingles(text):
+    words = re.findall(r"[a-z0-9']+", (text or "").lower())
+    if len(words) < SHINGLE_WORDS:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+
+
+def _h64(s):
+    return int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def minhash(text):
+    """NUM_PERM-slot MinHash signature of the text's word shingles (None if empty)."""
+    hashes = [_h64(s) for s in shingles(text)]
+    if not hashes:
+        return None
+    return tuple(min((a * x + b) % _PRIME for x in hashes) for a, b in _PERMS)
+
+
+def similarity(sig_a, sig_b):
+    """Estimated Jaccard similarity of two signatures."""
+    return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / NUM_PERM
+
+
+def _bands(sig):
+    return [(i, sig[i * ROWS:(i + 1) * ROWS]) for i in range(BANDS)]
+
+
+class SimilarityCache:
+
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()   # id -> (scope, signature, text)
+        self.buckets = {}              # (scope, band, rows) -> set of ids
+        self.next_id = 0
+        self.counters = {"lookups": 0, "hits": 0, "misses": 0, "candidates": 0, "indexed": 0, "evicted": 0}
+
+    def _unlink(self, entry_id):
+        scope, sig, _ = self.entries.pop(entry_id)
+        for band in _bands(sig):
+            ids = self.buckets.get((scope,) + band)
+            if ids is not None:
+                ids.discard(entry_id)
+                if not ids:
+                    del self.buckets[(scope,) + band]
+
+    def add(self, scope, seed_prompt, text):
+        sig = minhash(seed_prompt)
+        if sig is None or not text:
+            return
+        with self.lock:
+            entry_id = self.next_id
+            self.next_id += 1
+            self.entries[entry_id] = (scope, sig, text)
+            for band in _bands(sig):
+                self.buckets.setdefault((scope,) + band, set()).add(entry_id)
+            self.counters["indexed"] += 1
+            while len(self.entries) > self.max_entries:
+                self._unlink(next(iter(self.entries)))
+                self.counters["evicted"] += 1
+
+    def lookup(self, scope, seed_prompt, threshold):
+        """(text, similarity) of the closest indexed prompt at >= threshold, or None."""
+        sig = minhash(seed_prompt)
+        with self.lock:
+            self.counters["lookups"] += 1
+            candidates = set()
+            if sig is not None:
+                for band in _bands(sig):
+                    candidates |= self.buckets.get((scope,) + band, set())
+            self.counters["candidates"] += len(candidates)
+            best, best_sim = None, 0.0
+            for entry_id in candidates:
+                sim = similarity(sig, self.entries[entry_id][1])
+                if sim > best_sim:
+                    best, best_sim = entry_id, sim
+            if best is None or best_sim < threshold:
+                self.counters["misses"] += 1
+                return None
+            self.entries.move_to_end(best)
+            self.counters["hits"] += 1
+            return self.entries[best][2], best_sim
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.buckets.clear()
+
+    def snapshot(self):
+        with self.lock:
+            out = dict(self.counters)
+            out["entries"] = len(self.entries)
+        looked_up = out["hits"] + out["misses"]
+        out["hit_rate"] = round(out["hits"] / looked_up, 3) if looked_up else None
+        return out
+
+
+similarity_cache = SimilarityCache()
+register_snapshot("similarity_cache", similarity_cache.snapshot)
@@ -0,0 +1,94 @@
+import threading
+
+try:
+    from .enhancer_async import current_binding, RequestCancelled
+    from .enhancer_telemetry import register_snapshot
+except ImportError:
+    from enhancer_async import current_binding, RequestCancelled
+    from enhancer_telemetry import register_snapshot
+
+
+# =========================
+# 🛫 REQUEST COALESCING
+# =========================
+# Queued executions, or several nodes of one graph, often ask for the very
+# same enhancement at the same time. The first caller for a key issues the
+# request; the others wait for it and get the same result (or exception).
+# A follower whose leader was interrupted retries on its own: an interrupt
+# only aborts the execution that was cancelled.
+
+WAIT_POLL_S = 0.25
+
+
+class _Flight:
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.followers = 0
+
+
+class SingleFlight:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.inflight = {}   # key -> _Flight
+        self.rows = {}       # tag -> counters
+
+    def _count(self, tag, key, amount=1):
+        row = self.rows.setdefault(tag, {"calls": 0, "shared": 0, "retried": 0})
+        row[key] += amount
+
+    def do(self, key, fn, tag=""):
+        """fn() once per key among concurrent callers; everyone gets its result."""
+        while True:
+            with self.lock:
+                flight = self.inflight.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self.inflight[key] = _Flight()
+                    self._count(tag, "calls")
+                else:
+                    flight.followers += 1
+                    self._count(tag, "shared")
+
+            if leader:
+                try:
+                    flight.result = fn()
+                    return flight.result
+                except BaseException as e:
+                    flight.error = e
+                    raise
+                finally:
+                    with self.lock:
+                        self.inflight.pop(key, None)
+                    flight.done.set()
+
+            self._wait(flight)
+            if isinstance(flight.error, RequestCancelled):
+                with self.lock:
+                    # not saved after all: this caller sends its own request
+                    self._count(tag, "shared", -1)
+                    self._count(tag, "retried")
+                continue
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+    @staticmethod
+    def _wait(flight):
+        binding = current_binding()
+        while not flight.done.wait(WAIT_POLL_S):
+            if binding is not None and binding.cancelled.is_set():
+                raise RequestCancelled("interrupted")
+
+    def snapshot(self):
+        with self.lock:
+            out = {tag: dict(row) for tag, row in self.rows.items()}
+            total = sum(row["shared"] for row in self.rows.values())
+            return {"calls_saved": total, "inflight": len(self.inflight), "by_node": out}
+
+
+singleflight = SingleFlight()
+register_snapshot("coalescing", singleflight.snapshot)
@@ -0,0 +1,370 @@
+import os
+import json
+import time
+import atexit
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+
+# =========================
+# 📈 ENHANCER TELEMETRY
+# =========================
+# Every enhancer call in Creator / Builder / Refiner is wrapped in track(),
+# which records (per node + backend):
+#   queue_wait_ms  time spent blocked before sending (rate limiter, scheduler)
+#   connect_ms     transport overhead: client wall time minus server time
+#   ttft_ms        time to first token (streamed, or server load+prompt eval)
+#   total_ms       whole call
+#   tokens_in/out  reported by the backend, estimated (~4 chars/token) otherwise
+#   outcome        success / fallback / error
+# Dumped to logs/enhancer_stats.json and logs/enhancer_stats.prom
+# (Prometheus text format, e.g. for node_exporter's textfile collector).
+
+LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000, 20000, 30000, 60000, 120000)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096)
+
+WINDOW = 1000            # samples kept for rolling percentiles
+WRITE_INTERVAL_S = 30.0  # stats files are rewritten at most this often
+
+OUTCOMES = ("success", "fallback", "error")
+
+
+class RollingHistogram:
+    """Cumulative fixed buckets (for Prometheus) + last WINDOW samples (for percentiles)."""
+
+    def __init__(self, buckets, window=WINDOW):
+        self.bounds = tuple(buckets)
+        self.counts = [0] * (len(self.bounds) + 1)   # last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, value):
+        if value is None:
+            return
+        value = float(value)
+        i = 0
+        while i < len(self.bounds) and value > self.bounds[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+
+    @staticmethod
+    def _pct(ordered, q):
+        if not ordered:
+            return None
+        i = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+        return round(ordered[i], 1)
+
+    def snapshot(self):
+        ordered = sorted(self.recent)
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 1),
+            "p50": self._pct(ordered, 0.50),
+            "p95": self._pct(ordered, 0.95),
+            "p99": self._pct(ordered, 0.99),
+            "max": round(ordered[-1], 1) if ordered else None,
+        }
+
+    def cumulative(self):
+        out = []
+        running = 0
+        for bound, c in zip(self.bounds + ("+Inf",), self.counts):
+            running += c
+            out.append((bound, running))
+        return out
+
+
+class EnhancerCall:
+
+    def __init__(self, node, backend, model):
+        self.node = node
+        self.backend = backend
+        self.model = model or ""
+        self.t0 = time.perf_counter()
+        self.queue_wait_s = 0.0
+        self.connect_s = None
+        self.ttft_s = None
+        self.total_s = None
+        self.tokens_in = None
+        self.tokens_out = None
+        self.outcome = "success"
+        self.reason = ""
+
+    # --- annotations (safe to call from any helper below track()) ---
+    def add_queue_wait(self, seconds):
+        if seconds and seconds > 0:
+            self.queue_wait_s += seconds
+
+    def set_connect(self, seconds):
+        if seconds is not None and self.connect_s is None:
+            self.connect_s = max(0.0, seconds)
+
+    def set_ttft(self, seconds):
+        if seconds is not None and self.ttft_s is None:
+            self.ttft_s = max(0.0, seconds)
+
+    def set_tokens(self, tokens_in=None, tokens_out=None):
+        if tokens_in:
+            self.tokens_in = int(tokens_in)
+        if tokens_out:
+            self.tokens_out = int(tokens_out)
+
+    def fallback(self, reason=""):
+        self.outcome = "fallback"
+        self.reason = reason
+
+    def estimate_tokens(self, prompt_text, output_text):
+        """Fills token counts the backend did not report."""
+        if self.tokens_in is None and prompt_text:
+            self.tokens_in = len(prompt_text) // 4
+        if self.tokens_out is None and output_text:
+            self.tokens_out = len(output_text) // 4
+
+    def elapsed(self):
+        return time.perf_counter() - self.t0
+
+
+class _NoCall(EnhancerCall):
+    """Returned by current_call() outside track(): annotations go nowhere."""
+
+    def __init__(self):
+        super().__init__("", "", "")
+
+
+class EnhancerStats:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.series = {}
+        self.last_write = 0.0
+
+    def _row(self, node, backend):
+        key = (node, backend)
+        row = self.series.get(key)
+        if row is None:
+            row = self.series[key] = {
+                "queue_wait_ms": RollingHistogram(LATENCY_BUCKETS_MS),
+                "connect_ms": RollingHistogram(LATENCY_BUCKETS_MS),
+                "ttft_ms": RollingHistogram(LATENCY_BUCKETS_MS),
+                "total_ms": RollingHistogram(LATENCY_BUCKETS_MS),
+                "tokens_in": RollingHistogram(TOKEN_BUCKETS),
+                "tokens_out": RollingHistogram(TOKEN_BUCKETS),
+                "outcomes": {o: 0 for o in OUTCOMES},
+                "gen_s": 0.0,
+                "gen_tokens": 0,
+                "models": {},
+            }
+        return row
+
+    def record(self, call):
+        ms = 1000.0
+        with self.lock:
+            row = self._row(call.node, call.backend)
+            row["queue_wait_ms"].observe(call.queue_wait_s * ms)
+            row["connect_ms"].observe(call.connect_s * ms if call.connect_s is not None else None)
+            row["ttft_ms"].observe(call.ttft_s * ms if call.ttft_s is not None else None)
+            row["total_ms"].observe(call.total_s * ms)
+            row["tokens_in"].observe(call.tokens_in)
+            row["tokens_out"].observe(call.tokens_out)
+            row["outcomes"][call.outcome] = row["outcomes"].get(call.outcome, 0) + 1
+            if call.outcome == "success" and call.tokens_out:
+                row["gen_s"] += max(0.0, call.total_s - call.queue_wait_s)
+                row["gen_tokens"] += call.tokens_out
+            if call.model:
+                row["models"][call.model] = row["models"].get(call.model, 0) + 1
+
+    def snapshot(self, node=None):
+        with self.lock:
+            out = {}
+            for (n, backend), row in self.series.items():
+                if node and n != node:
+                    continue
+                out[f"{n}/{backend}"] = {
+                    "outcomes": dict(row["outcomes"]),
+                    "models": dict(row["models"]),
+                    "queue_wait_ms": row["queue_wait_ms"].snapshot(),
+                    "connect_ms": row["connect_ms"].snapshot(),
+                    "ttft_ms": row["ttft_ms"].snapshot(),
+                    "total_ms": row["total_ms"].snapshot(),
+                    "tokens_in": row["tokens_in"].snapshot(),
+                    "tokens_out": row["tokens_out"].snapshot(),
+                    "tokens_out_per_s": round(row["gen_tokens"] / row["gen_s"], 1) if row["gen_s"] else None,
+                }
+            return out
+
+    def prometheus(self):
+        lines = []
+
+        def esc(v):
+            return str(v).replace("\\", "\\\\").replace('"', '\\"')
+
+        with self.lock:
+            items = sorted(self.series.items())
+            for metric in ("queue_wait_ms", "connect_ms", "ttft_ms", "total_ms", "tokens_in", "tokens_out"):
+                name = f"pcn_enhancer_{metric}"
+                lines.append(f"# TYPE {name} histogram")
+                for (node, backend), row in items:
+                    h = row[metric]
+                    labels = f'node="{esc(node)}",backend="{esc(backend)}"'
+                    for bound, c in h.cumulative():
+                        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {c}')
+                    lines.append(f"{name}_sum{{{labels}}} {h.sum:.3f}")
+                    lines.append(f"{name}_count{{{labels}}} {h.count}")
+
+            lines.append("# TYPE pcn_enhancer_calls_total counter")
+            for (node, backend), row in items:
+                for outcome, c in sorted(row["outcomes"].items()):
+                    lines.append(
+                        f'pcn_enhancer_calls_total{{node="{esc(node)}",backend="{esc(backend)}",outcome="{outcome}"}} {c}'
+                    )
+        return "\n".join(lines) + "\n"
+
+
+stats = EnhancerStats()
+_local = threading.local()
+_NO_CALL = _NoCall()
+
+
+def current_call():
+    return getattr(_local, "call", None) or _NO_CALL
+
+
+@contextmanager
+def track(node, backend, model=None):
+    call = EnhancerCall(node, backend, model)
+    prev = getattr(_local, "call", None)
+    _local.call = call
+    try:
+        yield call
+    except BaseException as e:
+        call.outcome = "error"
+        call.reason = str(e)
+        raise
+    finally:
+        _local.call = prev
+        call.total_s = call.elapsed()
+        stats.record(call)
+        maybe_write()
+
+
+# ---------- annotation helpers used by the backends ----------
+def note_server_timings(r, timings):
+    """Local backends report load / prompt-eval / generation time (see enhancer_local)."""
+    if not timings:
+        return
+    call = current_call()
+    server_s = (timings.get("load_ms", 0.0) + timings["prompt_ms"] + timings["gen_ms"]) / 1000.0
+    overhead = None
+    try:
+        overhead = max(0.0, r.elapsed.total_seconds() - server_s)
+        call.set_connect(overhead)
+    except Exception:
+        pass
+    call.set_ttft((overhead or 0.0) + (timings.get("load_ms", 0.0) + timings["prompt_ms"]) / 1000.0)
+    call.set_tokens(timings["prompt_tokens"], timings["gen_tokens"])
+
+
+def note_usage(tokens_in=None, tokens_out=None):
+    current_call().set_tokens(tokens_in, tokens_out)
+
+
+def note_usage_from(resp):
+    """Token usage from whatever shape the provider returned."""
+    try:
+        if isinstance(resp, dict):
+            u = resp.get("usage") or {}
+            note_usage(u.get("prompt_tokens"), u.get("completion_tokens"))
+            return
+        meta = getattr(resp, "usage_metadata", None)            # gemini
+        if meta is not None:
+            note_usage(getattr(meta, "prompt_token_count", None), getattr(meta, "candidates_token_count", None))
+            return
+        usage = getattr(resp, "usage", None)
+        tokens = getattr(usage, "tokens", None)                 # cohere v2
+        if tokens is not None:
+            note_usage(getattr(tokens, "input_tokens", None), getattr(tokens, "output_tokens", None))
+        elif usage is not None:                                 # openai
+            note_usage(getattr(usage, "prompt_tokens", None), getattr(usage, "completion_tokens", None))
+    except Exception:
+        pass
+
+
+# ---------- dumps ----------
+# section name -> (snapshot function, costly). Each subsystem registers its
+# own next to its singleton; costly sections read files or databases and are
+# only built for a full snapshot.
+_providers = {}
+
+
+def register_snapshot(name, fn, costly=False):
+    _providers[name] = (fn, costly)
+
+
+def snapshot(node=None, full=True):
+    out = {"enhancers": stats.snapshot(node)}
+    for name, (fn, costly) in list(_providers.items()):
+        if costly and not full:
+            continue
+        try:
+            out[name] = fn()
+        except Exception as e:
+            out[name] = {"error": str(e)}
+    return out
+
+
+def stats_json(node=None, full=True):
+    return json.dumps(snapshot(node, full), ensure_ascii=False)
+
+
+def output_connected(graph, node_id, index):
+    """
+    True if output `index` of node_id feeds another node of the queued graph
+    (ComfyUI's hidden PROMPT / UNIQUE_ID inputs), or if that can't be told.
+    """
+    if not isinstance(graph, dict) or node_id is None or str(node_id) not in graph:
+        return True
+    node_id = str(node_id)
+    for node in graph.values():
+        inputs = node.get("inputs") if isinstance(node, dict) else None
+        for value in (inputs or {}).values():
+            if isinstance(value, list) and len(value) == 2 and str(value[0]) == node_id and value[1] == index:
+                return True
+    return False
+
+
+def _logs_dir():
+    return os.path.join(os.path.dirname(__file__), "logs")
+
+
+def write_stats(log_dir=None):
+    log_dir = log_dir or _logs_dir()
+    try:
+        os.makedirs(log_dir, exist_ok=True)
+        for name, text in (
+            ("enhancer_stats.json", json.dumps(snapshot(), ensure_ascii=False, indent=2)),
+            ("enhancer_stats.prom", stats.prometheus()),
+        ):
+            path = os.path.join(log_dir, name)
+            tmp = path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(tmp, path)
+    except Exception as e:
+        print(f"[EnhancerStats] could not write stats: {e}")
+
+
+def maybe_write():
+    now = time.monotonic()
+    with stats.lock:
+        if now - stats.last_write < WRITE_INTERVAL_S:
+            return
+        stats.last_write = now
+    write_stats()
+
+
+atexit.register(lambda: stats.series and write_stats())
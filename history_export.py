@@ -0,0 +1,227 @@
+"""
+Columnar export of the prompt history.
+
+Converts logs/prompt_history.jsonl and its rotated segments (logs/history/)
+into Arrow IPC files (default) or Parquet, so dataset and analytics jobs
+read columns instead of re-parsing the JSONL. Each run appends only the
+entries logged since the previous one, as new part files:
+
+    logs/history_arrow/part-000001.arrow, part-000002.arrow, ...
+
+json_world, source and system_prompt (and the other low-cardinality
+columns) are dictionary-encoded. Arrow files are written uncompressed by
+default, so they can be memory-mapped without copying:
+
+    import pyarrow as pa, pyarrow.dataset as ds
+    table = ds.dataset("logs/history_arrow", format="arrow").to_table()
+    with pa.memory_map("logs/history_arrow/part-000001.arrow") as src:
+        table = pa.ipc.open_file(src).read_all()        # zero-copy
+    df = table.to_pandas()
+
+Needs pyarrow (pip install pyarrow).
+
+    python history_export.py
+    python history_export.py --format parquet
+    python history_export.py --out /data/prompt_history --rebuild
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from datetime import datetime
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet as pq
+except ImportError:   # optional: the exporter only
+    pa = None
+
+try:
+    from .history_segments import HistoryLog
+    from .history_writer import replace_text, locked
+except ImportError:
+    from history_segments import HistoryLog
+    from history_writer import replace_text, locked
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+PART_ROWS = 250_000       # rows per part file (memory used by a run)
+BATCH_ROWS = 64 * 1024    # record batch / row group size
+STATE_FILE = "_export_state.json"
+
+FORMATS = {
+    # format: (file suffix, default compression)
+    "arrow": (".arrow", "none"),     # compressed buffers can't be memory-mapped as is
+    "parquet": (".parquet", "zstd"),
+}
+
+# column -> kind; "dict" columns are dictionary-encoded
+COLUMNS = {
+    "timestamp": "time",
+    "json_world": "dict",
+    "source": "dict",
+    "system_prompt": "dict",
+    "gender": "dict",
+    "use_enhancer": "dict",
+    "node_version": "dict",
+    "custom_intro": "text",
+    "lora_triggers": "text",
+    "final_prompt": "text",
+    "enhance_ms": "float",
+    "seed_fp": "text",              # hex, as logged: uint64 would turn float in pandas
+}
+
+
+def _value(kind, v):
+    if v is None or v == "":
+        return None
+    try:
+        if kind == "time":
+            return datetime.fromisoformat(str(v))
+        if kind == "float":
+            return float(v)
+    except (TypeError, ValueError):
+        return None
+    if isinstance(v, list):
+        return ", ".join(str(x) for x in v)
+    return str(v)
+
+
+def _array(kind, values):
+    if kind == "time":
+        return pa.array(values, type=pa.timestamp("s"))
+    if kind == "float":
+        return pa.array(values, type=pa.float64())
+    arr = pa.array(values, type=pa.string())
+    # one dictionary per part file: every batch of the file shares it
+    return arr.dictionary_encode() if kind == "dict" else arr
+
+
+def _table(columns):
+    return pa.table({name: _array(kind, columns[name]) for name, kind in COLUMNS.items()})
+
+
+def _write(table, path, fmt, compression):
+    codec = None if compression == "none" else compression
+    if fmt == "parquet":
+        dict_columns = [name for name, kind in COLUMNS.items() if kind == "dict"]
+        pq.write_table(table, path, compression=codec or "none", use_dictionary=dict_columns, row_group_size=BATCH_ROWS)
+        return
+    options = pa.ipc.IpcWriteOptions(compression=codec)
+    with pa.OSFile(path, "wb") as sink, pa.ipc.new_file(sink, table.schema, options=options) as writer:
+        writer.write_table(table, max_chunksize=BATCH_ROWS)
+
+
+def _read_state(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def export(base=HERE, out=None, fmt="arrow", compression=None, part_rows=PART_ROWS, rebuild=False):
+    """
+    Writes the entries logged since the last export as new part files.
+    Returns {"rows", "parts", "total_rows", "seconds", "out"} of this run.
+    """
+    if pa is None:
+        raise RuntimeError("pyarrow is not installed (pip install pyarrow)")
+    suffix, default_codec = FORMATS[fmt]
+    compression = compression or default_codec
+    log = HistoryLog(base)
+    out = out or os.path.join(base, "logs", f"history_{fmt}")
+    os.makedirs(out, exist_ok=True)
+    state_path = os.path.join(out, STATE_FILE)
+    t0 = time.perf_counter()
+
+    # one export at a time per folder
+    with open(os.path.join(out, ".export.lock"), "a") as lf, locked(lf):
+        state = None if rebuild else _read_state(state_path)
+        if state and state.get("format") != fmt:
+            raise RuntimeError(f"{out} holds {state.get('format')} parts: use --rebuild or another --out")
+        for name in os.listdir(out):
+            # parts of an interrupted run (never recorded), or everything on --rebuild
+            if name.endswith(".tmp") or (rebuild and name.startswith("part-")):
+                os.remove(os.path.join(out, name))
+        state = state or {"format": fmt, "cursor": {}, "rows": 0, "parts": [], "next_part": 1}
+
+        cursor = state["cursor"]
+        written = []        # (tmp path, final name, rows)
+        columns = {name: [] for name in COLUMNS}
+        rows = 0
+
+        def flush():
+            nonlocal rows, columns
+            if not rows:
+                return
+            part = f"part-{state['next_part']:06d}{suffix}"
+            state["next_part"] += 1
+            tmp = os.path.join(out, part + ".tmp")
+            _write(_table(columns), tmp, fmt, compression)
+            written.append((tmp, part, rows))
+            columns = {name: [] for name in COLUMNS}
+            rows = 0
+
+        for lines in log.new_lines(cursor):
+            for line in lines:
+                try:
+                    e = json.loads(line)
+                except Exception:
+                    continue
+                for name, kind in COLUMNS.items():
+                    columns[name].append(_value(kind, e.get(name)))
+                rows += 1
+                if rows >= part_rows:
+                    flush()
+        flush()
+
+        # parts become visible together, then the cursor moves past them
+        for tmp, name, n in written:
+            os.replace(tmp, os.path.join(out, name))
+            state["parts"].append(name)
+            state["rows"] += n
+        state["cursor"] = cursor
+        state["compression"] = compression
+        replace_text(state_path, json.dumps(state, indent=1))
+
+    return {
+        "rows": sum(n for _, _, n in written),
+        "parts": [name for _, name, _ in written],
+        "total_rows": state["rows"],
+        "seconds": round(time.perf_counter() - t0, 2),
+        "out": out,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--base", default=HERE, help="node folder holding logs/")
+    ap.add_argument("--out", default=None, help="output folder (default: logs/history_<format>)")
+    ap.add_argument("--format", choices=sorted(FORMATS), default="arrow")
+    ap.add_argument("--compression", choices=["none", "lz4", "zstd"], default=None,
+                    help="default: none for arrow (memory-mappable), zstd for parquet")
+    ap.add_argument("--part-rows", type=int, default=PART_ROWS)
+    ap.add_argument("--rebuild", action="store_true", help="drop the exported parts and start over")
+    args = ap.parse_args()
+
+    if pa is None:
+        print("[HistoryExport] pyarrow is not installed (pip install pyarrow)", file=sys.stderr)
+        return 1
+    try:
+        result = export(args.base, args.out, args.format, args.compression, args.part_rows, args.rebuild)
+    except RuntimeError as e:
+        print(f"[HistoryExport] {e}", file=sys.stderr)
+        return 1
+    if result["rows"]:
+        print(f"[HistoryExport] {result['rows']} new entries in {len(result['parts'])} parts "
+              f"({result['total_rows']} total) in {result['seconds']} s -> {result['out']}", file=sys.stderr)
+    else:
+        print(f"[HistoryExport] no new entries ({result['total_rows']} exported) -> {result['out']}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
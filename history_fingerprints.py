@@ -0,0 +1,453 @@
+import os
+import json
+import mmap
+import time
+import struct
+import hashlib
+import threading
+from datetime import datetime
+
+try:
+    from .history_writer import history_writer, replace_text, locked
+    from .history_segments import history_log, iter_lines, parse_time
+    from .enhancer_telemetry import register_snapshot
+except ImportError:
+    from history_writer import history_writer, replace_text, locked
+    from history_segments import history_log, iter_lines, parse_time
+    from enhancer_telemetry import register_snapshot
+
+
+# =========================
+# 🧬 PROMPT FINGERPRINTS
+# =========================
+# logs/prompt_fingerprints.<gen>.bin is a hash set of every seed prompt the
+# Creator sent to an enhancer and every final prompt it logged: 64-bit
+# fingerprints of the normalized text, in an open-addressing table (12-byte
+# slots, linear probing, at most 3/4 full) read through mmap. A lookup
+# touches one or two slots whatever the size: microseconds at tens of
+# millions of entries, about 16 bytes per entry on disk, only the pages
+# touched in memory.
+# Each slot also keeps the time of the newest run, which is enough to find
+# the logged entry again (the segment manifest narrows it to one file).
+# The table never grows in place or under a file another process may have
+# mapped (Windows refuses to replace those): once half full, sync() writes
+# the next generation in the background under a new name, then marks the
+# old one retired in its header. Every process checks that mark on its next
+# lookup and moves to the new file; retired files are removed once nothing
+# maps them any more.
+# Like history_index, it is derived from the log and can be deleted at any
+# time: it catches up on the lines and segments added since its last sync
+# (state in logs/prompt_fingerprints.json).
+
+MAGIC = b"PCNFP2\x00\x00"
+HEADER = struct.Struct("<8sQQQ")    # magic, capacity (power of two), used slots, next generation (0 = current)
+SLOT = struct.Struct("<QI")         # fingerprint (0 = empty), unix time of the newest run
+MIN_CAPACITY = 1 << 16
+MAX_LOAD = 0.75
+GROW_AT = 0.5                       # load at which sync() starts the next generation in the background
+
+# duplicate_policy input of the Creator
+POLICIES = ["off", "proceed", "reuse", "resample"]
+
+
+def normalize(text):
+    """Case, whitespace and add_symbols brackets don't make a prompt new."""
+    t = str(text or "").strip().lower()
+    if t.startswith("[") and t.endswith("]"):
+        t = t[1:-1]
+    return " ".join(t.split()).strip(" ,.;")
+
+
+def _fingerprint(kind, *parts):
+    h = hashlib.blake2b(kind.encode("utf-8"), digest_size=8)
+    for part in parts:
+        h.update(b"\x00")
+        h.update(normalize(part).encode("utf-8"))
+    return int.from_bytes(h.digest(), "little") or 1
+
+
+def seed_key(system_prompt, user_prompt):
+    """Fingerprint of an enhancer request: system prompt + words-controlled seed prompt."""
+    return _fingerprint("seed", system_prompt, user_prompt)
+
+
+def final_key(final_prompt):
+    return _fingerprint("final", final_prompt)
+
+
+def key_hex(key):
+    """As logged in the history entries (seed_fp)."""
+    return f"{key:016x}"
+
+
+def _create(path, capacity):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, capacity, 0, 0))
+        f.truncate(HEADER.size + capacity * SLOT.size)   # sparse where the OS allows
+    return tmp
+
+
+class PromptFingerprints:
+
+    def __init__(self, path=None, log=None):
+        self.log = log or history_log
+        # generations are <stem>.<gen>.bin; <stem>.bin is the single table of older versions
+        self.legacy_path = path or os.path.join(os.path.dirname(self.log.path), "prompt_fingerprints.bin")
+        self.stem = os.path.splitext(self.legacy_path)[0]
+        self.state_path = self.stem + ".json"
+        self.lock_path = self.legacy_path + ".lock"
+        # lock order: the file lock (writers, across processes), then this one
+        self.lock = threading.RLock()
+        self.file = None
+        self.map = None
+        self.capacity = 0
+        self.gen = 0
+        self.growing = False
+        self.counters = {
+            "lookups": 0, "seed_hits": 0, "final_hits": 0, "added": 0, "add_skipped": 0, "synced_lines": 0,
+            "sync_skipped": 0, "grown": 0, "reused": 0, "resampled": 0, "reuse_missing": 0, "sync_ms_total": 0.0,
+        }
+
+    def count(self, key, amount=1):
+        with self.lock:
+            self.counters[key] += amount
+
+    # ---------- generations ----------
+    def _gen_path(self, gen):
+        return f"{self.stem}.{gen:06d}.bin"
+
+    def _gens(self):
+        prefix = os.path.basename(self.stem) + "."
+        out = []
+        try:
+            names = os.listdir(os.path.dirname(self.stem))
+        except OSError:
+            return out
+        for name in names:
+            gen = name[len(prefix):-4] if name.startswith(prefix) and name.endswith(".bin") else ""
+            if gen.isdigit():
+                out.append(int(gen))
+        return sorted(out)
+
+    def _sweep(self):
+        """
+        Removes retired generations, and tables of grows that died half-way.
+        Call with the file lock held. A file still mapped by another process
+        (Windows) waits for a later sync.
+        """
+        prefix = os.path.basename(self.stem) + "."
+        stale = [self._gen_path(gen) for gen in self._gens() if gen < self.gen]
+        try:
+            stale += [
+                os.path.join(os.path.dirname(self.stem), name) for name in os.listdir(os.path.dirname(self.stem))
+                if name.startswith(prefix) and name.endswith(".tmp")
+            ]
+        except OSError:
+            pass
+        if os.path.exists(self.legacy_path):
+            stale.append(self.legacy_path)
+        for path in stale:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    # ---------- table ----------
+    def _close(self):
+        if self.map is not None:
+            self.map.close()
+            self.file.close()
+        self.map = self.file = None
+        self.capacity = 0
+
+    def _open(self, gen):
+        """Maps generation gen; False if it is gone or unreadable."""
+        try:
+            f = open(self._gen_path(gen), "r+b")
+        except OSError:
+            return False
+        m = mmap.mmap(f.fileno(), 0)
+        magic, capacity, _, _ = HEADER.unpack_from(m, 0)
+        if magic != MAGIC or len(m) != HEADER.size + capacity * SLOT.size:
+            m.close()
+            f.close()
+            return False
+        self.file, self.map, self.capacity, self.gen = f, m, capacity, gen
+        return True
+
+    def _next_gen(self):
+        return HEADER.unpack_from(self.map, 0)[3]
+
+    def _map(self, create=False):
+        """
+        Maps the current generation, following the retired mark of the mapped
+        one (a header read: no stat per lookup). create=True (writers, under
+        the file lock) starts a new table when there is none. Call with
+        self.lock held.
+        """
+        if self.map is not None:
+            gen = self._next_gen()
+            if not gen:
+                return True
+            self._close()
+        else:
+            gens = self._gens()
+            gen = gens[-1] if gens else None
+        while gen is not None:
+            if not self._open(gen):
+                # removed meanwhile (grown twice), or unreadable
+                gens = self._gens()
+                gen = gens[-1] if gens and gens[-1] > gen else None
+                continue
+            gen = self._next_gen()
+            if not gen:
+                return True
+            self._close()
+        if not create:
+            return False
+        # none, or unreadable: start over, the log has everything
+        gens = self._gens()
+        if gens:
+            print("[PromptFingerprints] table unreadable, rebuilding from the history log")
+        gen = (gens[-1] if gens else 0) + 1
+        os.replace(_create(self._gen_path(gen), MIN_CAPACITY), self._gen_path(gen))
+        if os.path.exists(self.state_path):
+            os.remove(self.state_path)
+        return self._open(gen)
+
+    def _get(self, key):
+        m, mask = self.map, self.capacity - 1
+        i = key & mask
+        while True:
+            k, v = SLOT.unpack_from(m, HEADER.size + i * SLOT.size)
+            if k == key:
+                return v
+            if k == 0:
+                return None
+            i = (i + 1) & mask
+
+    def _put(self, m, capacity, key, value):
+        """True if the key is new. Keeps the newest time of a known key."""
+        mask = capacity - 1
+        i = key & mask
+        while True:
+            off = HEADER.size + i * SLOT.size
+            k, v = SLOT.unpack_from(m, off)
+            if k == key:
+                if value > v:
+                    SLOT.pack_into(m, off, key, value)
+                return False
+            if k == 0:
+                SLOT.pack_into(m, off, key, value)
+                return True
+            i = (i + 1) & mask
+
+    def _used(self):
+        return HEADER.unpack_from(self.map, 0)[2]
+
+    def _add_many(self, pairs, grow=True):
+        """
+        Inserts (key, unix time) pairs; returns how many were new. When they
+        would overfill the table it grows first (grow=True, sync only) or
+        nothing is inserted (None).
+        """
+        pairs = list(pairs)
+        if not pairs:
+            return 0
+        used = self._used()
+        if used + len(pairs) > self.capacity * MAX_LOAD:
+            if not grow:
+                return None
+            self._grow(used + len(pairs))
+            used = self._used()
+        added = 0
+        for key, value in pairs:
+            if self._put(self.map, self.capacity, key, value):
+                added += 1
+        HEADER.pack_into(self.map, 0, MAGIC, self.capacity, used + added, 0)
+        return added
+
+    def _grow(self, needed):
+        """
+        Writes the next generation and retires this one. Call with the file
+        lock held (no writer can touch the table meanwhile): lookups in this
+        process go on reading the current map while it is copied.
+        """
+        capacity = self.capacity
+        while needed > capacity * GROW_AT:
+            capacity *= 2
+        gen = self.gen + 1
+        tmp = _create(self._gen_path(gen), capacity)
+        used = 0
+        with open(tmp, "r+b") as f, mmap.mmap(f.fileno(), 0) as m:
+            for key, value in SLOT.iter_unpack(memoryview(self.map)[HEADER.size:]):
+                if key:
+                    self._put(m, capacity, key, value)
+                    used += 1
+            HEADER.pack_into(m, 0, MAGIC, capacity, used, 0)
+            m.flush()
+        # a new name: nothing has it mapped, so this works on Windows too
+        os.replace(tmp, self._gen_path(gen))
+        with self.lock:
+            HEADER.pack_into(self.map, 0, MAGIC, self.capacity, self._used(), gen)
+            self.map.flush()
+            self._close()
+            self._open(gen)
+            self.counters["grown"] += 1
+        self._sweep()
+        print(f"[PromptFingerprints] table grown to {capacity} slots ({used} fingerprints)")
+
+    def _grow_in_background(self):
+        with self.lock:
+            if self.growing:
+                return
+            self.growing = True
+        threading.Thread(target=self._run_grow, name="pcn-fingerprints-grow", daemon=True).start()
+
+    def _run_grow(self):
+        try:
+            with open(self.lock_path, "a") as lf, locked(lf):
+                with self.lock:
+                    if not self._map():
+                        return
+                    used = self._used()
+                # another process may have grown it already
+                if used > self.capacity * GROW_AT:
+                    self._grow(used)
+        except Exception as e:
+            print(f"[PromptFingerprints] background grow failed: {e}")
+        finally:
+            with self.lock:
+                self.growing = False
+
+    # ---------- sync ----------
+    @staticmethod
+    def _pairs(lines):
+        for line in lines:
+            try:
+                e = json.loads(line)
+            except Exception:
+                continue
+            ts = int(parse_time(e.get("timestamp")) or 0)
+            if e.get("final_prompt"):
+                yield final_key(e["final_prompt"]), ts
+            if e.get("seed_fp"):
+                try:
+                    yield int(e["seed_fp"], 16), ts
+                except ValueError:
+                    continue
+
+    def _read_state(self):
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def sync(self, blocking=True):
+        """
+        Adds what the log got since the last sync (any process may have synced
+        meanwhile). blocking=False skips it when another sync or a grow holds
+        the table: the lookups then see it as it is.
+        """
+        t0 = time.perf_counter()
+        history_writer.flush()
+        os.makedirs(os.path.dirname(self.stem), exist_ok=True)
+        lines = 0
+        with open(self.lock_path, "a") as lf, locked(lf, blocking) as held:
+            if not held:
+                self.count("sync_skipped")
+                return 0
+            with self.lock:
+                self._map(create=True)
+                cursor = self._read_state()
+                for new in self.log.new_lines(cursor):
+                    self._add_many(self._pairs(new))
+                    lines += len(new)
+                self.map.flush()
+                replace_text(self.state_path, json.dumps(cursor))
+                self._sweep()
+                self.counters["synced_lines"] += lines
+                self.counters["sync_ms_total"] += (time.perf_counter() - t0) * 1000.0
+                due = self._used() > self.capacity * GROW_AT
+        if due:
+            self._grow_in_background()
+        return lines
+
+    # ---------- runs ----------
+    def seen(self, key):
+        """Unix time of the newest logged run with this fingerprint, or None."""
+        with self.lock:
+            self.counters["lookups"] += 1
+            if not self._map():
+                return None
+            return self._get(key)
+
+    def seen_seed(self, key):
+        ts = self.seen(key)
+        if ts is not None:
+            self.count("seed_hits")
+        return ts
+
+    def seen_final(self, key):
+        ts = self.seen(key)
+        if ts is not None:
+            self.count("final_hits")
+        return ts
+
+    def add(self, keys, when=None):
+        """
+        Records a run right away, before its log line is written. Skipped when
+        the table is busy (sync, grow) or full: the next sync reads the run
+        from the log anyway.
+        """
+        when = int(when or time.time())
+        os.makedirs(os.path.dirname(self.stem), exist_ok=True)
+        with open(self.lock_path, "a") as lf, locked(lf, blocking=False) as held:
+            with self.lock:
+                added = self._add_many(((k, when) for k in keys if k), grow=False) if held and self._map(create=True) else None
+                if added is None:
+                    self.counters["add_skipped"] += 1
+                else:
+                    self.counters["added"] += added
+
+    def logged_entry(self, key, ts):
+        """The newest log entry of the run with this seed fingerprint at this time (None if gone)."""
+        history_writer.flush()
+        stamp = datetime.fromtimestamp(ts).isoformat(timespec="seconds")
+        needle = key_hex(key)
+        for path in self.log.files(newest_first=True, since=stamp, until=stamp):
+            if not os.path.exists(path):
+                continue
+            found = None
+            try:
+                for line in iter_lines(path):
+                    if needle not in line:
+                        continue
+                    try:
+                        e = json.loads(line)
+                    except Exception:
+                        continue
+                    if e.get("seed_fp") == needle:
+                        found = e
+            except Exception as e:
+                print(f"[PromptFingerprints] {os.path.basename(path)} skipped: {e}")
+            if found is not None:
+                return found
+        return None
+
+    def snapshot(self):
+        with self.lock:
+            out = dict(self.counters)
+            out["sync_ms_total"] = round(out["sync_ms_total"], 1)
+            if self._map():
+                out["generation"] = self.gen
+                out["capacity"] = self.capacity
+                out["fingerprints"] = self._used()
+                out["bytes"] = len(self.map)
+        return out
+
+
+prompt_fingerprints = PromptFingerprints()
+register_snapshot("prompt_fingerprints", prompt_fingerprints.snapshot, costly=True)
@@ -0,0 +1,293 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+
+try:
+    from .history_segments import history_log
+    from .enhancer_telemetry import register_snapshot
+except ImportError:
+    from history_segments import history_log
+    from enhancer_telemetry import register_snapshot
+
+
+# =========================
+# 🔎 INDEXED PROMPT HISTORY
+# =========================
+# Prompt Replay used to parse the whole history log on every refresh and
+# filter it line by line in Python. logs/history_index.db (SQLite, WAL) is a
+# copy of the log with indexes on timestamp, world, source and system prompt,
+# and an FTS5 trigram index over final_prompt and the LoRA triggers, so the
+# filters (all substring filters) are indexed queries.
+# The JSONL stays the source of truth: before each query the index reads the
+# lines appended since its last sync and the segments rotated since then
+# (history_log.new_lines).
+# PCN_HISTORY_INDEX=0 turns it off (Prompt Replay then scans the segments).
+
+ENABLED = os.environ.get("PCN_HISTORY_INDEX", "auto").strip().lower() not in ("0", "off", "no", "false")
+MIN_FTS_CHARS = 3    # trigram tokens: shorter terms fall back to LIKE
+SCHEMA_VERSION = 3   # PRAGMA user_version; an index of another version is rebuilt from the log
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    id            INTEGER PRIMARY KEY,
+    ts            TEXT,
+    world         TEXT,
+    source        TEXT,
+    system_prompt TEXT,
+    lora_triggers TEXT,               -- lowercase, comma-joined
+    final_prompt  TEXT,
+    entry_id      TEXT,               -- entry_id(entry): what Prompt Replay picks by
+    data          TEXT NOT NULL       -- the JSONL line
+);
+CREATE INDEX IF NOT EXISTS entries_ts ON entries (ts);
+CREATE INDEX IF NOT EXISTS entries_entry_id ON entries (entry_id);
+CREATE INDEX IF NOT EXISTS entries_world ON entries (world, ts);
+CREATE INDEX IF NOT EXISTS entries_source ON entries (source, ts);
+CREATE INDEX IF NOT EXISTS entries_system ON entries (system_prompt, ts);
+CREATE VIRTUAL TABLE IF NOT EXISTS entries_fts USING fts5(
+    final_prompt, lora_triggers, content='entries', content_rowid='id', tokenize='trigram'
+);
+CREATE TABLE IF NOT EXISTS filter_values (
+    field TEXT NOT NULL,              -- world / system_prompt
+    value TEXT NOT NULL,              -- every distinct value the entries have
+    PRIMARY KEY (field, value)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS state (
+    key   TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+def entry_id(e):
+    """Stable id of a log entry: hash of its content (same in every segment, index or filter)."""
+    raw = json.dumps(e, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.blake2b(raw, digest_size=8).hexdigest()
+
+
+def _triggers(value):
+    if isinstance(value, list):
+        items = [str(x).strip() for x in value]
+    else:
+        items = [x.strip() for x in str(value or "").split(",")]
+    return ",".join(x for x in items if x).lower()
+
+
+def _fts_term(column, text):
+    return column + ' : "' + text.replace('"', '""') + '"'
+
+
+class HistoryIndex:
+
+    def __init__(self, path=None, log=None):
+        self.log = log or history_log
+        self.path = path or os.path.join(os.path.dirname(self.log.path), "history_index.db")
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.ready = False
+        self.broken = None
+        self.synced_version = None   # history_log.version() at this process's last sync
+        self.counters = {
+            "synced_lines": 0, "segments_synced": 0, "queries": 0, "lookups": 0,
+            "query_ms_total": 0.0, "sync_ms_total": 0.0,
+        }
+
+    def available(self):
+        if not ENABLED or self.broken:
+            return False
+        try:
+            self._db()
+            return True
+        except sqlite3.Error as e:
+            # e.g. a SQLite build without FTS5 / trigram
+            self.broken = str(e)
+            print(f"[HistoryIndex] disabled: {e}")
+            return False
+
+    def _db(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            with self.lock:
+                if not self.ready:
+                    self._create(conn)
+                    self.ready = True
+            self.local.conn = conn
+        return conn
+
+    @staticmethod
+    def _create(conn):
+        """Creates the tables; an index of another SCHEMA_VERSION is dropped, the next sync rebuilds it."""
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version == SCHEMA_VERSION:
+                return
+            if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'entries'").fetchone():
+                print(f"[HistoryIndex] index version {version} -> {SCHEMA_VERSION}, rebuilding from the history log")
+                for table in ("entries_fts", "entries", "filter_values", "state"):
+                    conn.execute(f"DROP TABLE IF EXISTS {table}")
+            for statement in SCHEMA.split(";"):
+                if statement.strip():
+                    conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def count(self, key, amount=1):
+        with self.lock:
+            self.counters[key] += amount
+
+    # ---------- sync ----------
+    def _state(self, db, key, default):
+        row = db.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def _set_state(self, db, key, value):
+        db.execute("INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+
+    @staticmethod
+    def _insert(db, lines):
+        rows = []
+        for line in lines:
+            try:
+                e = json.loads(line)
+            except Exception:
+                continue
+            rows.append((
+                e.get("timestamp"), e.get("json_world"), e.get("source"), e.get("system_prompt"),
+                _triggers(e.get("lora_triggers")), e.get("final_prompt") or "", entry_id(e), line,
+            ))
+        if not rows:
+            return 0
+        last = db.execute("SELECT COALESCE(MAX(id), 0) FROM entries").fetchone()[0]
+        db.executemany(
+            "INSERT INTO entries (ts, world, source, system_prompt, lora_triggers, final_prompt, entry_id, data) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+        # FTS rows in one statement: ~4x faster than a per-row trigger on a first build
+        db.execute(
+            "INSERT INTO entries_fts (rowid, final_prompt, lora_triggers) SELECT id, final_prompt, lora_triggers FROM entries WHERE id > ?",
+            (last,),
+        )
+        # the values the world / system substring filters are matched against
+        for field in ("world", "system_prompt"):
+            db.execute(
+                f"INSERT OR IGNORE INTO filter_values (field, value) "
+                f"SELECT DISTINCT '{field}', {field} FROM entries WHERE id > ? AND {field} IS NOT NULL",
+                (last,),
+            )
+        return len(rows)
+
+    def sync(self):
+        """Reads what the log got since the last sync (any process may have synced meanwhile)."""
+        t0 = time.perf_counter()
+        # unchanged since this process last synced: nothing to read
+        version = self.log.version()
+        if version == self.synced_version:
+            return 0
+        db = self._db()
+        added = 0
+        with db:
+            db.execute("BEGIN IMMEDIATE")
+            cursor = {"segments": self._state(db, "segments", []), "active": self._state(db, "active", None)}
+            read = len(cursor["segments"])
+            for lines in self.log.new_lines(cursor):
+                added += self._insert(db, lines)
+            self.count("segments_synced", len(cursor["segments"]) - read)
+            self._set_state(db, "segments", cursor["segments"])
+            self._set_state(db, "active", cursor["active"])
+        with self.lock:
+            self.synced_version = version
+            self.counters["synced_lines"] += added
+            self.counters["sync_ms_total"] += (time.perf_counter() - t0) * 1000.0
+        return added
+
+    # ---------- queries ----------
+    def find(self, entry_id):
+        """The entry with this id (see entry_id), wherever it is in the history; None if gone."""
+        self.sync()
+        row = self._db().execute(
+            "SELECT data FROM entries WHERE entry_id = ? ORDER BY id DESC LIMIT 1", (entry_id,)
+        ).fetchone()
+        self.count("lookups")
+        if row is None:
+            return None
+        try:
+            return json.loads(row[0])
+        except Exception:
+            return None
+
+    def _matching(self, db, column, needle):
+        """Values of world / system_prompt containing needle (from filter_values: one row per value)."""
+        needle = needle.lower()
+        rows = db.execute("SELECT value FROM filter_values WHERE field = ?", (column,))
+        return [v for (v,) in rows if needle in v.lower()]
+
+    def query(self, limit, source="all", world="", system="", lora="", text="", offset=0):
+        """Newest `limit` entries matching the Prompt Replay filters (skipping the `offset` newest), oldest first."""
+        self.sync()
+        t0 = time.perf_counter()
+        db = self._db()
+        where, params = [], []
+        if source and source != "all":
+            where.append("source = ?")
+            params.append(source)
+        for column, needle in (("world", world), ("system_prompt", system)):
+            if needle:
+                values = self._matching(db, column, needle)
+                if not values:
+                    return []
+                where.append(f"{column} IN ({','.join('?' * len(values))})")
+                params.extend(values)
+        terms = []
+        for column, needle in (("lora_triggers", lora.lower()), ("final_prompt", text)):
+            if not needle:
+                continue
+            if len(needle) >= MIN_FTS_CHARS:
+                terms.append(_fts_term(column, needle))
+            else:
+                where.append(f"instr(lower({column}), ?) > 0")
+                params.append(needle.lower())
+        if terms:
+            where.append("id IN (SELECT rowid FROM entries_fts WHERE entries_fts MATCH ?)")
+            params.append(" AND ".join(terms))
+        sql = "SELECT data FROM entries"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY ts DESC, id DESC LIMIT ? OFFSET ?"
+        params.extend((int(limit), int(offset)))
+        out = []
+        for (data,) in db.execute(sql, params):
+            try:
+                out.append(json.loads(data))
+            except Exception:
+                continue
+        with self.lock:
+            self.counters["queries"] += 1
+            self.counters["query_ms_total"] += (time.perf_counter() - t0) * 1000.0
+        return out[::-1]
+
+    def snapshot(self):
+        with self.lock:
+            out = dict(self.counters)
+        out["query_ms_total"] = round(out["query_ms_total"], 1)
+        out["sync_ms_total"] = round(out["sync_ms_total"], 1)
+        out["enabled"] = ENABLED and not self.broken
+        if self.broken:
+            out["error"] = self.broken
+        elif ENABLED and os.path.exists(self.path):
+            try:
+                out["rows"] = self._db().execute("SELECT MAX(id) FROM entries").fetchone()[0] or 0
+            except sqlite3.Error as e:
+                out["error"] = str(e)
+        return out
+
+
+history_index = HistoryIndex()
+register_snapshot("history_index", history_index.snapshot, costly=True)
@@ -0,0 +1,60 @@
+import asyncio
+
+try:
+    from server import PromptServer
+    from aiohttp import web
+except ImportError:   # outside ComfyUI
+    PromptServer = None
+
+try:
+    from .PromptReplayNode import PromptReplayNode
+except ImportError:
+    from PromptReplayNode import PromptReplayNode
+
+
+# =========================
+# 🌐 HISTORY ROUTE
+# =========================
+# GET /prompt_creator/history?world=&source=&lora=&system=&text=&offset=&limit=
+# One page of history entries, newest first:
+#   {"entries": [{"id", "label", "preview"}], "offset": n, "has_more": bool}
+# The Prompt Replay widget (web/extensions/PromptCreatorNode/promptreplay.js)
+# queries it as the user types and stores only the picked entry id.
+
+ROUTE = "/prompt_creator/history"
+MAX_LIMIT = 100
+
+
+def _int(value, default, lo, hi):
+    try:
+        return max(lo, min(hi, int(value)))
+    except (TypeError, ValueError):
+        return default
+
+
+def register():
+    if PromptServer is None or getattr(PromptServer, "instance", None) is None:
+        return False
+
+    @PromptServer.instance.routes.get(ROUTE)
+    async def history(request):
+        q = request.rel_url.query
+        kwargs = {
+            "offset": _int(q.get("offset"), 0, 0, 10 ** 9),
+            "limit": _int(q.get("limit"), 20, 1, MAX_LIMIT),
+            "source_filter": q.get("source", "all") or "all",
+            "json_filter": q.get("world", ""),
+            "lora_filter": q.get("lora", ""),
+            "system_filter": q.get("system", ""),
+            "text_filter": q.get("text", ""),
+        }
+        loop = asyncio.get_running_loop()
+        try:
+            # file / SQLite reads: off the event loop
+            page = await loop.run_in_executor(None, lambda: PromptReplayNode.search(**kwargs))
+        except Exception as e:
+            print(f"[PromptReplay] history route failed: {e}")
+            return web.json_response({"error": str(e)}, status=500)
+        return web.json_response(page)
+
+    return True
@@ -0,0 +1,512 @@
+import io
+import os
+import gzip
+import hashlib
+import json
+import time
+import threading
+from datetime import datetime
+
+try:
+    import zstandard
+except ImportError:   # optional: gzip then
+    zstandard = None
+
+try:
+    from .history_writer import history_writer, replace_text, locked
+    from .enhancer_telemetry import register_snapshot
+except ImportError:
+    from history_writer import history_writer, replace_text, locked
+    from enhancer_telemetry import register_snapshot
+
+
+# =========================
+# 🗃️ SEGMENTED PROMPT HISTORY
+# =========================
+# logs/prompt_history.jsonl is the active segment. Once it is bigger than
+# PCN_HISTORY_SEGMENT_MB or its first entry is older than
+# PCN_HISTORY_SEGMENT_DAYS, it is moved to logs/history/ and compressed
+# (zstd when `zstandard` is installed, else gzip). logs/history/manifest.json
+# records each segment's time range, entry count and per-world / per-source
+# counts, so readers only open the segments that can hold what they look for.
+
+SEGMENT_MB = float(os.environ.get("PCN_HISTORY_SEGMENT_MB", "16") or 16)
+SEGMENT_DAYS = float(os.environ.get("PCN_HISTORY_SEGMENT_DAYS", "30") or 30)
+CODEC = "zstd" if zstandard is not None else "gzip"
+SUFFIXES = {"zstd": ".jsonl.zst", "gzip": ".jsonl.gz", "none": ".jsonl"}
+TAIL_KEEP = 2000          # parsed entries of the active segment kept in memory
+BLOCK = 1 << 16
+
+
+def parse_time(ts):
+    try:
+        return datetime.fromisoformat(str(ts)).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def open_segment(path):
+    """Text stream over a segment, whatever its compression."""
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise RuntimeError("zstandard is not installed")
+        raw = open(path, "rb")
+        return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(raw, closefd=True), encoding="utf-8")
+    return open(path, "r", encoding="utf-8")
+
+
+def iter_lines(path):
+    with open_segment(path) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield line
+
+
+def file_identity(f):
+    """
+    (inode, hash of the first line) of a non-empty file (path or binary file
+    object), else None: survives renames, not rewrites.
+    """
+    if isinstance(f, str):
+        try:
+            with open(f, "rb") as fh:
+                return file_identity(fh)
+        except OSError:
+            return None
+    f.seek(0)
+    head = f.readline()
+    if not head.endswith(b"\n"):
+        return None
+    return [os.fstat(f.fileno()).st_ino, hashlib.blake2b(head, digest_size=8).hexdigest()]
+
+
+def reverse_lines(f, end, block=BLOCK):
+    """
+    (offset, line) of a binary file's complete lines before `end`, newest
+    first, reading blocks backwards from there (end must be a line start).
+    """
+    pos = end
+    rest = b""
+    first = True
+    while pos > 0:
+        size = min(block, pos)
+        pos -= size
+        f.seek(pos)
+        buf = f.read(size) + rest
+        pieces = buf.split(b"\n")
+        if first:
+            pieces.pop()       # after the last newline: empty
+            first = False
+        rest = pieces[0]
+        at = pos + len(buf)
+        for piece in reversed(pieces[1:]):
+            at -= len(piece) + 1
+            line = piece.strip()
+            if line:
+                yield at + 1, line.decode("utf-8", "replace")
+    if rest.strip():
+        yield 0, rest.strip().decode("utf-8", "replace")
+
+
+def segment_stats(path):
+    """Manifest record of a segment file (one pass over it)."""
+    first = last = None
+    entries = 0
+    worlds, sources = {}, {}
+    for line in iter_lines(path):
+        try:
+            data = json.loads(line)
+        except Exception:
+            continue
+        entries += 1
+        ts = data.get("timestamp")
+        if ts:
+            first = ts if first is None or ts < first else first
+            last = ts if last is None or ts > last else last
+        world = str(data.get("json_world", ""))
+        worlds[world] = worlds.get(world, 0) + 1
+        source = str(data.get("source", ""))
+        sources[source] = sources.get(source, 0) + 1
+    return {"first": first, "last": last, "entries": entries, "worlds": worlds, "sources": sources}
+
+
+def compress(src, codec):
+    """Writes src compressed next to it, returns the new path (src is left alone)."""
+    if codec == "none":
+        return src
+    base = src[:-len(".jsonl")] if src.endswith(".jsonl") else src
+    dst = base + SUFFIXES[codec]
+    tmp = dst + ".tmp"
+    with open(src, "rb") as fin:
+        if codec == "zstd":
+            with open(tmp, "wb") as fout:
+                zstandard.ZstdCompressor(level=10).copy_stream(fin, fout)
+        else:
+            with gzip.open(tmp, "wb", compresslevel=6) as fout:
+                while True:
+                    block = fin.read(1 << 20)
+                    if not block:
+                        break
+                    fout.write(block)
+    os.replace(tmp, dst)
+    return dst
+
+
+class HistoryLog:
+
+    def __init__(self, base_path=None):
+        base_path = base_path or os.path.dirname(__file__)
+        self.path = os.path.join(base_path, "logs", "prompt_history.jsonl")
+        self.dir = os.path.join(base_path, "logs", "history")
+        self.manifest_path = os.path.join(self.dir, "manifest.json")
+        self.lock = threading.Lock()
+        self.manifest = None
+        self.manifest_mtime = None
+        self.counters = {
+            "rotations": 0, "rotate_deferred": 0, "segments_read": 0, "segments_skipped": 0, "rotate_errors": 0,
+            "tail_parsed": 0, "tail_resets": 0, "tail_served": 0, "reverse_read": 0,
+        }
+        # parsed tail of the active segment: [(offset, entry)], oldest first
+        self.tail = []
+        self.tail_origin = None
+        self.tail_end = 0         # bytes of the active file parsed so far
+        history_writer.on_append(self.path, self._rotate_if_due)
+
+    # ---------- writing ----------
+    def append(self, entry):
+        history_writer.append_jsonl(self.path, entry)
+
+    def _active_first_ts(self):
+        # one short read per batch: cheaper than tracking inodes that get reused
+        with open(self.path, "r", encoding="utf-8") as f:
+            line = f.readline()
+        try:
+            return parse_time(json.loads(line).get("timestamp"))
+        except Exception:
+            return None
+
+    def _due(self, size):
+        if size >= SEGMENT_MB * 1024 * 1024:
+            return True
+        if SEGMENT_DAYS > 0:
+            first = self._active_first_ts()
+            return first is not None and time.time() - first >= SEGMENT_DAYS * 86400
+        return False
+
+    def _rotate_if_due(self, path, size):
+        """Runs after each appended batch, once the active file is closed again."""
+        try:
+            if size and self._due(size):
+                self.rotate(if_due=True)
+        except Exception as e:
+            self.count("rotate_errors")
+            print(f"[HistoryLog] rotation failed: {e}")
+
+    def rotate(self, codec=CODEC, if_due=False):
+        """Moves the active segment into logs/history/, compressed, and records it."""
+        os.makedirs(self.dir, exist_ok=True)
+        # processes appending to a newer active file may rotate at the same time
+        with open(os.path.join(self.dir, ".rotate.lock"), "a") as lf, locked(lf):
+            if if_due:
+                # another process may have rotated while we waited for the lock
+                try:
+                    size = os.path.getsize(self.path)
+                except OSError:
+                    return None
+                if not size or not self._due(size):
+                    return None
+            return self._rotate(codec)
+
+    def _rotate(self, codec):
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            return None
+        stamp = datetime.now().strftime("%Y%m%dT%H%M%S")
+        n = 0
+        while True:
+            name = f"prompt_history.{stamp}-{n}"
+            if not any(os.path.exists(os.path.join(self.dir, name + sfx)) for sfx in SUFFIXES.values()):
+                break
+            n += 1
+        raw = os.path.join(self.dir, name + ".jsonl")
+        origin = file_identity(self.path)
+        try:
+            os.replace(self.path, raw)
+        except PermissionError:
+            # Windows: another process has the file open; the next batch retries
+            self.count("rotate_deferred")
+            return None
+        # an appender holding the lock when we renamed is still writing into
+        # raw: wait for it (later ones see the file moved and reopen the path)
+        with open(raw, "a") as rf, locked(rf):
+            pass
+        stats = segment_stats(raw)
+        seg = compress(raw, codec)
+        if seg != raw:
+            os.remove(raw)
+        record = dict(stats, file=os.path.basename(seg), codec=codec, bytes=os.path.getsize(seg), origin=origin)
+        with self.lock:
+            manifest = self._read_manifest()
+            manifest["segments"].append(record)
+            manifest["segments"].sort(key=lambda r: (r.get("first") or "", r["file"]))
+            replace_text(self.manifest_path, json.dumps(manifest, indent=1, ensure_ascii=False))
+            self.manifest = manifest
+            self.manifest_mtime = os.path.getmtime(self.manifest_path)
+            self.counters["rotations"] += 1
+        print(f"[HistoryLog] rotated {stats['entries']} entries into {record['file']}")
+        return record
+
+    # ---------- reading ----------
+    def _read_manifest(self):
+        """Manifest as on disk (re-read when another process changed it). Call with self.lock held."""
+        try:
+            mtime = os.path.getmtime(self.manifest_path)
+        except OSError:
+            return {"segments": []}
+        if self.manifest is None or mtime != self.manifest_mtime:
+            try:
+                with open(self.manifest_path, "r", encoding="utf-8") as f:
+                    self.manifest = json.load(f)
+                self.manifest.setdefault("segments", [])
+            except Exception as e:
+                print(f"[HistoryLog] {self.manifest_path} unreadable: {e}")
+                self.manifest = {"segments": []}
+            self.manifest_mtime = mtime
+        return self.manifest
+
+    def segments(self):
+        """Manifest records of the rotated segments, oldest first (paths included)."""
+        with self.lock:
+            records = [dict(r) for r in self._read_manifest()["segments"]]
+        for r in records:
+            r["path"] = os.path.join(self.dir, r["file"])
+        return records
+
+    @staticmethod
+    def may_match(record, world=None, source=None, since=None, until=None):
+        """False when the manifest says this segment holds nothing of interest."""
+        if world:
+            w = world.lower()
+            if not any(w in name.lower() for name in record.get("worlds", {})):
+                return False
+        if source and source != "all" and source not in record.get("sources", {}):
+            return False
+        if since and record.get("last") and record["last"] < since:
+            return False
+        if until and record.get("first") and record["first"] > until:
+            return False
+        return True
+
+    def files(self, newest_first=False, **filters):
+        """Paths to read, rotated segments the manifest rules out left aside; the active one last."""
+        out = []
+        for r in self.segments():
+            if self.may_match(r, **filters):
+                out.append(r["path"])
+            else:
+                self.count("segments_skipped")
+        out.append(self.path)
+        return out[::-1] if newest_first else out
+
+    def iter_lines(self, newest_first=False, **filters):
+        """Raw JSONL lines of every relevant segment (segment order, lines in file order)."""
+        history_writer.flush()
+        for path in self.files(newest_first=newest_first, **filters):
+            if not os.path.exists(path):
+                continue
+            if path != self.path:
+                self.count("segments_read")
+            try:
+                yield from iter_lines(path)
+            except Exception as e:
+                print(f"[HistoryLog] {os.path.basename(path)} skipped: {e}")
+
+    def new_lines(self, cursor):
+        """
+        Lines the log got since `cursor`, one list per rotated segment / the
+        active file, oldest first: for readers that keep a copy up to date
+        (history_index, history_fingerprints, history_export).
+        cursor is {"segments": [files read], "active": {"origin", "offset",
+        "lines"}} as the previous call left it ({} the first time); it is
+        updated once the generator is exhausted, store it after that.
+        A rotated segment records the identity of the active file it came from
+        (file_identity), so lines already read there are not read twice.
+        """
+        done = set(cursor.get("segments") or [])
+        active = cursor.get("active")
+
+        for rec in self.segments():
+            if rec["file"] in done:
+                continue
+            skip = 0
+            if active and rec.get("origin") == active["origin"]:
+                # the file we were reading: only its lines past our offset are new
+                skip, active = active["lines"], None
+            lines = iter_lines(rec["path"])
+            for _ in range(skip):
+                next(lines, None)
+            yield list(lines)
+            done.add(rec["file"])
+
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            f = None
+        origin = file_identity(f) if f is not None else None
+        if origin is None:
+            active = None
+            if f is not None:
+                f.close()
+        else:
+            with f:
+                if not active or active["origin"] != origin:
+                    active = {"origin": origin, "offset": 0, "lines": 0}
+                f.seek(active["offset"])
+                chunk = f.read()
+            end = chunk.rfind(b"\n") + 1          # a line being written is left for next time
+            lines = [l.strip() for l in chunk[:end].decode("utf-8", "replace").split("\n")]
+            lines = [l for l in lines if l]
+            if lines:
+                yield lines
+            active = dict(active, offset=active["offset"] + end, lines=active["lines"] + len(lines))
+
+        cursor["segments"] = sorted(done)
+        cursor["active"] = active
+
+    def _refresh_tail(self):
+        """
+        Brings the parsed tail up to date: only lines appended since the last
+        call are parsed; a new active file (rotation) starts from its end.
+        Returns (origin, start offset of the tail). Call with self.lock held.
+        """
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            self.tail, self.tail_origin, self.tail_end = [], None, 0
+            return None, 0
+        with f:
+            origin = file_identity(f)
+            if origin is None:
+                self.tail, self.tail_origin, self.tail_end = [], None, 0
+                return None, 0
+            size = os.fstat(f.fileno()).st_size
+            if origin != self.tail_origin or size < self.tail_end:
+                # newest TAIL_KEEP lines, read backwards from the last full line
+                end = size
+                while end > 0:
+                    f.seek(max(0, end - BLOCK))
+                    chunk = f.read(end - max(0, end - BLOCK))
+                    nl = chunk.rfind(b"\n")
+                    if nl >= 0:
+                        end = end - len(chunk) + nl + 1
+                        break
+                    end -= len(chunk)
+                items = []
+                for offset, line in reverse_lines(f, end):
+                    try:
+                        items.append((offset, json.loads(line)))
+                    except Exception:
+                        continue
+                    if len(items) >= TAIL_KEEP:
+                        break
+                self.tail = items[::-1]
+                self.tail_origin, self.tail_end = origin, end
+                self.counters["tail_resets"] += 1
+                self.counters["tail_parsed"] += len(items)
+            else:
+                f.seek(self.tail_end)
+                chunk = f.read()
+                end = chunk.rfind(b"\n") + 1
+                at = self.tail_end
+                for piece in chunk[:end].split(b"\n"):
+                    line = piece.strip()
+                    if line:
+                        try:
+                            self.tail.append((at, json.loads(line)))
+                            self.counters["tail_parsed"] += 1
+                        except Exception:
+                            pass
+                    at += len(piece) + 1
+                self.tail_end += end
+                del self.tail[:-TAIL_KEEP]
+        start = self.tail[0][0] if self.tail else self.tail_end
+        return origin, start
+
+    def newest(self, **filters):
+        """
+        Entries newest first, read lazily: the cached tail of the active
+        segment, then the rest of it backwards block by block, then the rotated
+        segments the manifest can't rule out. Stop iterating once you have enough.
+        """
+        history_writer.flush()
+        with self.lock:
+            origin, start = self._refresh_tail()
+            tail = list(self.tail)
+            self.counters["tail_served"] += 1
+        for _, entry in reversed(tail):
+            yield entry
+
+        if origin is not None and start > 0:
+            try:
+                with open(self.path, "rb") as f:
+                    if file_identity(f) == origin:
+                        for _, line in reverse_lines(f, start):
+                            self.count("reverse_read")
+                            try:
+                                yield json.loads(line)
+                            except Exception:
+                                continue
+            except FileNotFoundError:
+                pass
+
+        for path in self.files(newest_first=True, **filters)[1:]:
+            if not os.path.exists(path):
+                continue
+            self.count("segments_read")
+            try:
+                # compressed: no seeking backwards, but segments are bounded
+                lines = list(iter_lines(path))
+            except Exception as e:
+                print(f"[HistoryLog] {os.path.basename(path)} skipped: {e}")
+                continue
+            for line in reversed(lines):
+                try:
+                    yield json.loads(line)
+                except Exception:
+                    continue
+
+    def version(self):
+        """Changes whenever the log does (append, rotation, any process): cache key for readers."""
+        try:
+            st = os.stat(self.path)
+            active = (st.st_ino, st.st_size, st.st_mtime_ns)
+        except OSError:
+            active = None
+        try:
+            manifest = os.stat(self.manifest_path).st_mtime_ns
+        except OSError:
+            manifest = None
+        return active, manifest
+
+    def exists(self):
+        return os.path.exists(self.path) or bool(self.segments())
+
+    def count(self, key, amount=1):
+        with self.lock:
+            self.counters[key] += amount
+
+    def snapshot(self):
+        segs = self.segments()
+        with self.lock:
+            out = dict(self.counters)
+        out["segments"] = len(segs)
+        out["segment_entries"] = sum(r.get("entries", 0) for r in segs)
+        out["segment_bytes"] = sum(r.get("bytes", 0) for r in segs)
+        out["active_bytes"] = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        return out
+
+
+history_log = HistoryLog()
+register_snapshot("history_segments", history_log.snapshot, costly=True)
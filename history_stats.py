@@ -0,0 +1,389 @@
+"""
+Prompt history analytics.
+
+Streams logs/prompt_history.jsonl and its rotated segments (logs/history/)
+through a process pool, in chunks, and writes a compact report:
+- entries per world, source, system prompt and enhancer backend
+- which world values (color realms, outfits, poses, ...) the prompts actually
+  used, matched back to the world JSON entries
+- duplicate rates of the final prompts (overall and per world, estimated with
+  HyperLogLog, so memory does not grow with the log)
+- per-day / per-hour histograms and enhancement time histograms
+
+Memory depends on the number of worlds / values / days, not on the log size.
+
+    python history_stats.py
+    python history_stats.py --out report.json --csv report_csv/ --workers 8
+    python history_stats.py --since 2026-09-01 --until 2026-10-01
+    python history_stats.py --base /path/to/PromptCreatorNode
+"""
+import os
+import re
+import sys
+import csv
+import json
+import math
+import time
+import hashlib
+import argparse
+from multiprocessing import Pool
+
+try:
+    from .history_segments import HistoryLog, iter_lines
+    from .generate_world_options import KEYS, normalize_key, normalize_list
+except ImportError:
+    from history_segments import HistoryLog, iter_lines
+    from generate_world_options import KEYS, normalize_key, normalize_list
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+CHUNK_BYTES = 8 << 20
+HLL_P = 14            # overall: 16384 registers, ~0.8% error
+HLL_P_WORLD = 10      # per world: 1024 registers, ~3% error
+ENHANCE_MS_BUCKETS = [250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000]
+TOP_VALUES = 25
+
+
+# ---------- HyperLogLog (mergeable distinct counts) ----------
+def _hash64(text):
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def hll_new(p):
+    return bytearray(1 << p)
+
+
+def hll_add(regs, p, h):
+    idx = h >> (64 - p)
+    rest = (h << p) & ((1 << 64) - 1)
+    rank = (64 - p + 1) if rest == 0 else (64 - rest.bit_length() + 1)
+    if rank > regs[idx]:
+        regs[idx] = rank
+
+
+def hll_merge(a, b):
+    for i, v in enumerate(b):
+        if v > a[i]:
+            a[i] = v
+
+
+def hll_count(regs):
+    m = len(regs)
+    alpha = 0.7213 / (1 + 1.079 / m)
+    est = alpha * m * m / sum(2.0 ** -v for v in regs)
+    zeros = regs.count(0)
+    if est <= 2.5 * m and zeros:
+        est = m * math.log(m / zeros)   # small range correction
+    return int(round(est))
+
+
+# ---------- world values ----------
+_WORLDS = {}
+_JSON_DIR = None
+MIN_VALUE_LEN = 3   # shorter values ("d", "x") match inside any prompt and only add noise
+
+
+def _init_worker(json_dir):
+    global _JSON_DIR
+    _JSON_DIR = json_dir
+
+
+def _world_matcher(world):
+    """(compiled alternation of the world's values, lowercase value -> [(key, value)]) or None."""
+    if world in _WORLDS:
+        return _WORLDS[world]
+    matcher = None
+    path = os.path.join(_JSON_DIR or "", os.path.basename(str(world)))
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        values = {}
+        pairs = [("COLOR_REALM", v) for v in normalize_list(data.get("COLOR_REALM"))]
+        for key in KEYS:
+            if key != "COLOR_REALM":
+                pairs += [(key, v) for v in normalize_key(data, key)["__all__"]]
+        for key, v in pairs:
+            if len(v.strip()) >= MIN_VALUE_LEN:
+                values.setdefault(v.lower(), []).append((key, v))
+        if values:
+            # longest first, so "red silk dress" wins over "red silk"; whole words only,
+            # so "red" does not count inside "hundred"
+            alternation = "|".join(re.escape(v) for v in sorted(values, key=len, reverse=True))
+            matcher = (re.compile(r"(?<!\w)(?:" + alternation + r")(?!\w)"), values)
+    except Exception:
+        matcher = None
+    _WORLDS[world] = matcher
+    return matcher
+
+
+# ---------- partial aggregates ----------
+def _new_partial():
+    return {
+        "entries": 0, "bad_lines": 0,
+        "worlds": {}, "sources": {}, "system_prompts": {}, "enhancers": {},
+        "values": {},         # world -> key -> value -> count
+        "matched": {},        # world -> entries with at least one value matched
+        "days": {}, "hours": [0] * 24,
+        "enhance_ms": {"count": 0, "total": 0.0, "max": 0.0, "buckets": [0] * (len(ENHANCE_MS_BUCKETS) + 1)},
+        "hll": hll_new(HLL_P), "hll_world": {},
+        "first": None, "last": None,
+    }
+
+
+def _bump(d, key, amount=1):
+    d[key] = d.get(key, 0) + amount
+
+
+def _account(part, e):
+    world = str(e.get("json_world") or "unknown")
+    part["entries"] += 1
+    _bump(part["worlds"], world)
+    _bump(part["sources"], str(e.get("source") or "unknown"))
+    _bump(part["system_prompts"], str(e.get("system_prompt") or "unknown"))
+    _bump(part["enhancers"], str(e.get("use_enhancer") or "none"))
+
+    ts = str(e.get("timestamp") or "")
+    if len(ts) >= 13:
+        _bump(part["days"], ts[:10])
+        try:
+            part["hours"][int(ts[11:13])] += 1
+        except ValueError:
+            pass
+        part["first"] = ts if part["first"] is None or ts < part["first"] else part["first"]
+        part["last"] = ts if part["last"] is None or ts > part["last"] else part["last"]
+
+    ms = e.get("enhance_ms")
+    if isinstance(ms, (int, float)):
+        em = part["enhance_ms"]
+        em["count"] += 1
+        em["total"] += ms
+        em["max"] = max(em["max"], ms)
+        i = 0
+        while i < len(ENHANCE_MS_BUCKETS) and ms >= ENHANCE_MS_BUCKETS[i]:
+            i += 1
+        em["buckets"][i] += 1
+
+    prompt = " ".join(str(e.get("final_prompt") or "").lower().split())
+    h = _hash64(prompt)
+    hll_add(part["hll"], HLL_P, h)
+    regs = part["hll_world"].get(world)
+    if regs is None:
+        regs = part["hll_world"][world] = hll_new(HLL_P_WORLD)
+    hll_add(regs, HLL_P_WORLD, h)
+
+    matcher = _world_matcher(world)
+    if matcher is not None:
+        pattern, values = matcher
+        seen = set(m.group(0) for m in pattern.finditer(prompt))
+        if seen:
+            _bump(part["matched"], world)
+            per_world = part["values"].setdefault(world, {})
+            for text in seen:
+                for key, value in values[text]:
+                    _bump(per_world.setdefault(key, {}), value)
+
+
+def _in_range(e, since, until):
+    ts = str(e.get("timestamp") or "")
+    return (not since or ts >= since) and (not until or ts < until)
+
+
+def _lines_of(task):
+    """Lines of one task: a whole (compressed) segment, or a byte range of a plain file."""
+    path, start, end = task
+    if start is None:
+        yield from iter_lines(path)
+        return
+    with open(path, "rb") as f:
+        if start:
+            # lines belong to the chunk they start in: skip the one started before
+            f.seek(start - 1)
+            f.readline()
+        while f.tell() <= end:
+            raw = f.readline()
+            if not raw:
+                break
+            line = raw.strip()
+            if line:
+                yield line.decode("utf-8", "replace")
+
+
+def scan_task(args):
+    task, since, until = args
+    part = _new_partial()
+    for line in _lines_of(task):
+        try:
+            e = json.loads(line)
+        except Exception:
+            part["bad_lines"] += 1
+            continue
+        if _in_range(e, since, until):
+            _account(part, e)
+    return part
+
+
+def merge(total, part):
+    total["entries"] += part["entries"]
+    total["bad_lines"] += part["bad_lines"]
+    for key in ("worlds", "sources", "system_prompts", "enhancers", "matched", "days"):
+        for k, v in part[key].items():
+            _bump(total[key], k, v)
+    for world, keys in part["values"].items():
+        tw = total["values"].setdefault(world, {})
+        for key, values in keys.items():
+            tk = tw.setdefault(key, {})
+            for value, n in values.items():
+                _bump(tk, value, n)
+    total["hours"] = [a + b for a, b in zip(total["hours"], part["hours"])]
+    te, pe = total["enhance_ms"], part["enhance_ms"]
+    te["count"] += pe["count"]
+    te["total"] += pe["total"]
+    te["max"] = max(te["max"], pe["max"])
+    te["buckets"] = [a + b for a, b in zip(te["buckets"], pe["buckets"])]
+    hll_merge(total["hll"], part["hll"])
+    for world, regs in part["hll_world"].items():
+        if world in total["hll_world"]:
+            hll_merge(total["hll_world"][world], regs)
+        else:
+            total["hll_world"][world] = regs
+    for key, pick in (("first", min), ("last", max)):
+        vals = [v for v in (total[key], part[key]) if v]
+        total[key] = pick(vals) if vals else None
+    return total
+
+
+# ---------- planning ----------
+def plan_tasks(log, since=None, until=None, chunk_bytes=CHUNK_BYTES):
+    """[(path, start, end)]: compressed segments whole, plain files in byte ranges."""
+    tasks = []
+    for rec in log.segments():
+        if not log.may_match(rec, since=since, until=until):
+            continue
+        tasks.append((rec["path"], None, None))
+    for path in [log.path]:
+        if not os.path.exists(path):
+            continue
+        size = os.path.getsize(path)
+        for start in range(0, size, chunk_bytes):
+            tasks.append((path, start, min(size, start + chunk_bytes) - 1))
+    return tasks
+
+
+def build_report(total, seconds, tasks):
+    def ranked(d, limit=None):
+        items = sorted(d.items(), key=lambda kv: (-kv[1], kv[0]))
+        return dict(items[:limit] if limit else items)
+
+    n = total["entries"]
+    distinct = min(n, hll_count(total["hll"])) if n else 0
+    worlds = {}
+    for world, count in ranked(total["worlds"]).items():
+        regs = total["hll_world"].get(world)
+        w_distinct = min(count, hll_count(regs)) if regs else count
+        worlds[world] = {
+            "entries": count,
+            "distinct_prompts": w_distinct,
+            "duplicate_rate": round(1 - w_distinct / count, 4) if count else 0.0,
+            "matched_entries": total["matched"].get(world, 0),
+            "values": {key: ranked(vals, TOP_VALUES) for key, vals in sorted(total["values"].get(world, {}).items())},
+        }
+    em = total["enhance_ms"]
+    labels = [f"<{ENHANCE_MS_BUCKETS[0]}"] + [
+        f"{lo}-{hi}" for lo, hi in zip(ENHANCE_MS_BUCKETS, ENHANCE_MS_BUCKETS[1:])
+    ] + [f">={ENHANCE_MS_BUCKETS[-1]}"]
+    return {
+        "generated": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "scan": {"seconds": round(seconds, 2), "tasks": len(tasks), "bad_lines": total["bad_lines"]},
+        "entries": n,
+        "first": total["first"],
+        "last": total["last"],
+        "distinct_prompts": distinct,
+        "duplicate_rate": round(1 - distinct / n, 4) if n else 0.0,
+        "sources": ranked(total["sources"]),
+        "system_prompts": ranked(total["system_prompts"]),
+        "enhancers": ranked(total["enhancers"]),
+        "enhance_ms": {
+            "count": em["count"],
+            "mean": round(em["total"] / em["count"], 1) if em["count"] else None,
+            "max": em["max"] if em["count"] else None,
+            "histogram": dict(zip(labels, em["buckets"])),
+        },
+        "per_day": dict(sorted(total["days"].items())),
+        "per_hour": total["hours"],
+        "worlds": worlds,
+    }
+
+
+def write_csv(report, out_dir):
+    os.makedirs(out_dir, exist_ok=True)
+    with open(os.path.join(out_dir, "worlds.csv"), "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(["world", "entries", "distinct_prompts", "duplicate_rate", "matched_entries"])
+        for world, row in report["worlds"].items():
+            w.writerow([world, row["entries"], row["distinct_prompts"], row["duplicate_rate"], row["matched_entries"]])
+    with open(os.path.join(out_dir, "values.csv"), "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(["world", "key", "value", "count"])
+        for world, row in report["worlds"].items():
+            for key, values in row["values"].items():
+                for value, count in values.items():
+                    w.writerow([world, key, value, count])
+    with open(os.path.join(out_dir, "per_day.csv"), "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(["day", "entries"])
+        w.writerows(report["per_day"].items())
+    with open(os.path.join(out_dir, "totals.csv"), "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(["group", "name", "entries"])
+        for group in ("sources", "system_prompts", "enhancers"):
+            for name, count in report[group].items():
+                w.writerow([group, name, count])
+        for label, count in report["enhance_ms"]["histogram"].items():
+            w.writerow(["enhance_ms", label, count])
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--base", default=HERE, help="node folder holding logs/ and JSON_DATA/")
+    ap.add_argument("--out", default=None, help="JSON report path (default: print to stdout)")
+    ap.add_argument("--csv", default=None, help="also write CSV tables to this folder")
+    ap.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) - 1))
+    ap.add_argument("--chunk-mb", type=float, default=CHUNK_BYTES / (1 << 20))
+    ap.add_argument("--since", default=None, help="ISO date/time, inclusive")
+    ap.add_argument("--until", default=None, help="ISO date/time, exclusive")
+    args = ap.parse_args()
+
+    log = HistoryLog(args.base)
+    tasks = plan_tasks(log, args.since, args.until, int(args.chunk_mb * (1 << 20)))
+    if not tasks:
+        print(f"[HistoryStats] no history under {os.path.join(args.base, 'logs')}", file=sys.stderr)
+        return 1
+
+    t0 = time.perf_counter()
+    total = _new_partial()
+    jobs = [(t, args.since, args.until) for t in tasks]
+    json_dir = os.path.join(args.base, "JSON_DATA")
+    if args.workers > 1 and len(tasks) > 1:
+        with Pool(args.workers, initializer=_init_worker, initargs=(json_dir,)) as pool:
+            for part in pool.imap_unordered(scan_task, jobs):
+                merge(total, part)
+    else:
+        _init_worker(json_dir)
+        for job in jobs:
+            merge(total, scan_task(job))
+    report = build_report(total, time.perf_counter() - t0, tasks)
+
+    text = json.dumps(report, indent=1, ensure_ascii=False)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+        print(f"[HistoryStats] {report['entries']} entries in {report['scan']['seconds']} s -> {args.out}", file=sys.stderr)
+    else:
+        print(text)
+    if args.csv:
+        write_csv(report, args.csv)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
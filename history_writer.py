@@ -0,0 +1,233 @@
+import os
+import json
+import time
+import queue
+import atexit
+import threading
+from contextlib import contextmanager
+
+try:
+    from .enhancer_telemetry import register_snapshot
+except ImportError:
+    from enhancer_telemetry import register_snapshot
+
+try:
+    import fcntl
+except ImportError:   # Windows
+    fcntl = None
+    import msvcrt
+
+
+# =========================
+# 📝 BUFFERED HISTORY WRITER
+# =========================
+# Every run appends one line to logs/prompt_history.jsonl. On a network
+# filesystem that small-file I/O is paid in every execution, so the nodes
+# hand it to this process-wide writer instead:
+#   - appends are batched: one open + lock + write per file per batch
+#   - flushed every FLUSH_INTERVAL_S, when MAX_BATCH items are waiting, and
+#     at interpreter exit
+#   - appends hold an exclusive file lock, so several ComfyUI processes can
+#     share one log
+# Readers in this process call flush() first to see the lines still queued.
+
+MAX_QUEUE = 2048
+MAX_BATCH = 256
+FLUSH_INTERVAL_S = 1.0
+PUT_TIMEOUT_S = 2.0
+LOCK_RETRY_S = 0.05      # Windows: poll interval while another process holds the lock
+
+
+@contextmanager
+def locked(f, blocking=True):
+    """
+    Exclusive lock on an open file, across processes. Yields True once held;
+    with blocking=False it yields False right away if another holder has it.
+    """
+    if fcntl is not None:
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        # msvcrt locks a byte range: every writer locks the first byte
+        # LK_LOCK gives up (OSError) after ~10 s: poll until acquired, like flock
+        while True:
+            f.seek(0)
+            try:
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+                break
+            except OSError:
+                if not blocking:
+                    f.seek(pos)
+                    yield False
+                    return
+                time.sleep(LOCK_RETRY_S)
+        try:
+            f.seek(pos)
+            yield True
+        finally:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def append_lines(path, lines, after=None):
+    """
+    Appends lines (already newline-terminated) under the file lock, then
+    calls after(path, size) once the file is unlocked and closed: the hook
+    may rename it (Windows refuses to while a handle is open).
+    """
+    while True:
+        with open(path, "a", encoding="utf-8") as f:
+            with locked(f):
+                try:
+                    moved = os.stat(path).st_ino != os.fstat(f.fileno()).st_ino
+                except FileNotFoundError:
+                    moved = True
+                if moved:
+                    # rotated away by another process while we waited: reopen
+                    continue
+                f.write("".join(lines))
+                f.flush()
+                size = f.tell()
+        if after is not None:
+            after(path, size)
+        return
+
+
+def replace_text(path, text):
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+class HistoryWriter:
+
+    def __init__(self):
+        self.queue = queue.Queue(maxsize=MAX_QUEUE)
+        self.lock = threading.Lock()
+        self.dirs = set()
+        self.after_append = {}    # path -> hook(path, size), see append_lines
+        self.thread = None
+        self.closed = False
+        self.counters = {
+            "queued": 0, "batches": 0, "lines": 0, "max_batch": 0, "sync_writes": 0, "errors": 0,
+        }
+
+    def _start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name="pcn-history-writer", daemon=True)
+                self.thread.start()
+
+    def _put(self, item):
+        if self.closed:
+            self._write_batch([item])
+            return
+        self._start()
+        try:
+            self.queue.put(item, timeout=PUT_TIMEOUT_S)
+        except queue.Full:
+            # the disk can't keep up: write this one ourselves
+            with self.lock:
+                self.counters["sync_writes"] += 1
+            self._write_batch([item])
+            return
+        with self.lock:
+            self.counters["queued"] += 1
+
+    # ---------- API ----------
+    def append_jsonl(self, path, entry):
+        self._put(("append", path, json.dumps(entry, ensure_ascii=False) + "\n"))
+
+    def on_append(self, path, hook):
+        """hook(path, size) runs after each batch appended to path, once the file is closed again."""
+        self.after_append[path] = hook
+
+    def flush(self, timeout=10.0):
+        """Blocks until everything queued so far is on disk."""
+        if self.thread is None or not self.thread.is_alive():
+            return
+        done = threading.Event()
+        try:
+            self.queue.put(("barrier", None, done), timeout=timeout)
+        except queue.Full:
+            return
+        done.wait(timeout)
+
+    def close(self):
+        self.closed = True
+        self.flush()
+
+    # ---------- worker ----------
+    def _run(self):
+        while True:
+            try:
+                first = self.queue.get(timeout=FLUSH_INTERVAL_S)
+            except queue.Empty:
+                continue
+            # let a burst accumulate, up to one flush interval
+            batch = [first]
+            deadline = time.monotonic() + FLUSH_INTERVAL_S
+            while len(batch) < MAX_BATCH and first[0] != "barrier":
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=left)
+                except queue.Empty:
+                    break
+                batch.append(item)
+                if item[0] == "barrier":
+                    break
+            self._write_batch(batch)
+
+    def _ensure_dir(self, path):
+        d = os.path.dirname(path)
+        if d and d not in self.dirs:
+            os.makedirs(d, exist_ok=True)
+            self.dirs.add(d)
+
+    def _write_batch(self, batch):
+        appends = {}   # path -> [lines], in order
+        barriers = []
+        for kind, path, payload in batch:
+            if kind == "append":
+                appends.setdefault(path, []).append(payload)
+            else:
+                barriers.append(payload)
+
+        try:
+            for path, lines in appends.items():
+                self._ensure_dir(path)
+                append_lines(path, lines, self.after_append.get(path))
+        except Exception as e:
+            with self.lock:
+                self.counters["errors"] += 1
+            print(f"[HistoryWriter] write failed: {e}")
+        finally:
+            with self.lock:
+                self.counters["batches"] += 1
+                self.counters["lines"] += sum(len(v) for v in appends.values())
+                self.counters["max_batch"] = max(self.counters["max_batch"], len(batch))
+            for done in barriers:
+                done.set()
+
+    def snapshot(self):
+        with self.lock:
+            out = dict(self.counters)
+        out["backlog"] = self.queue.qsize()
+        return out
+
+
+history_writer = HistoryWriter()
+atexit.register(history_writer.close)
+register_snapshot("history_writer", history_writer.snapshot)
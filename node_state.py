@@ -0,0 +1,199 @@
+import os
+import time
+import atexit
+import sqlite3
+import threading
+
+try:
+    from .enhancer_telemetry import register_snapshot
+except ImportError:
+    from enhancer_telemetry import register_snapshot
+
+
+# =========================
+# 🔐 NODE STATE STORE
+# =========================
+# lock_last_prompt and pose_mode="lock" used to keep one text file per world
+# under history/ (last_prompt_<world>.txt, last_pose_<world>.txt): hundreds
+# of tiny files, raced on by concurrent workers. That state now lives in one
+# SQLite database, logs/node_state.db (WAL), as (kind, world) -> value rows:
+#   - reads are served from memory; the cache is dropped as soon as another
+#     process commits (PRAGMA data_version), so workers see each other's locks
+#   - writes are coalesced in memory (newest value per key) and committed by a
+#     background thread in one transaction per FLUSH_INTERVAL_S (and at exit):
+#     a crash loses at most that interval, never half a value
+#   - a key missing from the database is looked up once in the old history/
+#     files and moved in; once committed the file is renamed to *.migrated
+#     (kept as a backup, and never read again)
+# kind is free-form: last_prompt, last_pose, or any per-world cursor a node
+# wants to keep across runs.
+
+FLUSH_INTERVAL_S = 0.5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS state (
+    kind    TEXT NOT NULL,          -- last_prompt / last_pose / ...
+    world   TEXT NOT NULL,          -- world JSON file name ('' for global values)
+    value   TEXT NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (kind, world)
+);
+"""
+
+
+class NodeState:
+
+    def __init__(self, path=None, legacy_dir=None):
+        base_path = os.path.dirname(__file__)
+        self.path = path or os.path.join(base_path, "logs", "node_state.db")
+        self.legacy_dir = legacy_dir or os.path.join(base_path, "history")
+        self.lock = threading.Lock()     # guards the connection, the cache and pending writes
+        self.conn = None
+        self.data_version = None
+        self.cache = {}                  # (kind, world) -> value, None = not set
+        self.pending = {}                # (kind, world) -> value not committed yet
+        self.migrated = {}               # (kind, world) -> legacy file to rename once committed
+        self.wake = threading.Event()
+        self.thread = None
+        self.counters = {
+            "reads": 0, "cache_hits": 0, "db_reads": 0, "writes": 0, "coalesced": 0,
+            "batches": 0, "rows_written": 0, "invalidations": 0, "migrated": 0, "errors": 0,
+        }
+
+    def _db(self):
+        """The store's connection (one, shared under self.lock). Call with self.lock held."""
+        if self.conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self.conn = conn
+        return self.conn
+
+    def _check_version(self, db):
+        # changes when another connection (another process) committed
+        version = db.execute("PRAGMA data_version").fetchone()[0]
+        if version != self.data_version:
+            if self.data_version is not None and self.cache:
+                self.cache.clear()
+                self.counters["invalidations"] += 1
+            self.data_version = version
+
+    def _legacy(self, kind, world):
+        if not world:
+            return None, None
+        path = os.path.join(self.legacy_dir, f"{kind}_{world}.txt")
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return f.read(), path
+        except OSError:
+            return None, None
+
+    # ---------- API ----------
+    def get(self, kind, world=""):
+        """Newest value of (kind, world), from any process; None if never set."""
+        key = (kind, world)
+        with self.lock:
+            self.counters["reads"] += 1
+            if key in self.pending:
+                self.counters["cache_hits"] += 1
+                return self.pending[key]
+            db = self._db()
+            self._check_version(db)
+            if key in self.cache:
+                self.counters["cache_hits"] += 1
+                return self.cache[key]
+            self.counters["db_reads"] += 1
+            row = db.execute("SELECT value FROM state WHERE kind = ? AND world = ?", key).fetchone()
+            value = row[0] if row else None
+            if row is None:
+                value, legacy_path = self._legacy(kind, world)
+                if value is not None:
+                    self.pending[key] = value
+                    self.migrated[key] = legacy_path
+                    self.counters["migrated"] += 1
+            self.cache[key] = value
+        if key in self.migrated:
+            self._start()
+            self.wake.set()
+        return value
+
+    def set(self, kind, world, value):
+        key = (kind, world)
+        value = str(value)
+        with self.lock:
+            if key in self.pending:
+                self.counters["coalesced"] += 1
+            self.pending[key] = value
+            self.cache[key] = value
+            self.counters["writes"] += 1
+        self._start()
+        self.wake.set()
+
+    def flush(self):
+        """Commits the pending writes now, in one transaction. Returns the rows written."""
+        with self.lock:
+            if not self.pending:
+                return 0
+            batch = dict(self.pending)
+            now = time.time()
+            try:
+                db = self._db()
+                with db:
+                    db.execute("BEGIN IMMEDIATE")
+                    db.executemany(
+                        "INSERT OR REPLACE INTO state (kind, world, value, updated) VALUES (?, ?, ?, ?)",
+                        [(kind, world, value, now) for (kind, world), value in batch.items()],
+                    )
+            except sqlite3.Error as e:
+                # kept pending: retried with the next batch
+                self.counters["errors"] += 1
+                print(f"[NodeState] write failed: {e}")
+                return 0
+            # our own commits don't change data_version: the cache stays
+            self.pending.clear()
+            self.counters["batches"] += 1
+            self.counters["rows_written"] += len(batch)
+            legacy = [self.migrated.pop(key) for key in batch if key in self.migrated]
+        for path in legacy:
+            try:
+                os.replace(path, path + ".migrated")
+            except OSError:
+                pass
+        return len(batch)
+
+    def close(self):
+        self.flush()
+
+    # ---------- worker ----------
+    def _start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name="pcn-node-state", daemon=True)
+                self.thread.start()
+
+    def _run(self):
+        while True:
+            self.wake.wait()
+            # let the writes of a run (prompt, pose, ...) accumulate
+            time.sleep(FLUSH_INTERVAL_S)
+            self.wake.clear()
+            self.flush()
+
+    def snapshot(self):
+        with self.lock:
+            out = dict(self.counters)
+            out["pending"] = len(self.pending)
+            out["cached"] = len(self.cache)
+            if os.path.exists(self.path):
+                try:
+                    out["rows"] = self._db().execute("SELECT COUNT(*) FROM state").fetchone()[0]
+                except sqlite3.Error as e:
+                    out["error"] = str(e)
+        return out
+
+
+node_state = NodeState()
+atexit.register(node_state.close)
+register_snapshot("node_state", node_state.snapshot, costly=True)
@@ -0,0 +1,413 @@
+"""
+Local stub LLM server for benchmarks and regression tests.
+
+Speaks just enough of:
+- Ollama:     POST /api/chat, POST /api/generate   (NDJSON streaming)
+- llama.cpp:  POST /completion                      (SSE streaming)
+- OpenAI:     POST /v1/chat/completions             (SSE streaming, also for OpenRouter)
+
+Latency model: fixed latency + prompt evaluation (prompt_tps, with a simple
+prefix cache when the request asks for it) + generation (tokens_per_s).
+Ollama requests also pay load_ms when their model is not among the
+max_loaded most recently used ones (reported as load_duration).
+Errors can be injected at a given rate (e.g. 429 with Retry-After).
+
+Usage:
+    python stub_llm_server.py --port 11435 --latency-ms 150 --tokens-per-s 40 --error-rate 0.05
+"""
+import re
+import json
+import time
+import random
+import argparse
+import threading
+from collections import OrderedDict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+WORDS = (
+    "cinematic portrait of a lone figure under neon rain, volumetric haze, "
+    "wet asphalt reflections, shallow depth of field, 85mm lens, rim light, "
+    "muted teal and crimson palette, film grain, baroque ornaments, velvet textures, "
+    "gothic cathedral arches, candlelight flicker, ethereal mist, dramatic shadows"
+).replace(",", "").split()
+
+
+class StubConfig:
+
+    def __init__(
+        self,
+        latency_ms=50.0,
+        tokens_per_s=200.0,
+        prompt_tps=2000.0,
+        output_tokens=180,
+        error_rate=0.0,
+        error_status=429,
+        retry_after=1,
+        seed=None,
+        load_ms=0.0,
+        max_loaded=1,
+    ):
+        self.latency_ms = float(latency_ms)
+        self.tokens_per_s = float(tokens_per_s)
+        self.prompt_tps = float(prompt_tps)
+        self.output_tokens = int(output_tokens)
+        self.error_rate = float(error_rate)
+        self.error_status = int(error_status)
+        self.retry_after = retry_after
+        self.load_ms = float(load_ms)
+        self.max_loaded = max(1, int(max_loaded))
+        self.rng = random.Random(seed)
+
+
+class StubState:
+
+    def __init__(self, config):
+        self.config = config
+        self.lock = threading.Lock()
+        self.prefixes = set()
+        self.counters = {"requests": 0, "errors": 0, "streamed": 0, "cached_prefix_hits": 0, "loads": 0, "evictions": 0}
+        self.requests = []   # (path, payload) of the last requests, for assertions
+        self.loaded_model = None
+        self.resident = OrderedDict()   # Ollama models in memory, LRU first
+        self.load_lock = threading.Lock()   # one model load at a time, like Ollama
+
+    def count(self, key):
+        with self.lock:
+            self.counters[key] += 1
+
+
+def _tokens(text):
+    return max(1, len(text or "") // 4)
+
+
+def _split_prompt(path, payload):
+    """Returns (prefix, rest) so the stub can simulate KV prefix reuse."""
+    if "messages" in payload:
+        msgs = payload.get("messages") or []
+        prefix = "".join(m.get("content", "") for m in msgs if m.get("role") == "system")
+        rest = "".join(m.get("content", "") for m in msgs if m.get("role") != "system")
+        return prefix, rest
+    prompt = payload.get("prompt") or ""
+    system = payload.get("system") or ""
+    if system:
+        return system, prompt
+    head, sep, tail = prompt.rpartition("\n\n")
+    return (head, tail) if sep else ("", prompt)
+
+
+PACK_RE = re.compile(r"JSON array of exactly (\d+) strings")
+
+
+def _cap(payload):
+    opts = payload.get("options") or {}
+    for v in (payload.get("n_predict"), payload.get("max_tokens"), opts.get("num_predict")):
+        if isinstance(v, int) and v > 0:
+            return v
+    return None
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state = None  # set by make_server
+
+    def log_message(self, *args):
+        pass
+
+    # ---------- plumbing ----------
+    def _read_json(self):
+        n = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(n) if n else b""
+        try:
+            return json.loads(raw or b"{}")
+        except ValueError:
+            return {}
+
+    def _send_json(self, status, obj, headers=None):
+        body = json.dumps(obj).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, str(v))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass   # client gave up (timeout / cancelled)
+
+    def _start_stream(self, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _chunk(self, data):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _end_stream(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    # ---------- simulation ----------
+    def _load_model(self, payload):
+        """Seconds spent loading the Ollama model of this request (0 if resident)."""
+        st = self.state
+        model = payload.get("model") or "stub"
+        with st.load_lock:
+            with st.lock:
+                if model in st.resident:
+                    st.resident.move_to_end(model)
+                    return 0.0
+                st.resident[model] = None
+                st.counters["loads"] += 1
+                while len(st.resident) > st.config.max_loaded:
+                    st.resident.popitem(last=False)
+                    st.counters["evictions"] += 1
+            load_s = st.config.load_ms / 1000.0
+            time.sleep(load_s)
+        return load_s
+
+    def _simulate(self, path, payload):
+        st = self.state
+        cfg = st.config
+        prefix, rest = _split_prompt(path, payload)
+        wants_cache = bool(payload.get("cache_prompt") or payload.get("keep_alive") or "messages" in payload)
+
+        with st.lock:
+            st.counters["requests"] += 1
+            st.requests.append((path, payload))
+            del st.requests[:-200]
+            cached = bool(prefix) and wants_cache and prefix in st.prefixes
+            if prefix:
+                st.prefixes.add(prefix)
+            if cached:
+                st.counters["cached_prefix_hits"] += 1
+            st.loaded_model = payload.get("model") or st.loaded_model
+
+        prompt_tokens = _tokens(rest) + (0 if cached else _tokens(prefix))
+        cached_tokens = _tokens(prefix) if cached else 0
+        # packed request (see enhancer_packing): answer with a JSON array
+        m = PACK_RE.search(rest)
+        items = int(m.group(1)) if m else 1
+        n_out = cfg.output_tokens * items
+        cap = _cap(payload)
+        if cap:
+            n_out = min(n_out, cap)
+        words = [WORDS[i % len(WORDS)] for i in range(n_out)]
+        if m:
+            per = max(1, n_out // items)
+            text = json.dumps([" ".join(words[i * per:(i + 1) * per]) for i in range(items)])
+            # same number of streamed pieces as tokens
+            size = max(1, -(-len(text) // n_out))
+            pieces = [text[i:i + size] for i in range(0, len(text), size)]
+        else:
+            text = " ".join(words)
+            pieces = [w if i == 0 else " " + w for i, w in enumerate(words)]
+        return {
+            "prompt_tokens": prompt_tokens,
+            "cached_tokens": cached_tokens,
+            "prompt_s": prompt_tokens / cfg.prompt_tps if cfg.prompt_tps > 0 else 0.0,
+            "token_s": 1.0 / cfg.tokens_per_s if cfg.tokens_per_s > 0 else 0.0,
+            "words": words,
+            "text": text,
+            "pieces": pieces,
+        }
+
+    def _maybe_error(self):
+        cfg = self.state.config
+        if cfg.error_rate > 0 and cfg.rng.random() < cfg.error_rate:
+            self.state.count("errors")
+            headers = {}
+            if cfg.error_status == 429 and cfg.retry_after is not None:
+                headers["Retry-After"] = cfg.retry_after
+            self._send_json(cfg.error_status, {"error": "injected error"}, headers)
+            return True
+        return False
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            model = self.state.loaded_model or "stub"
+            return self._send_json(200, {"models": [{"name": model, "model": model}]})
+        if self.path == "/api/ps":
+            with self.state.lock:
+                models = list(self.state.resident)
+            return self._send_json(200, {"models": [{"name": m, "model": m} for m in models]})
+        if self.path in ("/health", "/"):
+            return self._send_json(200, {"status": "ok", **self.state.counters})
+        self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        payload = self._read_json()
+        if self.path not in ("/api/chat", "/api/generate", "/completion", "/v1/chat/completions"):
+            return self._send_json(404, {"error": "not found"})
+
+        time.sleep(self.state.config.latency_ms / 1000.0)
+        if self._maybe_error():
+            return
+
+        load_s = self._load_model(payload) if self.path.startswith("/api/") else 0.0
+        if self.path == "/api/generate" and not payload.get("prompt"):
+            # Ollama's "load the model" request
+            return self._send_json(200, {
+                "model": payload.get("model") or "stub", "response": "", "done": True,
+                "done_reason": "load", "load_duration": int(load_s * 1e9),
+            })
+
+        sim = self._simulate(self.path, payload)
+        sim["load_s"] = load_s
+        time.sleep(sim["prompt_s"])
+
+        # Ollama defaults to streaming when "stream" is omitted
+        stream = payload.get("stream", self.path.startswith("/api/"))
+        if stream:
+            self.state.count("streamed")
+            return self._stream(payload, sim)
+
+        t0 = time.perf_counter()
+        time.sleep(sim["token_s"] * len(sim["words"]))
+        self._send_json(200, self._final_body(payload, sim, sim["text"], time.perf_counter() - t0))
+
+    def _final_body(self, payload, sim, text, gen_s):
+        n_out = len(sim["words"])
+        model = payload.get("model") or "stub"
+        if self.path == "/api/chat" or self.path == "/api/generate":
+            body = {
+                "model": model,
+                "done": True,
+                "total_duration": int((sim["prompt_s"] + gen_s) * 1e9),
+                "load_duration": int(sim.get("load_s", 0.0) * 1e9),
+                "prompt_eval_count": sim["prompt_tokens"],
+                "prompt_eval_duration": int(sim["prompt_s"] * 1e9),
+                "eval_count": n_out,
+                "eval_duration": int(gen_s * 1e9),
+            }
+            if self.path == "/api/chat":
+                body["message"] = {"role": "assistant", "content": text}
+            else:
+                body["response"] = text
+            return body
+
+        timings = {
+            "prompt_n": sim["prompt_tokens"],
+            "prompt_ms": sim["prompt_s"] * 1000.0,
+            "predicted_n": n_out,
+            "predicted_ms": gen_s * 1000.0,
+            "cache_n": sim["cached_tokens"],
+        }
+        if self.path == "/completion":
+            return {"content": text, "model": model, "tokens_cached": sim["cached_tokens"], "timings": timings, "stop": True}
+        return {
+            "id": "stub",
+            "object": "chat.completion",
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": {
+                "prompt_tokens": sim["prompt_tokens"] + sim["cached_tokens"],
+                "completion_tokens": n_out,
+                "total_tokens": sim["prompt_tokens"] + sim["cached_tokens"] + n_out,
+            },
+            "timings": timings,
+        }
+
+    def _stream(self, payload, sim):
+        ndjson = self.path.startswith("/api/")
+        self._start_stream("application/x-ndjson" if ndjson else "text/event-stream")
+        t0 = time.perf_counter()
+        try:
+            for piece in sim["pieces"]:
+                time.sleep(sim["token_s"])
+                if self.path == "/api/chat":
+                    ev = {"message": {"role": "assistant", "content": piece}, "done": False}
+                elif self.path == "/api/generate":
+                    ev = {"response": piece, "done": False}
+                elif self.path == "/completion":
+                    ev = {"content": piece, "stop": False}
+                else:
+                    ev = {"choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]}
+                self._chunk(json.dumps(ev) + "\n" if ndjson else f"data: {json.dumps(ev)}\n\n")
+
+            final = self._final_body(payload, sim, "", time.perf_counter() - t0)
+            if self.path == "/api/chat":
+                final["message"] = {"role": "assistant", "content": ""}
+            if ndjson:
+                self._chunk(json.dumps(final) + "\n")
+            elif self.path == "/completion":
+                final["stop"] = True
+                self._chunk(f"data: {json.dumps(final)}\n\n")
+            else:
+                final = {"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "usage": final["usage"], "timings": final["timings"]}
+                self._chunk(f"data: {json.dumps(final)}\n\n")
+                self._chunk("data: [DONE]\n\n")
+            self._end_stream()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+class StubServer:
+    """In-process stub: with StubServer(StubConfig(...)) as srv: srv.url ..."""
+
+    def __init__(self, config=None, host="127.0.0.1", port=0):
+        self.state = StubState(config or StubConfig())
+        handler = type("BoundStubHandler", (StubHandler,), {"state": self.state})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Stub Ollama / llama.cpp / OpenAI-compatible server")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=11435)
+    ap.add_argument("--latency-ms", type=float, default=50.0)
+    ap.add_argument("--tokens-per-s", type=float, default=200.0)
+    ap.add_argument("--prompt-tps", type=float, default=2000.0, help="prompt evaluation speed (tokens/s)")
+    ap.add_argument("--output-tokens", type=int, default=180)
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    ap.add_argument("--error-status", type=int, default=429)
+    ap.add_argument("--retry-after", type=int, default=1)
+    ap.add_argument("--seed", type=int, default=None)
+    ap.add_argument("--load-ms", type=float, default=0.0, help="Ollama model load time when not resident")
+    ap.add_argument("--max-loaded", type=int, default=1, help="Ollama models kept in memory")
+    a = ap.parse_args()
+
+    cfg = StubConfig(
+        latency_ms=a.latency_ms, tokens_per_s=a.tokens_per_s, prompt_tps=a.prompt_tps,
+        output_tokens=a.output_tokens, error_rate=a.error_rate, error_status=a.error_status,
+        retry_after=a.retry_after, seed=a.seed, load_ms=a.load_ms, max_loaded=a.max_loaded,
+    )
+    srv = StubServer(cfg, a.host, a.port)
+    print(f"[StubLLM] listening on {srv.url}")
+    try:
+        srv.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        srv.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
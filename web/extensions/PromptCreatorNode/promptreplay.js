@@ -0,0 +1,135 @@
+import { app } from "/scripts/app.js";
+import { api } from "/scripts/api.js";
+
+const EXT_NAME = "PromptCreatorNode.PromptReplaySearch";
+const ROUTE = "/prompt_creator/history";
+const PAGE_SIZE = 20;
+const DEBOUNCE_MS = 250;
+const FILTERS = [
+  ["json_filter", "world"],
+  ["source_filter", "source"],
+  ["lora_filter", "lora"],
+  ["system_filter", "system"],
+  ["text_filter", "text"]
+];
+
+function getWidget(node, name) {
+  return node.widgets?.find(w => w.name === name);
+}
+
+async function fetchPage(node, offset) {
+  const params = new URLSearchParams({ offset: String(offset), limit: String(PAGE_SIZE) });
+  for (const [widgetName, param] of FILTERS) {
+    const value = getWidget(node, widgetName)?.value;
+    if (value) params.set(param, value);
+  }
+  const res = await api.fetchApi(`${ROUTE}?${params}`, { cache: "no-store" });
+  if (!res.ok) throw new Error(`${ROUTE} failed (${res.status})`);
+  return res.json();
+}
+
+function pickedId(node) {
+  const m = /^#([0-9a-f]+)/.exec(String(getWidget(node, "pick")?.value || ""));
+  return m ? m[1] : null;
+}
+
+function buildSearchWidget(node) {
+  const root = document.createElement("div");
+  root.style.cssText = "display:flex;flex-direction:column;gap:4px;font-size:11px;width:100%;";
+
+  const search = document.createElement("input");
+  search.type = "search";
+  search.placeholder = "search prompts…";
+  search.style.cssText = "width:100%;box-sizing:border-box;";
+
+  const list = document.createElement("div");
+  list.style.cssText = "overflow-y:auto;max-height:220px;border:1px solid #444;border-radius:4px;";
+
+  const more = document.createElement("button");
+  more.textContent = "more…";
+  more.style.display = "none";
+
+  root.append(search, list, more);
+
+  const state = { offset: 0, seq: 0, timer: null };
+
+  function addRows(entries) {
+    const current = pickedId(node);
+    for (const e of entries) {
+      const row = document.createElement("div");
+      row.textContent = e.label;
+      row.title = e.preview;
+      row.style.cssText = "padding:2px 4px;cursor:pointer;white-space:nowrap;overflow:hidden;text-overflow:ellipsis;";
+      if (e.id === current) row.style.background = "#335";
+      row.onclick = () => {
+        const pick = getWidget(node, "pick");
+        if (pick) pick.value = `#${e.id} | ${e.label}`;
+        for (const r of list.children) r.style.background = "";
+        row.style.background = "#335";
+        node.setDirtyCanvas(true, true);
+      };
+      list.appendChild(row);
+    }
+  }
+
+  async function load(reset) {
+    // only the newest request may draw: answers can come back out of order
+    const seq = ++state.seq;
+    if (reset) state.offset = 0;
+    try {
+      const page = await fetchPage(node, state.offset);
+      if (seq !== state.seq) return;
+      if (reset) list.replaceChildren();
+      addRows(page.entries || []);
+      state.offset += (page.entries || []).length;
+      more.style.display = page.has_more ? "" : "none";
+      if (reset && !list.children.length) list.textContent = "(no entries match filters)";
+    } catch (err) {
+      console.warn("[PromptReplaySearch] query failed:", err);
+    }
+  }
+
+  function reload() {
+    clearTimeout(state.timer);
+    state.timer = setTimeout(() => load(true), DEBOUNCE_MS);
+  }
+
+  search.addEventListener("input", () => {
+    const text = getWidget(node, "text_filter");
+    if (text) text.value = search.value;
+    reload();
+  });
+  more.onclick = () => load(false);
+
+  node.addDOMWidget("history_search", "div", root, { serialize: false });
+
+  // refresh when a filter widget changes
+  for (const [widgetName] of FILTERS) {
+    const w = getWidget(node, widgetName);
+    if (!w) continue;
+    const origCb = w.callback;
+    w.callback = (v) => {
+      origCb?.(v);
+      if (widgetName === "text_filter") search.value = v || "";
+      reload();
+    };
+  }
+
+  search.value = getWidget(node, "text_filter")?.value || "";
+  load(true);
+}
+
+app.registerExtension({
+  name: EXT_NAME,
+
+  async beforeRegisterNodeDef(nodeType, nodeData) {
+    if (nodeData.name !== "PromptReplayNode") return;
+
+    const origCreated = nodeType.prototype.onNodeCreated;
+    nodeType.prototype.onNodeCreated = function () {
+      origCreated?.apply(this, arguments);
+      // older frontends without DOM widgets: pick stays a plain text field
+      if (typeof this.addDOMWidget === "function") buildSearchWidget(this);
+    };
+  }
+});